@@ -1,17 +1,27 @@
 import os
 import json
+import uuid
+import secrets
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from werkzeug.utils import secure_filename
-from flask import Flask, flash, request, redirect, url_for, render_template, send_from_directory, session
+from flask import Flask, Response, abort, flash, jsonify, request, redirect, url_for, render_template, send_from_directory, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, current_user, login_required, login_user, logout_user
+from sqlalchemy import text
 from sqlalchemy.orm import DeclarativeBase
 
-from document_parser import extract_text_from_file
-from date_extractor import extract_dates_from_text, extract_event_metadata, extract_structured_events
-from syllabus_extractor import extract_assessments_from_syllabus
-from calendar_generator import create_ics_file
+from document_parser import extract_text_from_file, extract_assessment_tables
+from date_extractor import (extract_dates_from_text, extract_event_metadata, extract_structured_events,
+                            STRUCTURED_EVENTS_VERSION, DATE_CANDIDATES_VERSION)
+from syllabus_extractor import (extract_segments, detect_course_code, extraction_day, EXTRACTOR_VERSION,
+                                UNDATED_TIMES)
+from syllabus_revisions import RevisionStore, extract_syllabus_revision
+from calendar_generator import (create_calendar_file, dump_events, load_events, serialize_calendar,
+                                make_event_uid)
+from calendar_cache import CalendarRenderCache
+from calendar_bundle import stream_calendar_bundle
+from extraction_cache import create_stage_memo, hash_inputs
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -42,17 +52,24 @@ login_manager.login_message_category = "info"
 
 # Import models and create tables
 with app.app_context():
-    from models import User
+    from models import User, StoredCalendar, CalendarFeed, CourseCalendar
     db.create_all()
 
 # Import and register Google Auth blueprint
-from google_auth import google_auth, add_event_to_google_calendar
+from google_auth import google_auth
 app.register_blueprint(google_auth)
 
 # Import and register Microsoft Auth blueprint
-from microsoft_auth import microsoft_auth, add_event_to_outlook_calendar
+from microsoft_auth import microsoft_auth
 app.register_blueprint(microsoft_auth)
 
+# Calendar pushes are sent from the outbox by background threads
+from calendar_outbox import OutboxWorker, diff_events, enqueue_pushes, enqueue_calendar_drop, get_batch_status
+outbox_worker = OutboxWorker(app)
+
+# Provider reachability is probed in the background and read from a cache
+from provider_health import prober
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -61,11 +78,18 @@ def load_user(user_id):
 UPLOAD_FOLDER = './uploads'
 CALENDAR_FOLDER = './calendar_events'
 TEMP_FOLDER = './temp'
+REVISION_FOLDER = './revisions'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx', 'doc'}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['CALENDAR_FOLDER'] = CALENDAR_FOLDER
 app.config['TEMP_FOLDER'] = TEMP_FOLDER
+app.config['REVISION_FOLDER'] = REVISION_FOLDER
+# "memory": store the events and render calendars on demand (served from an LRU);
+# "disk": write .ics files to CALENDAR_FOLDER
+app.config['CALENDAR_STORAGE'] = os.environ.get('CALENDAR_STORAGE', 'memory')
+# Days a calendar stored without an account stays downloadable
+app.config['STORED_CALENDAR_DAYS'] = int(os.environ.get('STORED_CALENDAR_DAYS', 30))
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
 app.config['SESSION_USE_SIGNER'] = True
 app.config['SESSION_TYPE'] = 'filesystem'
@@ -75,12 +99,53 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(CALENDAR_FOLDER, exist_ok=True)
 os.makedirs(TEMP_FOLDER, exist_ok=True)
 
+# Memo of extraction results, keyed by (text hash, stage, stage version)
+extraction_memo = create_stage_memo()
+
+# Last processed version of each course, for incremental re-extraction
+revision_store = RevisionStore(REVISION_FOLDER)
+
+# Rendered calendars, keyed by a hash of the stored events
+calendar_cache = CalendarRenderCache()
+
+
+def extract_segments_memoized(jobs):
+    """Extract course segments' assessments through the stage memo, the misses together."""
+    return extraction_memo.get_or_compute_many(
+        'syllabus_assessments', EXTRACTOR_VERSION,
+        [hash_inputs(text, tables, course_code, extraction_day()) for text, tables, course_code in jobs],
+        lambda missing: extract_segments([jobs[index] for index in missing]))
+
+
+def get_revision_owner():
+    """Key the current user's (or anonymous browser's) previous outlines are stored under."""
+    if current_user.is_authenticated:
+        return f"user_{current_user.id}"
+    if 'revision_owner' not in session:
+        session['revision_owner'] = secrets.token_urlsafe(12)
+    return f"session_{session['revision_owner']}"
+
+
+def get_event_uid(session_event):
+    """Stable UID of an event of the preview (see calendar_generator.make_event_uid)."""
+    if session_event.get('undated'):
+        return make_event_uid(session_event.get('course'), session_event['title'], None)
+    date_obj = datetime.strptime(session_event['date_obj_str'], '%Y-%m-%dT%H:%M:%S')
+    return make_event_uid(session_event.get('course'), session_event['title'], date_obj)
+
 
 def allowed_file(filename):
     """Check if a file has an allowed extension."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+@app.before_request
+def start_outbox_worker():
+    """Make sure this process drains the outbox and probes providers (once per process)."""
+    outbox_worker.ensure_started()
+    prober.ensure_started()
+
+
 @app.route('/')
 def index():
     """Render index page with file upload form."""
@@ -105,27 +170,16 @@ def check_google_setup():
     # Get current redirect URL
     from google_auth import DEV_REDIRECT_URL
     
-    # Test connectivity to Google services
-    google_connectivity = "Unknown"
-    google_error = None
-    try:
-        import requests
-        response = requests.get("https://accounts.google.com/.well-known/openid-configuration", timeout=5)
-        if response.status_code == 200:
-            google_connectivity = "Connected"
-        else:
-            google_connectivity = "Failed"
-            google_error = f"Received status code {response.status_code} from Google"
-    except Exception as e:
-        google_connectivity = "Failed"
-        google_error = str(e)
+    # Connectivity to Google services, as last probed in the background
+    google_status = prober.status('Google')
     
     setup_info = {
         "client_id_status": "Set" if client_id != "Not set" else "Not set",
         "client_secret_status": client_secret_status,
         "redirect_url": DEV_REDIRECT_URL,
-        "google_connectivity": google_connectivity,
-        "google_error": google_error
+        "google_connectivity": google_status['connectivity'],
+        "google_error": google_status['error'],
+        "checked_ago": google_status['checked_ago']
     }
     
     # Get the theme preference from cookies, default to dark
@@ -142,27 +196,16 @@ def check_microsoft_setup():
     # Get current domain for redirect URL
     redirect_uri = f"https://{os.environ.get('REPLIT_DEV_DOMAIN', 'localhost')}/microsoft_login/callback"
     
-    # Test connectivity to Microsoft services
-    ms_connectivity = "Unknown"
-    ms_error = None
-    try:
-        import requests
-        response = requests.get("https://login.microsoftonline.com/common/v2.0/.well-known/openid-configuration", timeout=5)
-        if response.status_code == 200:
-            ms_connectivity = "Connected"
-        else:
-            ms_connectivity = "Failed"
-            ms_error = f"Received status code {response.status_code} from Microsoft"
-    except Exception as e:
-        ms_connectivity = "Failed"
-        ms_error = str(e)
+    # Connectivity to Microsoft services, as last probed in the background
+    ms_status = prober.status('Microsoft')
     
     setup_info = {
         "client_id_status": "Set" if client_id != "Not set" else "Not set",
         "client_secret_status": client_secret_status,
         "redirect_url": redirect_uri,
-        "ms_connectivity": ms_connectivity,
-        "ms_error": ms_error
+        "ms_connectivity": ms_status['connectivity'],
+        "ms_error": ms_status['error'],
+        "checked_ago": ms_status['checked_ago']
     }
     
     # Get the theme preference from cookies, default to dark
@@ -170,6 +213,27 @@ def check_microsoft_setup():
     return render_template('check_microsoft_setup.html', setup_info=setup_info, theme=theme)
 
 
+@app.route('/health/ready')
+def readiness():
+    """
+    Readiness check for the load balancer.
+
+    The instance is ready when its database answers. Provider reachability
+    is reported from the background prober's cache but does not affect
+    readiness, since every instance would fail it alike.
+    """
+    try:
+        db.session.execute(text('SELECT 1'))
+        database_ok = True
+    except Exception as e:
+        logger.error(f"Readiness check failed: {e}")
+        database_ok = False
+    finally:
+        db.session.rollback()
+    body = {'ready': database_ok, 'database': database_ok, 'providers': prober.snapshot()}
+    return jsonify(body), 200 if database_ok else 503
+
+
 @app.route('/microsoft-setup-detail')
 def microsoft_setup_detail():
     """Display detailed Microsoft OAuth setup instructions."""
@@ -388,11 +452,29 @@ def upload_file():
             # Extract text from file
             document_text = extract_text_from_file(file_path)
             
-            # First try specialized syllabus assessment extractor for academic syllabi
-            syllabus_events = extract_assessments_from_syllabus(document_text)
+            # Rebuild the assessment table (component / weight / due date) if there is one
+            assessment_tables = extract_assessment_tables(file_path)
+            
+            # First try specialized syllabus assessment extractor for academic syllabi;
+            # a revised outline only has its changed paragraphs re-extracted
+            syllabus_events, delta = extract_syllabus_revision(
+                document_text, assessment_tables, revision_store, get_revision_owner(),
+                extract=extract_segments_memoized)
+            if (delta['changed'] or delta['removed']) or 0 < len(delta['added']) < len(syllabus_events):
+                flash(f"Revised outline: {len(delta['added'])} added, {len(delta['changed'])} changed, "
+                      f"{len(delta['removed'])} removed", 'info')
             
             # If syllabus-specific assessments found, use those
-            structured_events = syllabus_events if syllabus_events else extract_structured_events(document_text)
+            if syllabus_events:
+                structured_events = syllabus_events
+            else:
+                structured_events = extraction_memo.get_or_compute(
+                    'structured_events', STRUCTURED_EVENTS_VERSION, hash_inputs(document_text, extraction_day()),
+                    lambda: extract_structured_events(document_text))
+            
+            # A course pack holds several outlines; label each event with its course
+            courses = {event['course'] for event in structured_events if event.get('course')}
+            document_course = detect_course_code(document_text)
             
             # Process events for display
             events_preview = []
@@ -439,16 +521,25 @@ def upload_file():
                     'date_obj_str': date_obj.isoformat(),  # Convert to string for storage
                     'date_formatted': date_formatted,
                     'confidence': 0.9,  # Higher default confidence for structured events
-                    'title': event['title'],
+                    'title': f"{event['course']}: {event['title']}" if len(courses) > 1 else event['title'],
+                    'course': event.get('course') or document_course,
                     'full_description': "",  # Empty description as requested
-                    'description': ""  # Empty description as requested
+                    'description': "",  # Empty description as requested
+                    # Ongoing items are dated the day they are extracted
+                    'undated': event.get('time') in UNDATED_TIMES
                 }
                 
+                # Recurring work (e.g. weekly assignments) stays a single event
+                if event.get('recurrence'):
+                    event_info['recurrence'] = event['recurrence']
+                
                 events_preview.append(event_info)
             
             if not events_preview:
                 # If no structured events were found, fall back to the original method
-                date_results = extract_dates_from_text(document_text)
+                date_results = extraction_memo.get_or_compute(
+                    'date_candidates', DATE_CANDIDATES_VERSION, hash_inputs(document_text, extraction_day()),
+                    lambda: extract_dates_from_text(document_text))
                 
                 # Process dates without filtering by confidence
                 for idx, (date_str, date_obj, confidence) in enumerate(date_results):
@@ -468,6 +559,7 @@ def upload_file():
                         'date_formatted': date_formatted,
                         'confidence': confidence,
                         'title': title or f"Event on {date_obj.strftime('%Y-%m-%d')}",
+                        'course': document_course,
                         'full_description': description,
                         'description': document_text[max(0, pos - 100):min(len(document_text), pos + 100)]
                     }
@@ -484,7 +576,8 @@ def upload_file():
             # Store the data in a temporary file instead of in the session
             data = {
                 'events_preview': events_preview,
-                'document_text': document_text
+                'document_text': document_text,
+                'filename': filename
             }
             
             temp_file_path = os.path.join(app.config['TEMP_FOLDER'], f"{session_id}.json")
@@ -528,6 +621,7 @@ def generate_calendar():
         
         session_events = data.get('events_preview', [])
         document_text = data.get('document_text', '')
+        source_filename = data.get('filename', '')
     except Exception as e:
         logger.error(f"Failed to load session data: {e}")
         flash('Failed to load session data. Please try again.', 'error')
@@ -541,9 +635,12 @@ def generate_calendar():
         return redirect(url_for('index'))
     
     created_files = []
+    calendar_events = []
     calendar_results = []
     add_to_google = request.form.get('add_to_google_calendar') == 'yes'
     add_to_outlook = request.form.get('add_to_outlook_calendar') == 'yes'
+    course_calendars = request.form.get('course_calendars') == 'yes'
+    replace_course_calendars = course_calendars and request.form.get('replace_course_calendars') == 'yes'
     
     for event_id in selected_events:
         for session_event in session_events:
@@ -574,60 +671,337 @@ def generate_calendar():
                         'title': custom_title,
                         'description': custom_description
                     }
+                    if session_event.get('recurrence'):
+                        event_data['recurrence'] = session_event['recurrence']
                     
-                    # Create ICS file
-                    filepath = create_ics_file(event_data, app.config['CALENDAR_FOLDER'])
-                    created_files.append(os.path.basename(filepath))
+                    # The same assessment from a re-upload keeps its UID, so it
+                    # updates the event in calendars instead of adding a copy
+                    event_data['uid'] = get_event_uid(session_event)
+                    event_data['course'] = session_event.get('course')
                     
-                    # If user is logged in with Google and requested to add to Google Calendar
-                    if add_to_google and current_user.is_authenticated and current_user.google_token:
-                        success, message = add_event_to_google_calendar(event_data)
-                        calendar_results.append({
-                            'title': custom_title,
-                            'success': success,
-                            'message': message,
-                            'calendar': 'Google'
-                        })
-                    
-                    # If user is logged in with Microsoft and requested to add to Outlook Calendar
-                    if add_to_outlook and current_user.is_authenticated and current_user.microsoft_token:
-                        success, message = add_event_to_outlook_calendar(event_data)
-                        calendar_results.append({
-                            'title': custom_title,
-                            'success': success,
-                            'message': message,
-                            'calendar': 'Outlook'
-                        })
+                    # Collected into a single ICS file below
+                    calendar_events.append(event_data)
                 
                 except Exception as e:
                     logger.error(f"Failed to create calendar event: {e}")
                     flash(f'Failed to create event: {str(e)}', 'error')
     
+    # Sync the events to the connected calendars the user asked for: only new
+    # and changed events are pushed, events of these courses that are no
+    # longer extracted are removed (not those merely deselected), and events
+    # the user has changed in their calendar are left alone. Replacing course
+    # calendars instead drops each course's calendar with everything in it
+    # and adds the events afresh
+    extracted = [{'uid': get_event_uid(session_event), 'course': session_event.get('course')}
+                 for session_event in session_events]
+    pending_pushes = {}
+    signed_in = current_user.is_authenticated
+    for calendar, requested, connected in (
+            ('Google', add_to_google, signed_in and current_user.google_token),
+            ('Outlook', add_to_outlook, signed_in and current_user.microsoft_token)):
+        if not (requested and connected and calendar_events):
+            continue
+        
+        replaced = set()
+        if replace_course_calendars:
+            replaced = {course_calendar.course for course_calendar in CourseCalendar.query.filter_by(
+                user_id=current_user.id, calendar=calendar)}
+            replaced &= {event_data['course'] for event_data in calendar_events}
+        kept = [event_data for event_data in calendar_events if event_data['course'] not in replaced]
+        changed, skipped, removed = diff_events(
+            current_user, calendar, kept, [event for event in extracted if event['course'] not in replaced])
+        changed += [event_data for event_data in calendar_events if event_data['course'] in replaced]
+        for event_data, result in skipped:
+            calendar_results.append({
+                'title': event_data['title'],
+                'success': result['success'],
+                'message': result['message'],
+                'calendar': calendar
+            })
+        if changed or removed or replaced:
+            pending_pushes[calendar] = (changed, removed, replaced)
+    
+    # Queued events go to the outbox; the background worker sends them and
+    # the download page polls their status
+    push_status_url = None
+    if pending_pushes:
+        try:
+            batch = secrets.token_urlsafe(12)
+            for calendar, (changed, removed, replaced) in pending_pushes.items():
+                # Drops are queued first, so they are sent before the events
+                for course in sorted(replaced):
+                    enqueue_calendar_drop(current_user, batch, calendar, course)
+                enqueue_pushes(current_user, batch, calendar, changed, removed, course_calendars)
+            db.session.commit()
+            outbox_worker.notify()
+            push_status_url = url_for('push_status', batch=batch)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to queue calendar pushes: {e}")
+            flash(f'Failed to send events to your calendars: {str(e)}', 'error')
+    
+    # Write all selected events to one ICS file
+    if calendar_events:
+        try:
+            calendar_name = os.path.splitext(source_filename)[0] or None
+            if app.config['CALENDAR_STORAGE'] == 'memory':
+                created_files.append(store_calendar(calendar_events, calendar_name))
+            else:
+                if current_user.is_authenticated:
+                    # The user's subscription feed is built from stored calendars
+                    store_calendar(calendar_events, calendar_name)
+                # Keep each user's (or anonymous session's) files in their own folder
+                shard = f"user_{current_user.id}" if current_user.is_authenticated else f"session_{session_id}"
+                filepath = create_calendar_file(calendar_events, app.config['CALENDAR_FOLDER'], calendar_name, shard)
+                relative_path = os.path.relpath(filepath, app.config['CALENDAR_FOLDER']).replace(os.sep, '/')
+                created_files.append({
+                    'name': os.path.basename(filepath),
+                    'url': url_for('download_file', filename=relative_path)
+                })
+        except Exception as e:
+            logger.error(f"Failed to create calendar file: {e}")
+            flash(f'Failed to create calendar file: {str(e)}', 'error')
+    
     # Clean up - remove temporary file
     try:
         os.remove(temp_file_path)
     except Exception as e:
         logger.warning(f"Failed to remove temporary file: {e}")
     
-    # Clear session data
+    # Clear session data, keeping the key of an anonymous browser's previous outlines
+    revision_owner = session.get('revision_owner')
     session.clear()
+    if revision_owner:
+        session['revision_owner'] = revision_owner
     
     # Determine which calendar services the user is connected to
     has_google = current_user.is_authenticated and current_user.google_token is not None
     has_outlook = current_user.is_authenticated and current_user.microsoft_token is not None
     
+    # Signed-in users can subscribe to a feed of all their calendars
+    feed_url = None
+    user_course_calendars = []
+    if current_user.is_authenticated:
+        feed = get_calendar_feed(current_user)
+        db.session.commit()
+        feed_url = url_for('calendar_feed', token=feed.token, _external=True)
+        user_course_calendars = CourseCalendar.query.filter_by(user_id=current_user.id).order_by(
+            CourseCalendar.calendar, CourseCalendar.course).all()
+    
     # Get the theme preference from cookies, default to dark
     theme = request.cookies.get('theme', 'dark')
     return render_template('download.html', 
+                          feed_url=feed_url, 
                           files=created_files, 
+                          event_count=len(calendar_events), 
                           calendar_results=calendar_results,
+                          push_status_url=push_status_url,
+                          course_calendars=user_course_calendars,
                           is_authenticated=current_user.is_authenticated,
                           has_google=has_google,
                           has_outlook=has_outlook,
                           theme=theme)
 
 
-@app.route('/download/<filename>')
+def store_calendar(events_data, name=None):
+    """
+    Store a calendar's events for on-demand rendering.
+    
+    Args:
+        events_data (list): Event data dictionaries (see calendar_generator.create_ics_file)
+        name (str): Calendar name, used for the download file name
+        
+    Returns:
+        dict: The calendar's download "name" and "url"
+    """
+    # Fixed UIDs keep the rendered calendar identical across renders
+    for event_data in events_data:
+        event_data.setdefault('uid', str(uuid.uuid4()))
+    
+    name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in (name or 'calendar'))
+    stored = StoredCalendar(
+        key=secrets.token_urlsafe(16),
+        user_id=current_user.id if current_user.is_authenticated else None,
+        name=name,
+        events=dump_events(events_data)
+    )
+    db.session.add(stored)
+    
+    # The user's feed changes with every stored calendar
+    if current_user.is_authenticated:
+        get_calendar_feed(current_user).updated_at = datetime.utcnow()
+    prune_stored_calendars(current_user if current_user.is_authenticated else None)
+    db.session.commit()
+    
+    return {
+        'name': f"{name}.ics",
+        'url': url_for('download_calendar', key=stored.key),
+        'bundle_url': url_for('download_calendar_bundle', key=stored.key)
+    }
+
+
+def get_stored_calendar_cutoff():
+    """Creation time before which calendars stored without an account have expired."""
+    return datetime.utcnow() - timedelta(days=app.config['STORED_CALENDAR_DAYS'])
+
+
+def prune_stored_calendars(user=None):
+    """
+    Delete the stored calendars no longer needed (the caller commits).
+    
+    Calendars stored without an account expire after STORED_CALENDAR_DAYS.
+    A user's calendars make up their feed, so one is only deleted once newer
+    calendars of the user hold all its events (by UID).
+    
+    Args:
+        user (User): Also prune this user's superseded calendars (optional)
+    """
+    StoredCalendar.query.filter(StoredCalendar.user_id.is_(None),
+                                StoredCalendar.created_at < get_stored_calendar_cutoff()).delete()
+    if user is None:
+        return
+    
+    newer_uids = set()
+    for stored in StoredCalendar.query.filter_by(user_id=user.id).order_by(StoredCalendar.id.desc()):
+        uids = {event_data.get('uid') for event_data in load_events(stored.events)}
+        if newer_uids and None not in uids and uids <= newer_uids:
+            db.session.delete(stored)
+        newer_uids |= uids
+
+
+def get_stored_calendar_or_404(key):
+    """Get a stored calendar by its key, or abort with 404 if it is unknown or expired."""
+    stored = StoredCalendar.query.filter_by(key=key).first_or_404()
+    if stored.user_id is None and stored.created_at < get_stored_calendar_cutoff():
+        abort(404)
+    return stored
+
+
+def get_calendar_feed(user):
+    """
+    Get a user's subscription feed, creating it on first use.
+    
+    Args:
+        user (User): The user
+        
+    Returns:
+        CalendarFeed: The feed (added to the session, not committed)
+    """
+    feed = CalendarFeed.query.filter_by(user_id=user.id).first()
+    if feed is None:
+        feed = CalendarFeed(user_id=user.id, token=secrets.token_urlsafe(24))
+        db.session.add(feed)
+    return feed
+
+
+def calendar_response(rendered, filename, last_modified=None):
+    """
+    Build the response for a rendered calendar.
+    
+    Sends a strong ETag (one per encoding), answers a matching If-None-Match
+    (or, without one, an If-Modified-Since not older than last_modified) with
+    304 and gzip-encodes larger calendars for clients that accept it.
+    
+    Args:
+        rendered (RenderedCalendar): The calendar from calendar_cache
+        filename (str): Download file name
+        last_modified (datetime): When the calendar last changed, in UTC (optional)
+        
+    Returns:
+        Response: The response
+    """
+    use_gzip = rendered.gzip_data is not None and 'gzip' in request.accept_encodings
+    etag = f"{rendered.etag}-gzip" if use_gzip else rendered.etag
+    
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        # HTTP dates have whole seconds
+        not_modified = (last_modified is not None and request.if_modified_since is not None
+                        and last_modified.replace(microsecond=0) <= request.if_modified_since)
+    
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = Response(rendered.gzip_data if use_gzip else rendered.data, mimetype='text/calendar')
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Clients may keep the calendar but must revalidate it (cheap with the ETag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/calendars/<key>.ics')
+def download_calendar(key):
+    """Serve a stored calendar, rendered on demand."""
+    stored = get_stored_calendar_or_404(key)
+    rendered = calendar_cache.get_stored(stored.events, stored.created_at.replace(tzinfo=timezone.utc))
+    return calendar_response(rendered, f"{stored.name}.ics")
+
+
+@app.route('/calendars/<key>.zip')
+def download_calendar_bundle(key):
+    """Stream a ZIP of a stored calendar plus one .ics file per event."""
+    stored = get_stored_calendar_or_404(key)
+    events_data = load_events(stored.events)
+    dtstamp = stored.created_at.replace(tzinfo=timezone.utc)
+    
+    response = Response(stream_calendar_bundle(stored.name, events_data, dtstamp), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{stored.name}.zip"'
+    return response
+
+
+@app.route('/calendar/<token>.ics')
+def calendar_feed(token):
+    """
+    Serve a user's subscription feed: all events of their stored calendars.
+    
+    The feed is rendered once per change of the user's events; calendar
+    clients polling it get 304s in between.
+    """
+    feed = CalendarFeed.query.filter_by(token=token).first_or_404()
+    updated_at = feed.updated_at.replace(tzinfo=timezone.utc)
+    
+    def render():
+        # Events re-generated from a re-upload share their UID; the latest version wins
+        events_by_uid = {}
+        for stored in StoredCalendar.query.filter_by(user_id=feed.user_id).order_by(StoredCalendar.id):
+            for event_data in load_events(stored.events):
+                events_by_uid[event_data.get('uid') or id(event_data)] = event_data
+        return serialize_calendar(list(events_by_uid.values()), updated_at)
+    
+    rendered = calendar_cache.get(f"feed:{feed.token}:{updated_at.isoformat()}", render)
+    return calendar_response(rendered, 'calendar.ics', last_modified=updated_at)
+
+
+@app.route('/pushes/<batch>')
+@login_required
+def push_status(batch):
+    """Report the state of a generate request's calendar pushes, for the download page to poll."""
+    outbox_worker.notify()
+    return jsonify(get_batch_status(current_user, batch))
+
+
+@app.route('/course-calendars/<int:course_calendar_id>/delete', methods=['POST'])
+@login_required
+def delete_course_calendar(course_calendar_id):
+    """Remove one of the user's course calendars, with all its events, through the outbox."""
+    course_calendar = CourseCalendar.query.filter_by(id=course_calendar_id, user_id=current_user.id).first_or_404()
+    batch = secrets.token_urlsafe(12)
+    enqueue_calendar_drop(current_user, batch, course_calendar.calendar, course_calendar.course)
+    db.session.commit()
+    outbox_worker.notify()
+    flash(f'Your {course_calendar.course} calendar is being removed from {course_calendar.calendar}', 'info')
+    return redirect(url_for('index'))
+
+
+@app.route('/download/<path:filename>')
 def download_file(filename):
     return send_from_directory(app.config['CALENDAR_FOLDER'], filename, as_attachment=True)
 
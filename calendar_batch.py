@@ -0,0 +1,507 @@
+"""
+Calendar Batch Module
+
+This module sends many calendar events to a provider in a few HTTP requests
+instead of one request per event.
+
+A sync is a list of changes: an event sent for the first time is inserted,
+one sent before is patched with If-Match on the etag it was last sent with
+(so an event the user edited in their calendar since is not overwritten),
+and one no longer wanted is deleted.
+
+Google Calendar takes up to GOOGLE_BATCH_SIZE requests per multipart/mixed
+batch request; each part is a complete HTTP request and the response holds
+one HTTP response per part, matched back to its event by Content-ID.
+
+Microsoft Graph takes up to GRAPH_BATCH_SIZE requests per JSON $batch
+request; the response holds one status/body per request id.
+
+Every batch request first takes its events' worth of quota from the
+provider's rate limiter. Throttled items (429/503, and Google's rate-limit
+403s) are reported to the limiter, which holds further requests back for
+their Retry-After, and are sent again a bounded number of times. Only
+throttling of the whole app slows every user down; one user exceeding
+their own quota (Google's userRateLimitExceeded, Graph's per-mailbox
+limits) holds back that user alone.
+
+The batch requests of one push are sent concurrently from an asyncio event
+loop, a bounded number per provider at a time, so pushing many events costs
+about one round trip rather than one per batch.
+"""
+
+import re
+import json
+import uuid
+import asyncio
+import logging
+from urllib.parse import quote
+
+import http_client
+from rate_limiter import limiters, RateLimited
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_BATCH_URL = "https://www.googleapis.com/batch/calendar/v3"
+GOOGLE_EVENTS_PATH = "/calendar/v3/calendars/primary/events"
+GOOGLE_EVENT_PATH = GOOGLE_EVENTS_PATH + "/{event_id}"
+GOOGLE_CALENDAR_EVENTS_PATH = "/calendar/v3/calendars/{calendar_id}/events"
+GOOGLE_CALENDAR_EVENT_PATH = GOOGLE_CALENDAR_EVENTS_PATH + "/{event_id}"
+GOOGLE_BATCH_SIZE = 50
+
+GRAPH_BATCH_URL = "https://graph.microsoft.com/v1.0/$batch"
+GRAPH_EVENTS_PATH = "/me/calendar/events"
+GRAPH_EVENT_PATH = "/me/events/{event_id}"
+GRAPH_CALENDAR_EVENTS_PATH = "/me/calendars/{calendar_id}/events"
+GRAPH_BATCH_SIZE = 20
+
+# Batch requests in flight at once per provider; Graph allows four
+# concurrent requests per mailbox
+GOOGLE_CONCURRENCY = 4
+GRAPH_CONCURRENCY = 4
+
+# Attempts per throttled event, and the longest Retry-After we wait for
+MAX_ATTEMPTS = 3
+MAX_RETRY_AFTER = 30
+
+# Reasons of Google's 403 responses that mean "slow down", and those that
+# concern one user's quota only
+GOOGLE_RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+GOOGLE_USER_RATE_LIMIT_REASONS = {'userRateLimitExceeded'}
+
+# Error code of Graph's 429s when the app, not one mailbox, is throttled
+GRAPH_APP_THROTTLED_CODE = 'ApplicationThrottled'
+
+# Connect and read timeouts of batch requests, in seconds; a batch takes
+# longer to answer than a single request
+REQUEST_TIMEOUT = (5, 60)
+
+BOUNDARY_PATTERN = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+CONTENT_ID_PATTERN = re.compile(r'^Content-ID:\s*<?response-item-(\d+)>?\s*$', re.IGNORECASE | re.MULTILINE)
+STATUS_LINE_PATTERN = re.compile(r'^HTTP/\d(?:\.\d)?\s+(\d{3})', re.MULTILINE)
+
+
+def google_batch_send(access_token, requests, batch_url=GOOGLE_BATCH_URL, batch_size=GOOGLE_BATCH_SIZE,
+                      concurrency=GOOGLE_CONCURRENCY, user_key=None, limiter=None, max_attempts=MAX_ATTEMPTS):
+    """
+    Send Google Calendar requests (inserts, patches, deletes) using batch requests.
+
+    Args:
+        access_token (str): Google OAuth access token
+        requests (list): Request dicts with "method", "path" and optionally
+            "body" (a JSON resource) and "headers"
+        batch_url (str): Batch endpoint
+        batch_size (int): Maximum requests per batch request
+        concurrency (int): Batch requests sent at once
+        user_key: Identifies the user for per-user rate limiting (optional)
+        limiter (RateLimiter): Rate limiter (defaults to Google's)
+        max_attempts (int): Attempts per request before giving up on throttling
+
+    Returns:
+        list: One (status_code, body) tuple per request, in the order given;
+              body is the parsed JSON response (or text). Requests whose batch
+              request failed as a whole get that request's status and body.
+    """
+    def send(indices):
+        boundary = f"batch_{uuid.uuid4().hex}"
+        response = http_client.post(
+            batch_url,
+            headers={
+                'Authorization': f"Bearer {access_token}",
+                'Content-Type': f"multipart/mixed; boundary={boundary}",
+            },
+            data=build_google_batch_body([requests[index] for index in indices], boundary, indices),
+            timeout=REQUEST_TIMEOUT,
+        )
+
+        if response.status_code != 200:
+            logger.warning(f"Google batch request failed: {response.status_code}")
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            throttled = response.status_code in (429, 503)
+            provider_wide = is_google_provider_limit(response.status_code, response.text)
+            return [(index, response.status_code, response.text, retry_after if throttled else None, provider_wide)
+                    for index in indices]
+
+        parts = {index: (status_code, headers, body) for index, status_code, headers, body
+                 in parse_google_batch_response(response.headers.get('Content-Type', ''), response.text)}
+        items = []
+        for index in indices:
+            # A part missing from the response counts as failed
+            status_code, headers, body = parts.get(index, (502, {}, "No response for this event in the batch"))
+            retry_after = None
+            if is_google_rate_limit(status_code, body):
+                retry_after = parse_retry_after(headers.get('Retry-After'))
+            items.append((index, status_code, body, retry_after, is_google_provider_limit(status_code, body)))
+        return items
+
+    return send_in_batches(len(requests), batch_size, send, concurrency,
+                           limiter or limiters['Google'], user_key, max_attempts)
+
+
+def is_google_rate_limit(status_code, body):
+    """Whether a Google response asks the client to slow down."""
+    if status_code in (429, 503):
+        return True
+    if status_code == 403 and isinstance(body, dict):
+        reasons = {error.get('reason') for error in body.get('error', {}).get('errors', [])}
+        return bool(reasons & GOOGLE_RATE_LIMIT_REASONS)
+    return False
+
+
+def is_google_provider_limit(status_code, body):
+    """Whether a Google rate limit concerns the whole app rather than one user's quota."""
+    reasons = {error.get('reason') for error in error_of(body).get('errors', [])}
+    return not reasons or not reasons <= GOOGLE_USER_RATE_LIMIT_REASONS
+
+
+def is_graph_provider_limit(status_code, body):
+    """Whether a Graph rate limit concerns the whole app rather than one mailbox."""
+    # Graph limits Outlook requests per app and mailbox
+    return status_code == 503 or error_of(body).get('code') == GRAPH_APP_THROTTLED_CODE
+
+
+def error_of(body):
+    """The "error" object of a provider's response body (JSON or its text), or {}."""
+    if isinstance(body, str):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return {}
+    error = body.get('error') if isinstance(body, dict) else None
+    return error if isinstance(error, dict) else {}
+
+
+def build_google_batch_body(requests, boundary, indices=None):
+    """
+    Build a multipart/mixed batch body with one part per request.
+
+    Args:
+        requests (list): Request dicts (see google_batch_send)
+        boundary (str): Multipart boundary
+        indices (list): Indices of the requests, used in the parts' Content-IDs
+            (defaults to their positions)
+
+    Returns:
+        bytes: The request body
+    """
+    indices = range(len(requests)) if indices is None else indices
+    parts = []
+    for index, item in zip(indices, requests):
+        headers = dict(item.get('headers') or {})
+        payload = ''
+        if item.get('body') is not None:
+            headers['Content-Type'] = 'application/json'
+            payload = json.dumps(item['body'])
+        header_lines = ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+        parts.append(
+            f"--{boundary}\r\n"
+            f"Content-Type: application/http\r\n"
+            f"Content-ID: <item-{index}>\r\n"
+            f"\r\n"
+            f"{item['method']} {item['path']}\r\n"
+            f"{header_lines}"
+            f"\r\n"
+            f"{payload}\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n")
+    return ''.join(parts).encode('utf-8')
+
+
+def parse_google_batch_response(content_type, text):
+    """
+    Split a batch response into the responses of its parts.
+
+    Args:
+        content_type (str): Content-Type header of the batch response
+        text (str): Body of the batch response
+
+    Returns:
+        list: (index, status_code, headers, body) tuples, index being the
+              event index from the part's Content-ID and headers a dict of
+              the part response's headers
+    """
+    boundary_match = BOUNDARY_PATTERN.search(content_type)
+    if not boundary_match:
+        logger.warning("Google batch response has no multipart boundary")
+        return []
+
+    results = []
+    for part in text.split(f"--{boundary_match.group(1)}"):
+        content_id = CONTENT_ID_PATTERN.search(part)
+        status_line = STATUS_LINE_PATTERN.search(part)
+        if not content_id or not status_line:
+            continue
+
+        # The part's HTTP response: status line, headers, blank line, body
+        http_response = part[status_line.start():].replace('\r\n', '\n')
+        head, _, body = http_response.partition('\n\n')
+        headers = {}
+        for line in head.split('\n')[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().title()] = value.strip()
+        body = body.strip()
+        try:
+            body = json.loads(body) if body else {}
+        except ValueError:
+            pass
+        results.append((int(content_id.group(1)), int(status_line.group(1)), headers, body))
+
+    return results
+
+
+def graph_batch_send(access_token, requests, batch_url=GRAPH_BATCH_URL, batch_size=GRAPH_BATCH_SIZE,
+                     concurrency=GRAPH_CONCURRENCY, user_key=None, limiter=None, max_attempts=MAX_ATTEMPTS):
+    """
+    Send Microsoft Graph requests (inserts, patches, deletes) using $batch requests.
+
+    Args:
+        access_token (str): Microsoft Graph access token
+        requests (list): Request dicts with "method", "path" (relative to the
+            Graph version, e.g. "/me/events/{id}") and optionally "body" (a
+            JSON resource) and "headers"
+        batch_url (str): $batch endpoint
+        batch_size (int): Maximum requests per $batch request
+        concurrency (int): $batch requests sent at once
+        user_key: Identifies the user for per-user rate limiting (optional)
+        limiter (RateLimiter): Rate limiter (defaults to Outlook's)
+        max_attempts (int): Attempts per request before giving up on throttling
+
+    Returns:
+        list: One (status_code, body) tuple per request, in the order given
+    """
+    def send(indices):
+        response = http_client.post(
+            batch_url,
+            headers={
+                'Authorization': f"Bearer {access_token}",
+                'Content-Type': 'application/json',
+            },
+            json={'requests': [build_graph_batch_item(index, requests[index]) for index in indices]},
+            timeout=REQUEST_TIMEOUT,
+        )
+
+        if response.status_code != 200:
+            logger.warning(f"Graph batch request failed: {response.status_code}")
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            throttled = response.status_code in (429, 503)
+            provider_wide = is_graph_provider_limit(response.status_code, response.text)
+            return [(index, response.status_code, response.text, retry_after if throttled else None, provider_wide)
+                    for index in indices]
+
+        items = {index: (index, 502, "No response for this event in the batch", None, False) for index in indices}
+        for item in response.json().get('responses', []):
+            index = int(item['id'])
+            status_code = item.get('status', 500)
+            body = item.get('body', {})
+            retry_after = None
+            if status_code in (429, 503):
+                retry_after = parse_retry_after((item.get('headers') or {}).get('Retry-After'))
+            if index in items:
+                items[index] = (index, status_code, body, retry_after, is_graph_provider_limit(status_code, body))
+        return list(items.values())
+
+    return send_in_batches(len(requests), batch_size, send, concurrency,
+                           limiter or limiters['Outlook'], user_key, max_attempts)
+
+
+def build_graph_batch_item(index, item):
+    """Build the $batch entry of one request."""
+    entry = {'id': str(index), 'method': item['method'], 'url': item['path']}
+    headers = dict(item.get('headers') or {})
+    if item.get('body') is not None:
+        headers['Content-Type'] = 'application/json'
+        entry['body'] = item['body']
+    if headers:
+        entry['headers'] = headers
+    return entry
+
+
+def build_change_requests(changes, events_path, event_path, build_event,
+                          calendar_events_path=None, calendar_event_path=None):
+    """
+    Build the requests that apply event changes.
+
+    Args:
+        changes (list): Change dicts with "event" (event data, or None to
+            delete), the "remote_id" and "etag" the event was last sent with
+            (None if it has not been sent) and optionally the "calendar_id"
+            of a secondary calendar the event is in (None for the default)
+        events_path (str): Path events are inserted at
+        event_path (str): Path of one event, with an {event_id} field
+        build_event (callable): Builds the provider's resource from event data
+        calendar_events_path (str): Path events are inserted at in a given
+            calendar, with a {calendar_id} field (defaults to events_path)
+        calendar_event_path (str): Path of one event in a given calendar,
+            with {calendar_id} and {event_id} fields (defaults to event_path)
+
+    Returns:
+        list: One request dict per change (see google_batch_send)
+    """
+    requests = []
+    for change in changes:
+        remote_id = change.get('remote_id')
+        calendar_id = change.get('calendar_id')
+        if calendar_id:
+            calendar_id = quote(calendar_id, safe='')
+            insert_path = (calendar_events_path or events_path).format(calendar_id=calendar_id)
+            path = (calendar_event_path or event_path).format(calendar_id=calendar_id, event_id=remote_id)
+        else:
+            insert_path, path = events_path, event_path.format(event_id=remote_id)
+
+        headers = {'If-Match': change['etag']} if change.get('etag') else {}
+        if change['event'] is None:
+            requests.append({'method': 'DELETE', 'path': path, 'headers': headers})
+        elif remote_id:
+            requests.append({'method': 'PATCH', 'path': path, 'headers': headers, 'body': build_event(change['event'])})
+        else:
+            requests.append({'method': 'POST', 'path': insert_path, 'body': build_event(change['event'])})
+    return requests
+
+
+def change_result(change, status_code, body, calendar, etag_field):
+    """
+    Describe the outcome of a change.
+
+    Args:
+        change (dict): The change (see build_change_requests)
+        status_code (int): Status of the change's request
+        body: Parsed response body (or text)
+        calendar (str): "Google" or "Outlook"
+        etag_field (str): Field of the event resource holding its etag
+
+    Returns:
+        dict: "success", "message", the event's "remote_id" and "etag" after
+              the change (None once deleted), and "retry" (whether a failed
+              change may succeed if sent again)
+    """
+    remote_id = change.get('remote_id')
+    action = 'delete' if change['event'] is None else 'update' if remote_id else 'add'
+    body = body if isinstance(body, dict) else {'error': {'message': body}}
+
+    # An event that is already gone needs no deleting
+    if 200 <= status_code < 300 or (action == 'delete' and status_code in (404, 410)):
+        done = {'add': 'added to', 'update': 'updated in', 'delete': 'removed from'}[action]
+        return {
+            'success': True,
+            'message': f"Event {done} {calendar} Calendar",
+            'remote_id': None if action == 'delete' else body.get('id', remote_id),
+            'etag': None if action == 'delete' else body.get(etag_field),
+            'retry': False,
+        }
+
+    retry = True
+    if status_code == 412:
+        message, retry = f"Event was changed in your {calendar} Calendar, not overwritten", False
+    elif action == 'update' and status_code in (404, 410):
+        message, retry = f"Event was deleted from your {calendar} Calendar, not added again", False
+    else:
+        error = body.get('error')
+        error_message = error.get('message') if isinstance(error, dict) else error
+        message = f"Failed to {action} event in {calendar} Calendar: {error_message or status_code}"
+    return dict(failed_change(change, message), retry=retry)
+
+
+def failed_change(change, message):
+    """The result of a change that could not be sent (see change_result)."""
+    return {'success': False, 'message': message, 'remote_id': change.get('remote_id'), 'etag': change.get('etag'),
+            'retry': True}
+
+
+def send_in_batches(count, batch_size, send, concurrency, limiter, user_key, max_attempts):
+    """
+    Send events in concurrent batch requests, retrying throttled ones.
+
+    Args:
+        count (int): Number of events
+        batch_size (int): Maximum events per batch request
+        send (callable): Sends the events with the given indices in one batch
+            request; returns (index, status_code, body, retry_after,
+            provider_wide) per event, retry_after being None unless the event
+            was throttled and provider_wide telling whether the throttling
+            concerns the whole app
+        concurrency (int): Batch requests sent at once
+        limiter (RateLimiter): Provider rate limiter
+        user_key: Identifies the user for per-user rate limiting
+        max_attempts (int): Attempts per event before giving up on throttling
+
+    Returns:
+        list: One (status_code, body) tuple per event, in the order given
+    """
+    results = [None] * count
+    pending = list(range(count))
+
+    def send_limited(indices):
+        try:
+            limiter.acquire(user_key, len(indices))
+        except RateLimited as e:
+            return [(index, 429, str(e), None, False) for index in indices]
+        items = send(indices)
+        throttled = [item for item in items if item[3] is not None]
+        if throttled:
+            limiter.throttled(user_key, max(item[3] for item in throttled),
+                              provider_wide=any(item[4] for item in throttled))
+        else:
+            limiter.succeeded(user_key)
+        return items
+
+    for attempt in range(max_attempts):
+        chunks = [pending[offset:offset + batch_size] for offset in range(0, len(pending), batch_size)]
+        throttled = []
+        for items in run_concurrently([lambda chunk=chunk: send_limited(chunk) for chunk in chunks], concurrency):
+            for index, status_code, body, retry_after, provider_wide in items:
+                results[index] = (status_code, body)
+                if retry_after is not None:
+                    throttled.append(index)
+
+        if not throttled or attempt == max_attempts - 1:
+            break
+        # The limiter holds the next requests back for the Retry-After
+        logger.info(f"{len(throttled)} events throttled, retrying")
+        pending = sorted(throttled)
+
+    return results
+
+
+def parse_retry_after(value, default=1):
+    """
+    Read a Retry-After header given in seconds.
+
+    Args:
+        value (str): Header value (optional)
+        default (int): Delay when the header is missing or not a number
+
+    Returns:
+        int: Seconds to wait, at most MAX_RETRY_AFTER
+    """
+    try:
+        return min(max(int(value), 0), MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return default
+
+
+def run_concurrently(calls, concurrency):
+    """
+    Run blocking calls concurrently from an asyncio event loop.
+
+    Each call runs on a worker thread (the HTTP client's connection pool is
+    shared between threads); at most `concurrency` run at once.
+
+    Args:
+        calls (list): Callables taking no arguments
+        concurrency (int): Maximum calls in flight
+
+    Returns:
+        list: The calls' results, in the order given
+    """
+    if len(calls) <= 1 or concurrency <= 1:
+        return [call() for call in calls]
+
+    async def gather():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(call):
+            async with semaphore:
+                return await asyncio.to_thread(call)
+
+        return await asyncio.gather(*(run(call) for call in calls))
+
+    return asyncio.run(gather())
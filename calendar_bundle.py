@@ -0,0 +1,98 @@
+"""
+Calendar Bundle Module
+
+This module streams a ZIP bundle of a calendar: the combined .ics plus one
+.ics per event. The archive is produced chunk by chunk as it is sent, so
+nothing is staged on disk and memory use does not grow with the number of
+events.
+"""
+
+import zipfile
+import logging
+
+from calendar_generator import iter_calendar
+
+logger = logging.getLogger(__name__)
+
+# Bytes of archive collected before a chunk is handed to the response
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkBuffer:
+    """Write-only, unseekable file object that collects bytes until drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def stream_calendar_bundle(name, events_data, dtstamp=None):
+    """
+    Stream a ZIP holding a combined calendar and one calendar per event.
+
+    Args:
+        name (str): Calendar name; the combined file is "<name>.ics" and the
+            per-event files live in "<name>/"
+        events_data (list): Event data dictionaries (see calendar_generator.create_ics_file)
+        dtstamp (datetime): Creation time written as DTSTAMP (optional)
+
+    Yields:
+        bytes: Consecutive chunks of the archive
+    """
+    buffer = _ChunkBuffer()
+    # An unseekable target makes zipfile write sizes in data descriptors
+    # after each entry instead of seeking back to the entry's header
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for entry_name, pieces in bundle_entries(name, events_data, dtstamp):
+            with archive.open(entry_name, 'w') as entry:
+                for piece in pieces:
+                    entry.write(piece)
+                    if buffer.size >= CHUNK_SIZE:
+                        yield buffer.drain()
+    yield buffer.drain()
+
+
+def bundle_entries(name, events_data, dtstamp=None):
+    """
+    Generate the entries of a bundle, one at a time.
+
+    Args:
+        name (str): Calendar name
+        events_data (list): Event data dictionaries
+        dtstamp (datetime): Creation time written as DTSTAMP (optional)
+
+    Yields:
+        tuple: (entry_name, pieces) where pieces yields the entry's .ics bytes
+    """
+    yield f"{name}.ics", iter_calendar(events_data, dtstamp)
+
+    used_names = set()
+    for event_data in events_data:
+        start_time = event_data['start_time']
+        title = event_data.get('title') or 'Event'
+        title_slug = '_'.join(title.split()[:3])
+        title_slug = ''.join(c if c.isalnum() else '_' for c in title_slug)
+        stem = f"{start_time.strftime('%Y%m%d')}_{title_slug}"
+
+        entry_stem = stem
+        counter = 1
+        while entry_stem in used_names:
+            entry_stem = f"{stem}_{counter}"
+            counter += 1
+        used_names.add(entry_stem)
+
+        yield f"{name}/{entry_stem}.ics", iter_calendar([event_data], dtstamp)
@@ -0,0 +1,111 @@
+"""
+Calendar Cache Module
+
+This module renders stored calendars to .ics bytes on demand and keeps the
+results in a bounded in-memory LRU keyed by a hash of the stored content.
+Each entry carries a strong ETag and, for larger calendars, a gzip-encoded
+copy, so re-downloads and polling calendar clients are served from memory.
+"""
+
+import gzip
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from calendar_generator import serialize_calendar, load_events
+
+logger = logging.getLogger(__name__)
+
+# Bounds of the cache: number of calendars and total size of their bytes
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+# Calendars smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+
+RenderedCalendar = namedtuple('RenderedCalendar', ['data', 'gzip_data', 'etag'])
+
+
+def content_key(events_json, dtstamp):
+    """Hash the stored content a calendar is rendered from."""
+    digest = hashlib.sha256(events_json.encode('utf-8'))
+    digest.update(dtstamp.isoformat().encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CalendarRenderCache:
+    """
+    LRU of rendered calendars, bounded by entry count and total bytes.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, render):
+        """
+        Get a rendered calendar, rendering it on a miss.
+
+        Args:
+            key (str): Identifies the calendar's content; must change whenever
+                the content does (see content_key)
+            render (callable): Produces the calendar's .ics bytes
+
+        Returns:
+            RenderedCalendar: The .ics bytes, their gzip encoding (None for
+                small calendars) and a strong ETag (unquoted)
+        """
+        with self._lock:
+            rendered = self._entries.get(key)
+            if rendered is not None:
+                self._entries.move_to_end(key)
+                return rendered
+
+        rendered = make_rendered_calendar(render())
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = rendered
+                self._size += entry_size(rendered)
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= entry_size(evicted)
+        return rendered
+
+    def get_stored(self, events_json, dtstamp):
+        """
+        Get a calendar rendered from stored events.
+
+        Args:
+            events_json (str): Stored events (see calendar_generator.dump_events)
+            dtstamp (datetime): When the calendar was created; written as DTSTAMP
+
+        Returns:
+            RenderedCalendar: The rendered calendar
+        """
+        return self.get(content_key(events_json, dtstamp),
+                        lambda: serialize_calendar(load_events(events_json), dtstamp))
+
+
+def make_rendered_calendar(data):
+    """
+    Prepare .ics bytes for serving.
+
+    Args:
+        data (bytes): The calendar
+
+    Returns:
+        RenderedCalendar: The calendar with its ETag and gzip encoding
+    """
+    etag = hashlib.sha256(data).hexdigest()[:32]
+    # mtime=0 keeps the encoding reproducible
+    gzip_data = gzip.compress(data, mtime=0) if len(data) >= GZIP_MIN_BYTES else None
+    return RenderedCalendar(data, gzip_data, etag)
+
+
+def entry_size(rendered):
+    return len(rendered.data) + len(rendered.gzip_data or b'')
@@ -6,16 +6,41 @@ from extracted date information.
 """
 
 import os
+import re
+import json
 import uuid
+import hashlib
 import logging
-from datetime import datetime, timedelta
+import tempfile
+from datetime import datetime, timedelta, timezone
 
 from icalendar import Calendar, Event
 from icalendar import vCalAddress, vText
 
 logger = logging.getLogger(__name__)
 
-def create_ics_file(event_data, output_dir=None):
+# Calendar header and footer written once per bulk-serialized file
+CALENDAR_HEADER = (
+    b"BEGIN:VCALENDAR\r\n"
+    b"PRODID:-//Date Extractor//AI Assistant//EN\r\n"
+    b"VERSION:2.0\r\n"
+    b"CALSCALE:GREGORIAN\r\n"
+    b"METHOD:PUBLISH\r\n"
+)
+CALENDAR_FOOTER = b"END:VCALENDAR\r\n"
+
+# RFC 5545 TEXT escaping (section 3.3.11); CR is dropped, LF becomes "\n"
+TEXT_ESCAPES = str.maketrans({'\\': '\\\\', ';': '\\;', ',': '\\,', '\n': '\\n', '\r': None})
+TEXT_SPECIAL_CHARS = re.compile(r'[\\;,\n\r]')
+
+# Hex digits of the content hash appended to calendar file names
+CONTENT_SUFFIX_LENGTH = 10
+
+# Content lines longer than this many octets are folded (RFC 5545 section 3.1)
+MAX_LINE_OCTETS = 75
+
+
+def create_ics_file(event_data, output_dir=None, shard=None):
     """
     Create an ICS file from event data.
     
@@ -26,7 +51,12 @@ def create_ics_file(event_data, output_dir=None):
             - title: Event title (optional)
             - description: Event description (optional)
             - location: Event location (optional)
+            - recurrence: Recurrence rule (optional), e.g.
+              {"frequency": "weekly", "until": "2025-04-08", "exdates": ["2025-03-11"]}
+            - uid: Event UID (optional, see make_event_uid; random by default)
         output_dir (str): Directory to save the ICS file (default: current directory)
+        shard (str): User or session the file belongs to; files are kept in a
+            sub-folder per shard (optional)
             
     Returns:
         str: Path to the created ICS file
@@ -35,9 +65,39 @@ def create_ics_file(event_data, output_dir=None):
     if output_dir is None:
         output_dir = './calendar_events'
     
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
+    # Create calendar
+    cal = Calendar()
+    cal.add('prodid', '-//Date Extractor//AI Assistant//EN')
+    cal.add('version', '2.0')
+    cal.add('calscale', 'GREGORIAN')
+    cal.add('method', 'PUBLISH')
+    
+    # Add event to calendar
+    event = build_event(event_data)
+    cal.add_component(event)
     
+    # Generate filename: Date_Title_<content hash>.ics
+    start_time = event_data['start_time']
+    title = str(event.get('summary'))
+    date_str = start_time.strftime('%Y%m%d')
+    title_slug = '_'.join(title.split()[:3])  # Use first three words of title
+    title_slug = ''.join(c if c.isalnum() else '_' for c in title_slug)  # Remove special chars
+    file_path = write_calendar_file(get_shard_dir(output_dir, shard), f"{date_str}_{title_slug}", cal.to_ical())
+    
+    logger.info(f"Created calendar file: {file_path}")
+    return file_path
+
+
+def build_event(event_data):
+    """
+    Build an icalendar Event from event data.
+    
+    Args:
+        event_data (dict): Event information (see create_ics_file)
+        
+    Returns:
+        Event: The event component
+    """
     # Extract event data with defaults
     start_time = event_data.get('start_time')
     if not start_time:
@@ -52,13 +112,6 @@ def create_ics_file(event_data, output_dir=None):
     description = event_data.get('description', '')
     location = event_data.get('location', '')
     
-    # Create calendar
-    cal = Calendar()
-    cal.add('prodid', '-//Date Extractor//AI Assistant//EN')
-    cal.add('version', '2.0')
-    cal.add('calscale', 'GREGORIAN')
-    cal.add('method', 'PUBLISH')
-    
     # Create event
     event = Event()
     event.add('summary', title)
@@ -70,36 +123,329 @@ def create_ics_file(event_data, output_dir=None):
     event.add('dtstart', start_time)
     event.add('dtend', end_time)
     
+    # Add the recurrence rule and skipped occurrences for recurring events
+    recurrence = event_data.get('recurrence')
+    if recurrence:
+        event.add('rrule', {
+            'freq': recurrence['frequency'],
+            'until': get_recurrence_until(recurrence, start_time)
+        })
+        exdates = get_recurrence_exdates(recurrence, start_time)
+        if exdates:
+            event.add('exdate', exdates)
+    
     # Add timestamp and unique ID
     event.add('dtstamp', datetime.now())
-    event.add('uid', str(uuid.uuid4()))
+    event.add('uid', event_data.get('uid') or str(uuid.uuid4()))
     
-    # Add event to calendar
-    cal.add_component(event)
+    return event
+
+
+def write_calendar_file(output_dir, stem, data):
+    """
+    Atomically write calendar data under a collision-free name.
     
-    # Generate filename: Date_Title.ics
-    date_str = start_time.strftime('%Y%m%d')
-    title_slug = '_'.join(title.split()[:3])  # Use first three words of title
-    title_slug = ''.join(c if c.isalnum() else '_' for c in title_slug)  # Remove special chars
-    filename = f"{date_str}_{title_slug}.ics"
+    The name ends with a short hash of the content, so two different calendars
+    never share a name and no existence probes are needed. The data is written
+    to a temporary file and then linked into place, which fails rather than
+    overwrites if the name exists; an existing file of that name already holds
+    the same content. Safe for concurrent writers sharing the folder.
     
-    # Create a unique filename if it already exists
-    base_path = os.path.join(output_dir, filename)
-    file_path = base_path
-    counter = 1
+    Args:
+        output_dir (str): Directory of the file (must exist)
+        stem (str): File name without suffix and extension
+        data (bytes): The calendar
+        
+    Returns:
+        str: Path of the file
+    """
+    suffix = hashlib.sha256(data).hexdigest()[:CONTENT_SUFFIX_LENGTH]
+    file_path = os.path.join(output_dir, f"{stem}_{suffix}.ics")
     
-    while os.path.exists(file_path):
-        file_path = os.path.join(output_dir, f"{date_str}_{title_slug}_{counter}.ics")
-        counter += 1
+    fd, temp_path = tempfile.mkstemp(dir=output_dir, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            os.link(temp_path, file_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # File systems without hard links: replacing is harmless, the content is identical
+            os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
     
-    # Write to file
-    with open(file_path, 'wb') as f:
-        f.write(cal.to_ical())
+    return file_path
+
+
+def get_shard_dir(output_dir, shard):
+    """
+    Get (and create) the folder of one user or session inside output_dir.
     
-    logger.info(f"Created calendar file: {file_path}")
+    Args:
+        output_dir (str): The calendar folder
+        shard (str): User or session identifier (optional)
+        
+    Returns:
+        str: The shard's folder, or output_dir when no shard is given
+    """
+    if shard:
+        output_dir = os.path.join(output_dir, secure_shard_name(shard))
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir
+
+
+def secure_shard_name(shard):
+    """Reduce a shard identifier to characters that are safe in a folder name."""
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(shard)) or '_'
+
+
+def make_event_uid(course, title, date):
+    """
+    Derive a stable UID for an extracted event.
+    
+    The same assessment extracted again (e.g. from a re-upload) gets the same
+    UID, so calendar clients update the event instead of adding a copy.
+    
+    Args:
+        course (str): Course code such as "FNCE 674" (optional)
+        title (str): Event title; a leading "<course>: " prefix, case,
+            punctuation and spacing are ignored
+        date (str or datetime): Event date (YYYY-MM-DD) or start time, or
+            None for an ongoing item whose date is only the day it was
+            extracted (so it keeps its UID from one day to the next)
+        
+    Returns:
+        str: The UID
+    """
+    date = date or ''
+    if isinstance(date, datetime):
+        date = date.strftime('%Y-%m-%d')
+    course = ' '.join((course or '').upper().split())
+    if course and title.upper().startswith(course + ':'):
+        title = title[len(course) + 1:]
+    normalized_title = ' '.join(re.sub(r'[^a-z0-9#]+', ' ', title.lower()).split())
+    digest = hashlib.sha256(f"{course}|{normalized_title}|{date}".encode('utf-8')).hexdigest()
+    return f"{digest[:32]}@date-extractor"
+
+
+def event_content_hash(event_data, recurrence=True):
+    """
+    Hash the fields of an event that calendars display.
+
+    Calendars do not report a recurrence back the way it was sent (Graph
+    keeps no trace of the skipped weeks), so hashes compared with an event
+    pulled from a calendar leave it out (recurrence=False), which hashes the
+    event as a one-off.
+    """
+    content = '|'.join(str(event_data.get(field) or '') for field in
+                       ('title', 'description', 'location', 'start_time', 'end_time'))
+    content += '|' + json.dumps(event_data.get('recurrence') if recurrence else None, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def create_calendar_file(events_data, output_dir=None, name=None, shard=None):
+    """
+    Create one ICS file holding all the given events.
+    
+    Args:
+        events_data (list): List of event data dictionaries (see create_ics_file)
+        output_dir (str): Directory to save the ICS file
+        name (str): File name without extension (default: derived from the first event)
+        shard (str): User or session the file belongs to (optional)
+            
+    Returns:
+        str: Path to the created ICS file, or None when there are no events
+    """
+    if not events_data:
+        logger.warning("No events provided")
+        return None
+    
+    if output_dir is None:
+        output_dir = './calendar_events'
+    
+    if name is None:
+        name = f"{events_data[0]['start_time'].strftime('%Y%m%d')}_calendar"
+    name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+    file_path = write_calendar_file(get_shard_dir(output_dir, shard), name, serialize_calendar(events_data))
+    
+    logger.info(f"Created calendar file with {len(events_data)} events: {file_path}")
     return file_path
 
 
+def serialize_calendar(events_data, dtstamp=None):
+    """
+    Serialize many events into a single VCALENDAR.
+    
+    The common fields are written directly as content lines instead of going
+    through the icalendar object model; events whose times carry a time zone
+    other than UTC fall back to icalendar for their VEVENT.
+    
+    Args:
+        events_data (list): List of event data dictionaries (see create_ics_file);
+            an event's "uid" is used when present
+        dtstamp (datetime): Creation time written as DTSTAMP (default: now);
+            with stored UIDs, a fixed dtstamp makes the output reproducible
+        
+    Returns:
+        bytes: The calendar, CRLF-terminated and line-folded
+    """
+    return b''.join(iter_calendar(events_data, dtstamp))
+
+
+def iter_calendar(events_data, dtstamp=None):
+    """
+    Serialize a calendar piece by piece (see serialize_calendar).
+    
+    Args:
+        events_data (iterable): Event data dictionaries
+        dtstamp (datetime): Creation time written as DTSTAMP (default: now)
+        
+    Yields:
+        bytes: The header, each VEVENT, then the footer
+    """
+    dtstamp = (dtstamp or datetime.now(timezone.utc)).astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield CALENDAR_HEADER
+    for event_data in events_data:
+        yield serialize_event(event_data, dtstamp)
+    yield CALENDAR_FOOTER
+
+
+def serialize_event(event_data, dtstamp):
+    """
+    Serialize one event as a VEVENT.
+    
+    Args:
+        event_data (dict): Event information (see create_ics_file)
+        dtstamp (str): DTSTAMP value shared by the calendar's events
+        
+    Returns:
+        bytes: The VEVENT content lines
+    """
+    start_time = event_data.get('start_time')
+    if not start_time:
+        raise ValueError("Event must have a start time")
+    
+    end_time = event_data.get('end_time') or start_time + timedelta(hours=1)
+    if not (is_fast_path_time(start_time) and is_fast_path_time(end_time)):
+        return build_event(event_data).to_ical()
+    
+    title = event_data.get('title', f"Event on {start_time.strftime('%Y-%m-%d')}")
+    lines = [
+        "BEGIN:VEVENT",
+        "SUMMARY:" + escape_text(title),
+        "DTSTART:" + format_ical_datetime(start_time),
+        "DTEND:" + format_ical_datetime(end_time),
+        "DTSTAMP:" + dtstamp,
+        "UID:" + str(event_data.get('uid') or uuid.uuid4()),
+        "DESCRIPTION:" + escape_text(event_data.get('description', '')),
+    ]
+    if event_data.get('location'):
+        lines.append("LOCATION:" + escape_text(event_data['location']))
+    
+    recurrence = event_data.get('recurrence')
+    if recurrence:
+        until = get_recurrence_until(recurrence, start_time)
+        lines.append(f"RRULE:FREQ={recurrence['frequency'].upper()};UNTIL={format_ical_datetime(until)}")
+        exdates = get_recurrence_exdates(recurrence, start_time)
+        if exdates:
+            lines.append("EXDATE:" + ','.join(format_ical_datetime(exdate) for exdate in exdates))
+    
+    lines.append("END:VEVENT")
+    return ''.join(fold_line(line) for line in lines).encode('utf-8')
+
+
+def is_fast_path_time(value):
+    """Check if a datetime is floating (naive) or UTC, the forms serialize_event writes itself."""
+    return value.tzinfo is None or value.utcoffset() == timedelta(0)
+
+
+def format_ical_datetime(value):
+    """Format a floating or UTC datetime as an iCalendar DATE-TIME."""
+    if value.tzinfo is None:
+        return value.strftime('%Y%m%dT%H%M%S')
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def escape_text(value):
+    """Escape a TEXT property value; values without special characters are returned as is."""
+    value = str(value)
+    if TEXT_SPECIAL_CHARS.search(value) is None:
+        return value
+    return value.translate(TEXT_ESCAPES)
+
+
+def fold_line(line):
+    """
+    Fold a content line to at most MAX_LINE_OCTETS octets per physical line.
+    
+    Args:
+        line (str): Content line without line break
+        
+    Returns:
+        str: The line, folded with CRLF + space and terminated with CRLF
+    """
+    # Short lines (the vast majority) need no octet counting
+    if len(line) * 4 <= MAX_LINE_OCTETS or len(line.encode('utf-8')) <= MAX_LINE_OCTETS:
+        return line + "\r\n"
+    
+    chunks = []
+    chunk_start = 0
+    chunk_octets = 0
+    limit = MAX_LINE_OCTETS
+    for index, char in enumerate(line):
+        char_octets = len(char.encode('utf-8'))
+        if chunk_octets + char_octets > limit:
+            chunks.append(line[chunk_start:index])
+            chunk_start = index
+            chunk_octets = 0
+            # Continuation lines start with a space, which counts towards the limit
+            limit = MAX_LINE_OCTETS - 1
+        chunk_octets += char_octets
+    chunks.append(line[chunk_start:])
+    return "\r\n ".join(chunks) + "\r\n"
+
+
+def dump_events(events_data):
+    """
+    Convert event data to JSON for storage.
+    
+    Args:
+        events_data (list): List of event data dictionaries (see create_ics_file)
+        
+    Returns:
+        str: JSON text; datetimes are stored in ISO format
+    """
+    stored = []
+    for event_data in events_data:
+        event = dict(event_data)
+        for field in ('start_time', 'end_time'):
+            if event.get(field):
+                event[field] = event[field].isoformat()
+        stored.append(event)
+    return json.dumps(stored, sort_keys=True)
+
+
+def load_events(events_json):
+    """
+    Convert stored JSON back to event data (the inverse of dump_events).
+    
+    Args:
+        events_json (str): JSON text from dump_events
+        
+    Returns:
+        list: List of event data dictionaries
+    """
+    events_data = json.loads(events_json)
+    for event in events_data:
+        for field in ('start_time', 'end_time'):
+            if event.get(field):
+                event[field] = datetime.fromisoformat(event[field])
+    return events_data
+
+
 def create_multiple_ics_files(events_data, output_dir=None):
     """
     Create multiple ICS files from a list of event data.
@@ -126,4 +472,60 @@ def create_multiple_ics_files(events_data, output_dir=None):
             # Continue with other events even if one fails
             continue
     
-    return created_files
\ No newline at end of file
+    return created_files
+
+
+def get_recurrence_until(recurrence, start_time):
+    """
+    Get the last moment a recurring event may occur.
+    
+    Args:
+        recurrence (dict): Recurrence rule with an "until" date (YYYY-MM-DD)
+        start_time (datetime): Start of the first occurrence
+        
+    Returns:
+        datetime: End of the "until" day, in the same form as start_time
+    """
+    until = datetime.strptime(recurrence['until'], '%Y-%m-%d')
+    return until.replace(hour=23, minute=59, second=59, tzinfo=start_time.tzinfo)
+
+
+def get_recurrence_exdates(recurrence, start_time):
+    """
+    Get the skipped occurrences of a recurring event.
+    
+    Args:
+        recurrence (dict): Recurrence rule with optional "exdates" (YYYY-MM-DD)
+        start_time (datetime): Start of the first occurrence
+        
+    Returns:
+        list: datetime of each skipped occurrence, at the event's start time
+    """
+    exdates = []
+    for exdate in recurrence.get('exdates', []):
+        day = datetime.strptime(exdate, '%Y-%m-%d')
+        exdates.append(start_time.replace(year=day.year, month=day.month, day=day.day))
+    return exdates
+
+
+def get_recurrence_lines(recurrence, start_time):
+    """
+    Format a recurrence as RFC 5545 RRULE/EXDATE lines (as used by the Google Calendar API).
+    
+    Times are written in UTC, matching the UTC time zone used for event pushes.
+    
+    Args:
+        recurrence (dict): Recurrence rule (see create_ics_file)
+        start_time (datetime): Start of the first occurrence
+        
+    Returns:
+        list: Recurrence lines, e.g. ["RRULE:FREQ=WEEKLY;UNTIL=20250408T235959Z", ...]
+    """
+    until = get_recurrence_until(recurrence, start_time)
+    lines = [f"RRULE:FREQ={recurrence['frequency'].upper()};UNTIL={until.strftime('%Y%m%dT%H%M%SZ')}"]
+    
+    exdates = get_recurrence_exdates(recurrence, start_time)
+    if exdates:
+        lines.append("EXDATE;TZID=UTC:" + ','.join(exdate.strftime('%Y%m%dT%H%M%S') for exdate in exdates))
+    
+    return lines
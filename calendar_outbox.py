@@ -0,0 +1,625 @@
+"""
+Calendar Outbox Module
+
+Pushes to Google Calendar and Outlook are not sent inside the request that
+generates the calendar. They are written to the outbox table in that request
+and sent by a pool of background threads, so a slow provider never holds a
+web worker, and a push survives a crash: rows are committed before the page
+is returned, and rows claimed by a worker that died are claimed again once
+their lease runs out. A user's pushes to a calendar are claimed together
+and sent by one worker at a time. Failed pushes are retried with
+exponential backoff.
+
+Pushes are idempotent. Each event sent to a calendar is recorded in the
+emitted-event index under its stable UID, with its id and etag in that
+calendar. When a push is sent, the index decides what it becomes: an event
+not sent before is inserted, a changed one is patched in place, and one sent
+unchanged needs no request at all. Events of a course that are no longer
+extracted are deleted. Re-syncing an unchanged syllabus therefore costs no
+provider writes. A crash between a provider accepting an insert and the row
+being marked sent can still add that one event twice.
+
+Before sending, the worker pulls the changes made in the calendar since its
+last pull (see calendar_sync). Events the user edited or deleted there are
+marked in the index and left alone: they are not updated, re-added or
+removed, unless the new extraction matches the user's version anyway.
+
+Optionally each course's events go into a secondary calendar of their own,
+created on first use and reused after. Removing or replacing a course is
+then a single calendar-level delete instead of one delete per event.
+"""
+
+import os
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, exists
+from sqlalchemy.orm import aliased
+
+from app import db
+from models import User, OutboxPush, EmittedEvent, SyncCursor, CourseCalendar
+from calendar_generator import dump_events, load_events, event_content_hash
+from calendar_sync import SyncCursorExpired
+from google_auth import (sync_events_to_google_calendar, pull_google_calendar_changes, create_google_calendar,
+                         delete_google_calendar)
+from microsoft_auth import (sync_events_to_outlook_calendar, pull_outlook_calendar_changes, create_outlook_calendar,
+                            delete_outlook_calendar)
+
+logger = logging.getLogger(__name__)
+
+# Background threads per process, and seconds between polls when idle
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 2))
+POLL_INTERVAL = 5
+
+# Attempts before a push is given up, and the delay before the first retry (doubling after)
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30
+
+# Seconds after which a push claimed by a worker that stopped answering is claimed again
+LEASE_SECONDS = 300
+
+# Pushes of one user and calendar sent together (a few provider batch requests)
+MAX_CLAIM = 100
+
+PUSHERS = {
+    'Google': sync_events_to_google_calendar,
+    'Outlook': sync_events_to_outlook_calendar,
+}
+
+PULLERS = {
+    'Google': pull_google_calendar_changes,
+    'Outlook': pull_outlook_calendar_changes,
+}
+
+CALENDAR_CREATORS = {
+    'Google': create_google_calendar,
+    'Outlook': create_outlook_calendar,
+}
+
+CALENDAR_DELETERS = {
+    'Google': delete_google_calendar,
+    'Outlook': delete_outlook_calendar,
+}
+
+
+def diff_events(user, calendar, events_data, extracted=None):
+    """
+    Compare events with those already sent to one of a user's calendars.
+
+    Events are matched by UID. Sent events of the extracted courses that
+    are no longer extracted are to be removed; events left out of
+    events_data but still extracted (deselected in the preview) are kept,
+    and events without a course are never removed.
+
+    Args:
+        user (User): The user
+        calendar (str): "Google" or "Outlook"
+        events_data (list): Event data dictionaries with their "uid" (and "course")
+        extracted (list): Every extracted event, selected or not, as
+            dictionaries with their "uid" and "course" (optional, defaults
+            to events_data)
+
+    Returns:
+        tuple: (changed, skipped, removed) - the event data to push,
+               (event_data, result) pairs of events that need no push (see
+               resolve_change), and the EmittedEvent rows of the events to remove
+    """
+    emitted = {row.uid: row for row in EmittedEvent.query.filter_by(user_id=user.id, calendar=calendar)}
+    changed, skipped = [], []
+    for event_data in events_data:
+        change, result = resolve_change(emitted.get(event_data['uid']), event_data, calendar)
+        if change is not None:
+            changed.append(event_data)
+        else:
+            skipped.append((event_data, result))
+
+    extracted = events_data if extracted is None else extracted
+    uids = {event_data['uid'] for event_data in extracted}
+    courses = {event_data.get('course') for event_data in extracted} - {None, ''}
+    removed = [row for row in emitted.values() if row.course in courses and row.uid not in uids
+               and resolve_change(row, None, calendar)[0] is not None]
+    return changed, skipped, removed
+
+
+def resolve_change(emitted, event_data, calendar, calendar_id=None):
+    """
+    Decide what sending an event to a calendar takes, given what was sent before.
+
+    An event stays in the calendar it was first added to.
+
+    Args:
+        emitted (EmittedEvent): The event's row in the index (None if never sent)
+        event_data (dict): The event's data, or None to remove it
+        calendar (str): "Google" or "Outlook"
+        calendar_id (str): Secondary calendar a new event goes into (optional)
+
+    Returns:
+        tuple: (change, result) - the change to send (see
+               calendar_batch.build_change_requests) and None, or None and
+               the result dict ("success", "message", "retry") of an event
+               that needs no request
+    """
+    def done(success, message):
+        return None, {'success': success, 'message': message, 'retry': False}
+
+    status = emitted.remote_status if emitted is not None else None
+    if event_data is None:
+        if emitted is None or not emitted.remote_id or status == 'deleted':
+            return done(True, f"Event removed from {calendar} Calendar")
+        if status == 'edited':
+            return done(False, f"Event was changed in your {calendar} Calendar, not removed")
+        return {'event': None, 'remote_id': emitted.remote_id, 'etag': emitted.etag,
+                'calendar_id': emitted.calendar_id}, None
+
+    if emitted is None:
+        return {'event': event_data, 'remote_id': None, 'etag': None, 'calendar_id': calendar_id}, None
+    if status == 'deleted':
+        return done(False, f"Event was deleted from your {calendar} Calendar, not added again")
+    # The user's own version counts as sent when it matches the event
+    if status == 'edited':
+        unchanged = emitted.remote_hash == event_content_hash(event_data, recurrence=False)
+    else:
+        unchanged = emitted.content_hash == event_content_hash(event_data)
+    if unchanged:
+        return done(True, f"Already in your {calendar} Calendar, not added again")
+    if status == 'edited':
+        return done(False, f"Event was changed in your {calendar} Calendar, not overwritten")
+    if not emitted.remote_id:
+        return {'event': event_data, 'remote_id': None, 'etag': None, 'calendar_id': calendar_id}, None
+    return {'event': event_data, 'remote_id': emitted.remote_id, 'etag': emitted.etag,
+            'calendar_id': emitted.calendar_id}, None
+
+
+def pull_remote_changes(user, calendar):
+    """
+    Bring the index of a user's calendars up to date with the changes made in them (the caller commits).
+
+    Args:
+        user (User): The user
+        calendar (str): "Google" or "Outlook"
+
+    Returns:
+        int: Number of indexed events found changed
+
+    Raises:
+        calendar_sync.SyncError: If the changes could not be pulled
+    """
+    rows = EmittedEvent.query.filter(EmittedEvent.user_id == user.id, EmittedEvent.calendar == calendar,
+                                     EmittedEvent.remote_id.isnot(None)).all()
+    # Each calendar holding sent events (the default one and any course calendars) has its own cursor
+    found = 0
+    for calendar_id in {row.calendar_id for row in rows}:
+        emitted = {row.remote_id: row for row in rows if row.calendar_id == calendar_id}
+        found += pull_calendar_changes(user, calendar, calendar_id, emitted)
+    if found:
+        logger.info(f"{found} events of user {user.id} changed in their {calendar} Calendar")
+    return found
+
+
+def pull_calendar_changes(user, calendar, calendar_id, emitted):
+    """
+    Pull the changes made in one of a user's calendars into its index rows (the caller commits).
+
+    Args:
+        user (User): The user
+        calendar (str): "Google" or "Outlook"
+        calendar_id (str): Secondary calendar (None for the default)
+        emitted (dict): The calendar's EmittedEvent rows by remote id
+
+    Returns:
+        int: Number of indexed events found changed
+    """
+    cursor = SyncCursor.query.filter_by(user_id=user.id, calendar=calendar, calendar_id=calendar_id or '').first()
+    try:
+        changes, next_cursor = PULLERS[calendar](cursor.cursor if cursor else None, user=user, calendar_id=calendar_id)
+    except SyncCursorExpired:
+        logger.info(f"{calendar} sync cursor of user {user.id} expired, listing in full")
+        changes, next_cursor = PULLERS[calendar](None, user=user, calendar_id=calendar_id)
+
+    found = 0
+    for change in changes:
+        row = emitted.get(change['remote_id'])
+        # Our own writes come back with the etag they were recorded with
+        if row is None or (change['etag'] == row.etag and not change['removed']):
+            continue
+        found += 1
+        if change['removed']:
+            row.remote_status = 'deleted'
+            continue
+        row.etag = change['etag']
+        # Rows recorded before display_hash existed match for one-off events
+        if change['content_hash'] == (row.display_hash or row.content_hash):
+            row.remote_status, row.remote_hash = None, None
+        else:
+            row.remote_status, row.remote_hash = 'edited', change['content_hash']
+
+    if next_cursor:
+        if cursor is None:
+            cursor = SyncCursor(user_id=user.id, calendar=calendar, calendar_id=calendar_id or '')
+            db.session.add(cursor)
+        cursor.cursor = next_cursor
+        cursor.updated_at = datetime.utcnow()
+    return found
+
+
+def get_course_calendar(user, calendar, course):
+    """
+    Get a user's secondary calendar for a course, creating it on first use.
+
+    Args:
+        user (User): The user
+        calendar (str): "Google" or "Outlook"
+        course (str): The course code, used as the calendar's name
+
+    Returns:
+        tuple: (calendar_id, error) where error is None on success and a
+               message (with calendar_id None) otherwise
+    """
+    course_calendar = CourseCalendar.query.filter_by(user_id=user.id, calendar=calendar, course=course).first()
+    if course_calendar is not None:
+        return course_calendar.remote_id, None
+
+    calendar_id, error = CALENDAR_CREATORS[calendar](course, user=user)
+    if error:
+        return None, error
+    # Committed at once, so a calendar is never created twice for a course
+    db.session.add(CourseCalendar(user_id=user.id, calendar=calendar, course=course, remote_id=calendar_id))
+    db.session.commit()
+    logger.info(f"Created {calendar} calendar for {course} of user {user.id}")
+    return calendar_id, None
+
+
+def drop_course_calendar(user, calendar, course):
+    """
+    Delete a user's secondary calendar for a course with all its events (the caller commits).
+
+    Args:
+        user (User): The user
+        calendar (str): "Google" or "Outlook"
+        course (str): The course code
+
+    Returns:
+        dict: The result ("success", "message", "retry")
+    """
+    course_calendar = CourseCalendar.query.filter_by(user_id=user.id, calendar=calendar, course=course).first()
+    if course_calendar is None:
+        return {'success': True, 'message': f"{course} calendar removed from {calendar}", 'retry': False}
+
+    success, message = CALENDAR_DELETERS[calendar](course_calendar.remote_id, user=user)
+    if success:
+        for model in (EmittedEvent, SyncCursor):
+            model.query.filter_by(user_id=user.id, calendar=calendar,
+                                  calendar_id=course_calendar.remote_id).delete(synchronize_session='fetch')
+        db.session.delete(course_calendar)
+    return {'success': success, 'message': message, 'retry': True}
+
+
+def enqueue_pushes(user, batch, calendar, events_data, removed=(), course_calendars=False):
+    """
+    Write pushes to the outbox (the caller commits).
+
+    Args:
+        user (User): The user whose calendar the events go to
+        batch (str): Identifies the generate request, for status polling
+        calendar (str): "Google" or "Outlook"
+        events_data (list): Event data dictionaries to add or update
+        removed (list): EmittedEvent rows of events to delete (optional)
+        course_calendars (bool): Add each course's events to a calendar of
+            its own (events without a course go to the default calendar)
+    """
+    for event_data in events_data:
+        db.session.add(OutboxPush(
+            user_id=user.id,
+            batch=batch,
+            calendar=calendar,
+            course_calendar=course_calendars and bool(event_data.get('course')),
+            title=event_data.get('title') or 'Event',
+            event=dump_events([event_data]),
+        ))
+    for emitted in removed:
+        db.session.add(OutboxPush(
+            user_id=user.id,
+            batch=batch,
+            calendar=calendar,
+            action='delete',
+            title=emitted.title or 'Event',
+            event=dump_events([{'uid': emitted.uid}]),
+        ))
+
+
+def enqueue_calendar_drop(user, batch, calendar, course):
+    """
+    Write the removal of a course's calendar to the outbox (the caller commits).
+
+    Args:
+        user (User): The user
+        batch (str): Identifies the request, for status polling
+        calendar (str): "Google" or "Outlook"
+        course (str): The course code
+    """
+    db.session.add(OutboxPush(
+        user_id=user.id,
+        batch=batch,
+        calendar=calendar,
+        action='drop_calendar',
+        title=f"{course} calendar",
+        event=dump_events([{'uid': f"course-calendar:{course}", 'course': course}]),
+    ))
+
+
+def get_batch_status(user, batch):
+    """
+    Get the state of the pushes of one generate request.
+
+    Args:
+        user (User): The user who made the request
+        batch (str): The request's batch id
+
+    Returns:
+        dict: "done" (every push has been attempted) and "results", one per
+              push with its title, calendar, status (pending, sending, sent,
+              retrying or failed), success and message
+    """
+    pushes = OutboxPush.query.filter_by(user_id=user.id, batch=batch).order_by(OutboxPush.id).all()
+    results = []
+    for push in pushes:
+        # A failed push waiting for its next attempt is reported as retrying
+        status = 'retrying' if push.status == 'pending' and push.attempts else push.status
+        results.append({
+            'title': push.title,
+            'calendar': push.calendar,
+            'status': status,
+            'success': status == 'sent',
+            'message': push.message or ("Waiting to be sent" if status == 'pending' else "Sending"),
+        })
+    return {
+        'done': all(result['status'] in ('sent', 'failed', 'retrying') for result in results),
+        'results': results,
+    }
+
+
+def record_emitted_event(user, calendar, event_data, remote_id=None, etag=None, calendar_id=None):
+    """
+    Record an event sent to one of a user's calendars in the emitted-UID index (the caller commits).
+
+    Args:
+        user (User): The user
+        calendar (str): "Google" or "Outlook"
+        event_data (dict): Event data with its "uid"
+        remote_id (str): The event's id in the calendar
+        etag (str): The event's etag in the calendar
+        calendar_id (str): The secondary calendar the event is in (None for the default)
+    """
+    emitted = EmittedEvent.query.filter_by(user_id=user.id, calendar=calendar, uid=event_data['uid']).first()
+    if emitted is None:
+        emitted = EmittedEvent(user_id=user.id, calendar=calendar, uid=event_data['uid'])
+        db.session.add(emitted)
+    emitted.content_hash = event_content_hash(event_data)
+    emitted.display_hash = event_content_hash(event_data, recurrence=False)
+    emitted.remote_id = remote_id or emitted.remote_id
+    emitted.etag = etag or emitted.etag
+    emitted.calendar_id = calendar_id
+    emitted.title = event_data.get('title')
+    emitted.course = event_data.get('course')
+    emitted.remote_status, emitted.remote_hash = None, None
+    emitted.updated_at = datetime.utcnow()
+
+
+def claim_pushes(now=None):
+    """
+    Claim the due pushes of one user and calendar.
+
+    The claim is a conditional update, so concurrent workers (in this or
+    other processes) never claim the same push, nor pushes of a user and
+    calendar while another claim on them is live: sends to one calendar
+    never overlap. Claiming counts as an attempt, so a push whose worker
+    keeps dying is given up too.
+
+    Args:
+        now (datetime): Current UTC time (optional)
+
+    Returns:
+        list: The claimed OutboxPush rows (empty if nothing is due)
+    """
+    now = now or datetime.utcnow()
+    lease_start = now - timedelta(seconds=LEASE_SECONDS)
+    expired = and_(OutboxPush.status == 'sending', OutboxPush.claimed_at < lease_start)
+    OutboxPush.query.filter(expired, OutboxPush.attempts >= MAX_ATTEMPTS).update(
+        {'status': 'failed', 'claimed_by': None, 'message': "Sending stopped without an answer"},
+        synchronize_session=False)
+
+    due = or_(and_(OutboxPush.status == 'pending', OutboxPush.next_attempt_at <= now), expired)
+    claim = uuid.uuid4().hex
+    live = aliased(OutboxPush)
+    # Rows this claim takes are not a claim by someone else (SQLite sees them taken mid-update)
+    claimed = exists().where(live.user_id == OutboxPush.user_id, live.calendar == OutboxPush.calendar,
+                             live.status == 'sending', live.claimed_at >= lease_start, live.claimed_by != claim)
+    first = OutboxPush.query.filter(due, ~claimed).order_by(OutboxPush.id).first()
+    if first is None:
+        db.session.commit()
+        return []
+
+    ids = [push_id for (push_id,) in db.session.query(OutboxPush.id)
+           .filter(due, OutboxPush.user_id == first.user_id, OutboxPush.calendar == first.calendar)
+           .order_by(OutboxPush.id).limit(MAX_CLAIM)]
+    OutboxPush.query.filter(OutboxPush.id.in_(ids), due, ~claimed).update(
+        {'status': 'sending', 'claimed_by': claim, 'claimed_at': now, 'attempts': OutboxPush.attempts + 1},
+        synchronize_session=False)
+    db.session.commit()
+    return OutboxPush.query.filter_by(claimed_by=claim).order_by(OutboxPush.id).all()
+
+
+def finish_push(push, result, now):
+    """
+    Record the outcome of a claimed push, scheduling a retry if it may succeed later.
+
+    Args:
+        push (OutboxPush): The push
+        result (dict): Its result ("success", "message", "retry")
+        now (datetime): Current UTC time
+    """
+    push.message = result['message']
+    push.claimed_by = None
+    if result['success']:
+        push.status = 'sent'
+    elif not result.get('retry', True) or push.attempts >= MAX_ATTEMPTS:
+        push.status = 'failed'
+    else:
+        push.status = 'pending'
+        push.next_attempt_at = now + timedelta(seconds=RETRY_DELAY * 2 ** (push.attempts - 1))
+
+
+def send_pushes(pushes, now=None):
+    """
+    Send claimed pushes (all of one user and calendar) and record the outcome.
+
+    Each push is turned into a change against the emitted-event index at the
+    time it is sent, so pushes that were retried or enqueued twice never
+    write an event twice. Course calendars are dropped before any event is
+    sent, so a replaced course's events go into a new calendar.
+
+    Args:
+        pushes (list): Claimed OutboxPush rows
+        now (datetime): Current UTC time (optional)
+    """
+    if not pushes:
+        return
+    calendar = pushes[0].calendar
+    user = db.session.get(User, pushes[0].user_id)
+    events_data = [load_events(push.event)[0] for push in pushes]
+    results = [None] * len(pushes)
+    changes = {}
+
+    if user is None:
+        results = [{'success': False, 'message': "User no longer exists", 'retry': False}] * len(pushes)
+    else:
+        for index, push in enumerate(pushes):
+            if push.action == 'drop_calendar':
+                results[index] = drop_course_calendar(user, calendar, events_data[index]['course'])
+        try:
+            pull_remote_changes(user, calendar)
+        except Exception as e:
+            # Patches and deletes still carry If-Match, so no edit is overwritten
+            logger.warning(f"Could not pull {calendar} changes of user {user.id}: {str(e)}")
+
+    emitted = {row.uid: row for row in EmittedEvent.query.filter(
+        EmittedEvent.user_id == pushes[0].user_id, EmittedEvent.calendar == calendar,
+        EmittedEvent.uid.in_({event_data['uid'] for event_data in events_data}))}
+
+    # Only the latest push of an event is sent; earlier ones share its result
+    latest = {event_data['uid']: index for index, (push, event_data) in enumerate(zip(pushes, events_data))
+              if push.action != 'drop_calendar'}
+    course_calendars = {}
+    for index in latest.values():
+        push, event_data = pushes[index], events_data[index]
+        if user is None:
+            continue
+        calendar_id = None
+        if push.course_calendar and push.action == 'upsert':
+            course = event_data['course']
+            if course not in course_calendars:
+                course_calendars[course] = get_course_calendar(user, calendar, course)
+            calendar_id, error = course_calendars[course]
+            if error:
+                results[index] = {'success': False, 'message': error, 'retry': True}
+                continue
+        change, results[index] = resolve_change(emitted.get(event_data['uid']),
+                                                None if push.action == 'delete' else event_data, calendar, calendar_id)
+        if change is not None:
+            changes[index] = change
+
+    if changes:
+        try:
+            sent = PUSHERS[calendar](list(changes.values()), user=user)
+        except Exception as e:
+            logger.error(f"{calendar} push failed: {str(e)}")
+            sent = [{'success': False, 'message': f"Error syncing event to {calendar} Calendar: {str(e)}",
+                     'retry': True}] * len(changes)
+        for (index, change), result in zip(changes.items(), sent):
+            results[index] = result
+            uid = events_data[index]['uid']
+            if not result['success']:
+                continue
+            if pushes[index].action == 'delete':
+                db.session.delete(emitted[uid])
+            else:
+                record_emitted_event(user, calendar, events_data[index], result.get('remote_id'), result.get('etag'),
+                                     change.get('calendar_id'))
+
+    now = now or datetime.utcnow()
+    for index, (push, event_data) in enumerate(zip(pushes, events_data)):
+        finish_push(push, results[index] or results[latest[event_data['uid']]], now)
+    db.session.commit()
+    logger.info(f"Synced {len(changes)} changes for {len(pushes)} {calendar} pushes of user {pushes[0].user_id}")
+
+
+def drain_outbox(now=None):
+    """
+    Send every push that is due, in this thread.
+
+    Args:
+        now (datetime): Current UTC time (optional)
+
+    Returns:
+        int: Number of pushes attempted
+    """
+    attempted = 0
+    while True:
+        pushes = claim_pushes(now)
+        if not pushes:
+            return attempted
+        try:
+            send_pushes(pushes, now)
+        except Exception as e:
+            # Left claimed, the pushes would only be claimed again once their lease ran out
+            logger.error(f"Sending {len(pushes)} {pushes[0].calendar} pushes failed: {str(e)}")
+            db.session.rollback()
+            for push in pushes:
+                finish_push(push, {'success': False, 'message': f"Error sending to {push.calendar}: {str(e)}",
+                                   'retry': True}, now or datetime.utcnow())
+            db.session.commit()
+        attempted += len(pushes)
+
+
+class OutboxWorker:
+    """
+    Pool of daemon threads draining the outbox.
+    """
+
+    def __init__(self, app, threads=OUTBOX_WORKERS, poll_interval=POLL_INTERVAL):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        """Start the threads, in this process, if they are not running."""
+        # Threads do not survive a fork, so a forked web worker starts its own
+        if self._pid == os.getpid() or self.threads <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for index in range(self.threads):
+                threading.Thread(target=self._run, name=f"outbox-{index}", daemon=True).start()
+
+    def notify(self):
+        """Wake the threads, e.g. after pushes were enqueued."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    attempted = drain_outbox()
+            except Exception as e:
+                logger.error(f"Outbox worker error: {str(e)}")
+                attempted = 0
+            if not attempted:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
@@ -0,0 +1,192 @@
+"""
+Calendar Sync Module
+
+This module pulls the changes users made in their own calendars since the
+last sync, so that pushes can leave those changes alone. Only changes are
+fetched: Google Calendar answers an events listing made with a syncToken
+with the events changed since that token was issued, and a new
+nextSyncToken; Microsoft Graph answers a calendar view delta query's
+deltaLink with the events changed since, and a new deltaLink. The first
+pull of a user's calendar lists it in full to get its first cursor.
+
+Each change is reduced to the event's id, etag, whether it was removed, and
+a hash of the fields the app sends, comparable with
+calendar_generator.event_content_hash of event data.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+import http_client
+from calendar_generator import event_content_hash
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_EVENTS_URL = "https://www.googleapis.com/calendar/v3/calendars/primary/events"
+GOOGLE_CALENDAR_EVENTS_URL = "https://www.googleapis.com/calendar/v3/calendars/{calendar_id}/events"
+GRAPH_DELTA_URL = "https://graph.microsoft.com/v1.0/me/calendarView/delta"
+
+# Events per page of a listing
+GOOGLE_PAGE_SIZE = 2500
+GRAPH_PAGE_SIZE = 200
+
+# Days before and after the first pull that a Graph delta cursor covers
+# (a calendar view delta query is bound to a date range)
+GRAPH_WINDOW_PAST = 365
+GRAPH_WINDOW_FUTURE = 730
+
+# Pages followed in one pull before giving up
+MAX_PAGES = 100
+
+
+class SyncError(Exception):
+    """Raised when changes could not be pulled from a calendar."""
+
+
+class SyncCursorExpired(SyncError):
+    """Raised when the provider no longer accepts a cursor; pull again without one."""
+
+
+def pull_google_changes(access_token, sync_token=None, events_url=GOOGLE_EVENTS_URL):
+    """
+    Pull the events changed in a Google Calendar since a sync token.
+
+    Args:
+        access_token (str): Google OAuth access token
+        sync_token (str): nextSyncToken of the last pull (None for a full listing)
+        events_url (str): Events endpoint of the calendar (defaults to the primary)
+
+    Returns:
+        tuple: (changes, next_sync_token)
+
+    Raises:
+        SyncCursorExpired: If Google no longer accepts the sync token (410)
+        SyncError: If the listing failed
+    """
+    params = {'maxResults': GOOGLE_PAGE_SIZE}
+    if sync_token:
+        params['syncToken'] = sync_token
+
+    changes = []
+    for _ in range(MAX_PAGES):
+        response = http_client.get(events_url, headers={'Authorization': f"Bearer {access_token}"}, params=params)
+        if response.status_code == 410:
+            raise SyncCursorExpired("Google sync token expired")
+        if response.status_code != 200:
+            raise SyncError(f"Could not list Google Calendar changes: {response.status_code}")
+
+        data = response.json()
+        changes.extend(google_change(item) for item in data.get('items', []))
+        if data.get('nextSyncToken'):
+            return changes, data['nextSyncToken']
+        params = {'maxResults': GOOGLE_PAGE_SIZE, 'pageToken': data['nextPageToken']}
+        if sync_token:
+            params['syncToken'] = sync_token
+    raise SyncError("Too many pages of Google Calendar changes")
+
+
+def pull_graph_changes(access_token, delta_link=None, delta_url=GRAPH_DELTA_URL, now=None):
+    """
+    Pull the events changed in the user's Outlook calendar since a delta link.
+
+    Args:
+        access_token (str): Microsoft Graph access token
+        delta_link (str): @odata.deltaLink of the last pull (None to start
+            over with a full listing of the window around now)
+        delta_url (str): Calendar view delta endpoint
+        now (datetime): Current UTC time (optional)
+
+    Returns:
+        tuple: (changes, next_delta_link)
+
+    Raises:
+        SyncCursorExpired: If Graph no longer accepts the delta link (410)
+        SyncError: If the listing failed
+    """
+    headers = {
+        'Authorization': f"Bearer {access_token}",
+        'Prefer': f'odata.maxpagesize={GRAPH_PAGE_SIZE}, outlook.timezone="UTC", outlook.body-content-type="text"',
+    }
+    url, params = delta_link, None
+    if not url:
+        now = now or datetime.utcnow()
+        url = delta_url
+        params = {
+            'startDateTime': (now - timedelta(days=GRAPH_WINDOW_PAST)).strftime('%Y-%m-%dT00:00:00Z'),
+            'endDateTime': (now + timedelta(days=GRAPH_WINDOW_FUTURE)).strftime('%Y-%m-%dT00:00:00Z'),
+        }
+
+    changes = []
+    for _ in range(MAX_PAGES):
+        response = http_client.get(url, headers=headers, params=params)
+        if response.status_code == 410:
+            raise SyncCursorExpired("Graph delta link expired")
+        if response.status_code != 200:
+            raise SyncError(f"Could not list Outlook Calendar changes: {response.status_code}")
+
+        data = response.json()
+        changes.extend(graph_change(item) for item in data.get('value', []))
+        if data.get('@odata.deltaLink'):
+            return changes, data['@odata.deltaLink']
+        url, params = data['@odata.nextLink'], None
+    raise SyncError("Too many pages of Outlook Calendar changes")
+
+
+def google_change(item):
+    """Reduce a Google Calendar event resource to a change."""
+    removed = item.get('status') == 'cancelled'
+    return {
+        'remote_id': item['id'],
+        'etag': item.get('etag'),
+        'removed': removed,
+        'content_hash': None if removed else event_content_hash({
+            'title': item.get('summary'),
+            'description': item.get('description'),
+            'location': item.get('location'),
+            'start_time': parse_remote_time(item.get('start')),
+            'end_time': parse_remote_time(item.get('end')),
+        }, recurrence=False),
+    }
+
+
+def graph_change(item):
+    """Reduce a Graph event resource (or @removed entry) to a change."""
+    removed = '@removed' in item or item.get('isCancelled', False)
+    return {
+        'remote_id': item['id'],
+        'etag': item.get('@odata.etag'),
+        'removed': removed,
+        'content_hash': None if removed else event_content_hash({
+            'title': item.get('subject'),
+            'description': (item.get('body') or {}).get('content'),
+            'location': (item.get('location') or {}).get('displayName'),
+            'start_time': parse_remote_time(item.get('start')),
+            'end_time': parse_remote_time(item.get('end')),
+        }, recurrence=False),
+    }
+
+
+def parse_remote_time(value):
+    """
+    Parse a provider's start/end into a naive UTC datetime, as events are sent.
+
+    Args:
+        value (dict): {"dateTime": ..., "timeZone": ...}; a dateTime without
+            an offset is taken as UTC (Graph answers in UTC when asked to)
+
+    Returns:
+        datetime: The time, or None for all-day or missing times
+    """
+    date_time = (value or {}).get('dateTime')
+    if not date_time:
+        return None
+    # Graph gives seven fractional digits, more than fromisoformat accepts
+    main, _, fraction = date_time.partition('.')
+    offset = ''
+    for sign in ('+', '-', 'Z'):
+        if sign in fraction:
+            offset = fraction[fraction.index(sign):]
+    parsed = datetime.fromisoformat(main + offset.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
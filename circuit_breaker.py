@@ -0,0 +1,136 @@
+"""
+Circuit Breaker Module
+
+This module stops the app from waiting on a provider that is down. Every
+call to Google or Microsoft goes through the breaker of its endpoint family
+(sign-in, Calendar, Graph). After FAILURE_THRESHOLD failed calls in a row
+the breaker opens, and calls to that family fail at once with a clear
+message instead of each holding a worker for its timeouts. Once
+RESET_TIMEOUT has passed, one call is let through as a probe (half-open):
+if it succeeds the breaker closes, otherwise it stays open for another
+RESET_TIMEOUT.
+
+Breakers live in process memory; each worker process learns of an outage
+from its own calls.
+"""
+
+import time
+import logging
+import threading
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Failed calls in a row that open a breaker
+FAILURE_THRESHOLD = 5
+
+# Seconds a breaker stays open before a probe call is let through
+RESET_TIMEOUT = 30
+
+# Endpoint families by host; other hosts get a breaker of their own
+ENDPOINT_FAMILIES = {
+    'accounts.google.com': 'Google sign-in',
+    'oauth2.googleapis.com': 'Google sign-in',
+    'openidconnect.googleapis.com': 'Google sign-in',
+    'www.googleapis.com': 'Google Calendar',
+    'login.microsoftonline.com': 'Microsoft sign-in',
+    'graph.microsoft.com': 'Microsoft Graph',
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint family whose breaker is open."""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} is unavailable after repeated failures; "
+                         f"not trying again for {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker with a single half-open probe.
+    """
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """The breaker's state: closed, open or half-open (a probe may be sent)."""
+        with self._lock:
+            if self.failures < self.failure_threshold:
+                return 'closed'
+            if self._clock() < self.opened_at + self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def allow(self):
+        """
+        Check that a call may be made.
+
+        When the breaker is half-open the caller becomes the probe, and other
+        callers keep failing fast until it reports back (or until another
+        RESET_TIMEOUT passes, should it never do so).
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+        """
+        with self._lock:
+            if self.failures < self.failure_threshold:
+                return
+            now = self._clock()
+            retry_in = self.opened_at + self.reset_timeout - now
+            if retry_in > 0:
+                raise CircuitOpenError(self.name, retry_in)
+            self.opened_at = now
+        logger.info(f"Circuit for {self.name} half-open, probing")
+
+    def record_success(self):
+        """Record a successful call, closing the breaker."""
+        with self._lock:
+            recovered = self.failures >= self.failure_threshold
+            self.failures = 0
+            self.opened_at = None
+        if recovered:
+            logger.info(f"Circuit for {self.name} closed, provider recovered")
+
+    def record_failure(self):
+        """Record a failed call, opening the breaker once failures reach the threshold."""
+        with self._lock:
+            self.failures += 1
+            if self.failures < self.failure_threshold:
+                return
+            self.opened_at = self._clock()
+        logger.warning(f"Circuit for {self.name} open after {self.failures} failures in a row")
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    """
+    Get the breaker of the endpoint family a URL belongs to.
+
+    Args:
+        url (str): URL about to be called
+
+    Returns:
+        CircuitBreaker: The family's breaker, created on first use
+    """
+    host = urlsplit(url).netloc.lower()
+    name = ENDPOINT_FAMILIES.get(host.split(':')[0], host)
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
@@ -12,6 +12,11 @@ from dateutil import parser, tz
 
 logger = logging.getLogger(__name__)
 
+# Bump when a change alters the results of extract_structured_events /
+# extract_dates_from_text; memoized results of older versions are then ignored
+STRUCTURED_EVENTS_VERSION = 1
+DATE_CANDIDATES_VERSION = 1
+
 # Regex patterns for date extraction
 DATE_PATTERNS = [
     # Common date formats (MM/DD/YYYY, DD/MM/YYYY, YYYY/MM/DD)
@@ -6,6 +6,7 @@ and extracting their content for date processing.
 """
 
 import os
+import re
 import logging
 from io import BytesIO
 
@@ -144,4 +145,237 @@ def extract_text_from_file(file_path):
         return text
     except Exception as e:
         logger.error(f"Failed to extract text from {file_path}: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# Assessment tables are recognised by a header line that names both a
+# weight column and a date column (e.g. "Assessment | Weight | Due Date").
+WEIGHT_HEADER_PATTERN = re.compile(r'^weight', re.IGNORECASE)
+DATE_HEADER_PATTERN = re.compile(r'\bdate\b', re.IGNORECASE)
+WEIGHT_PATTERN = re.compile(r'(?<![\d.])\d{1,3}(?:\.\d+)?\s*%$')
+TOTAL_ROW_PATTERN = re.compile(r'^total\b', re.IGNORECASE)
+
+# Fragments whose baselines differ by less than this (in points) share a line
+LINE_TOLERANCE = 2.0
+# A vertical gap larger than this (in points) ends the table
+MAX_ROW_GAP = 45.0
+# Longer single lines are running prose rather than table cells
+MAX_CELL_LINE = 60
+
+
+def extract_assessment_tables(file_path):
+    """
+    Rebuild assessment tables (component / weight / due date grids) from a document.
+    
+    PDF tables are reconstructed from text positions, since PyPDF2's plain text
+    output interleaves the cells of neighbouring columns. Word tables are read
+    row by row. Each table is returned as a dictionary:
+        - header: list of column header strings
+        - rows: list of rows, each a dictionary with
+            - cells: one list of text pieces per column
+            - text: the row text in reading order
+    
+    Args:
+        file_path (str): Path to the document
+        
+    Returns:
+        list: Assessment tables found in the document (empty if none)
+    """
+    file_extension = os.path.splitext(file_path)[1].lower()
+    
+    try:
+        if file_extension == '.pdf':
+            return extract_pdf_assessment_tables(file_path)
+        elif file_extension == '.docx':
+            # python-docx reads only the Office Open XML format, not legacy .doc
+            return extract_word_assessment_tables(file_path)
+    except Exception as e:
+        # Table reconstruction is best effort; the plain text path still applies
+        logger.warning(f"Could not rebuild assessment tables from {file_path}: {e}")
+    
+    return []
+
+
+def extract_pdf_assessment_tables(file_path):
+    """
+    Rebuild assessment tables from the text positions of a PDF file.
+    
+    Args:
+        file_path (str): Path to the PDF file
+        
+    Returns:
+        list: Assessment tables (see extract_assessment_tables)
+    """
+    import PyPDF2
+    
+    tables = []
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page in pdf_reader.pages:
+            lines = _collect_pdf_lines(page)
+            
+            # Single pass over the page lines: a header line opens a table and
+            # the following lines are folded into its rows
+            index = 0
+            while index < len(lines):
+                texts = [text for _, text in lines[index]['fragments']]
+                if any(WEIGHT_HEADER_PATTERN.match(t) for t in texts) and \
+                   any(DATE_HEADER_PATTERN.search(t) for t in texts):
+                    table, index = _collect_pdf_table(lines, index)
+                    if table['rows']:
+                        tables.append(table)
+                else:
+                    index += 1
+    
+    return tables
+
+
+def extract_word_assessment_tables(file_path):
+    """
+    Read assessment tables from a Microsoft Word document.
+    
+    Args:
+        file_path (str): Path to the Word document
+        
+    Returns:
+        list: Assessment tables (see extract_assessment_tables)
+    """
+    import docx
+    
+    tables = []
+    doc = docx.Document(file_path)
+    for doc_table in doc.tables:
+        if not doc_table.rows:
+            continue
+        
+        header = [cell.text.strip() for cell in doc_table.rows[0].cells]
+        if not any(WEIGHT_HEADER_PATTERN.match(h) for h in header) or \
+           not any(DATE_HEADER_PATTERN.search(h) for h in header):
+            continue
+        
+        rows = []
+        for doc_row in doc_table.rows[1:]:
+            cells = [[piece.strip() for piece in cell.text.split('\n') if piece.strip()]
+                     for cell in doc_row.cells]
+            text = ' '.join(' '.join(cell) for cell in cells)
+            if TOTAL_ROW_PATTERN.match(text.strip()) or any(
+                    TOTAL_ROW_PATTERN.match(piece) for cell in cells for piece in cell):
+                break
+            rows.append({'cells': cells, 'text': text})
+        
+        if rows:
+            tables.append({'header': header, 'rows': rows})
+    
+    return tables
+
+
+def _collect_pdf_lines(page):
+    """
+    Group the positioned text fragments of a PDF page into lines, top to bottom.
+    
+    Fragments that PyPDF2 split out of a single word or number (e.g. "1", "0",
+    "%" or "Participatio", "n") are glued back together within each line.
+    """
+    fragments = []
+    
+    def visitor(text, cm, tm, font_dict, font_size):
+        text = text.strip()
+        if text:
+            x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+            y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+            scale = abs(tm[0] * cm[0]) or 1.0
+            fragments.append((x, y, text, (font_size or 10.0) * scale))
+    
+    page.extract_text(visitor_text=visitor)
+    fragments.sort(key=lambda fragment: (-fragment[1], fragment[0]))
+    
+    lines = []
+    for x, y, text, size in fragments:
+        if lines and abs(lines[-1]['y'] - y) <= LINE_TOLERANCE:
+            lines[-1]['fragments'].append((x, text, size))
+        else:
+            lines.append({'y': y, 'fragments': [(x, text, size)]})
+    
+    for line in lines:
+        pieces = []
+        end = None
+        for x, text, size in sorted(line['fragments']):
+            # Average glyph width is roughly half the font size
+            if pieces and x - end < size * 0.6 and _is_split_fragment(pieces[-1][1], text):
+                pieces[-1] = (pieces[-1][0], pieces[-1][1] + text)
+            else:
+                pieces.append((x, text))
+            end = x + len(text) * size * 0.5
+        line['fragments'] = pieces
+    
+    return lines
+
+
+def _is_split_fragment(previous, text):
+    """Check whether a fragment continues the previous one without a space."""
+    return (
+        text[:1] in ('%', '-', ',') or previous.endswith(('-', '/')) or
+        (previous[-1:].isdigit() and text[:1].isdigit() and len(text) <= 2) or
+        (len(text) == 1 and text.islower()) or
+        (len(previous) == 1 and previous.isalpha())
+    )
+
+
+def _collect_pdf_table(lines, header_index):
+    """
+    Fold the lines following a header line into table rows.
+    
+    A line holding a weight (e.g. "10%") starts a new row; other lines are
+    wrapped cell text and are appended to the current row.
+    
+    Returns:
+        tuple: (table, index of the first line after the table)
+    """
+    header_line = lines[header_index]
+    columns = [x for x, _ in header_line['fragments']]
+    table = {'header': [text for _, text in header_line['fragments']], 'rows': []}
+    
+    last_y = header_line['y']
+    index = header_index + 1
+    while index < len(lines):
+        line = lines[index]
+        texts = [text for _, text in line['fragments']]
+        # Stop at large gaps, the "Total" row and running prose (page footers)
+        if last_y - line['y'] > MAX_ROW_GAP or \
+           any(TOTAL_ROW_PATTERN.match(t) or len(t) > MAX_CELL_LINE for t in texts):
+            break
+        
+        cells = [[] for _ in columns]
+        for x, text in line['fragments']:
+            column = min(range(len(columns)), key=lambda c: abs(columns[c] - x))
+            cells[column].append(text)
+        line_text = ' '.join(texts)
+        
+        if any(WEIGHT_PATTERN.search(t) for t in texts):
+            rows = table['rows']
+            # Lower-case text at the top of a cell continues the previous row's
+            # cell (e.g. "Case write-" / "ups")
+            if rows:
+                for column, cell in enumerate(cells):
+                    while cell and cell[0][:1].islower():
+                        _continue_cell(rows[-1]['cells'][column], cell.pop(0))
+            rows.append({'cells': cells, 'text': line_text})
+        elif table['rows']:
+            row = table['rows'][-1]
+            for column, cell in enumerate(cells):
+                for text in cell:
+                    _continue_cell(row['cells'][column], text)
+            row['text'] = f"{row['text']} {line_text}"
+        
+        last_y = line['y']
+        index += 1
+    
+    return table, index
+
+
+def _continue_cell(cell, text):
+    """Append wrapped text from a following line to the last piece of a cell."""
+    if cell:
+        separator = '' if cell[-1].endswith('-') else ' '
+        cell[-1] = cell[-1] + separator + text
+    else:
+        cell.append(text)
@@ -0,0 +1,188 @@
+"""
+Extraction Cache Module
+
+This module memoizes the results of the extraction stages (syllabus assessments,
+structured events, raw date candidates) so a document that has been processed
+before is not extracted again.
+
+Entries are keyed by (text hash, stage name, stage version). Each extractor
+module declares the version of its stage; bumping it invalidates only that
+stage's entries. Stages whose results depend on more than the text (e.g. the
+current day) hash those inputs too. An in-process LRU holds recent results
+and an optional directory backend keeps them across reloads and deploys.
+"""
+
+import os
+import copy
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Number of results kept in memory
+DEFAULT_MAX_ENTRIES = 256
+
+
+def hash_inputs(*inputs):
+    """
+    Hash the inputs of an extraction stage.
+
+    Args:
+        *inputs: The document text and any other stage inputs (e.g. rebuilt
+            assessment tables); non-string inputs are hashed by their repr
+
+    Returns:
+        str: Hex digest identifying the inputs
+    """
+    digest = hashlib.sha256()
+    for value in inputs:
+        data = value if isinstance(value, str) else repr(value)
+        digest.update(data.encode('utf-8', errors='replace'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class DirectoryMemoBackend:
+    """
+    Persistent memo backend storing one pickle file per entry.
+
+    Files live under <root>/<stage>/<version>/<hash>.pkl, so a version bump
+    leaves the other stages untouched.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        text_hash, stage, version = key
+        return os.path.join(self.root, stage, str(version), f"{text_hash}.pkl")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                return True, pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {path}: {e}")
+            return False, None
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial entry
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump(value, f)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not store cache entry {path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+class StageMemo:
+    """
+    Memo of extraction stage results with an LRU front and optional backend.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, backend=None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, stage, version, text_hash, compute):
+        """
+        Return the memoized result of a stage, computing it on a miss.
+
+        Args:
+            stage (str): Stage name, e.g. "syllabus_assessments"
+            version: The stage's extractor version
+            text_hash (str): Hash of the stage inputs (see hash_inputs)
+            compute (callable): Produces the result when it is not cached
+
+        Returns:
+            The stage result
+        """
+        return self.get_or_compute_many(stage, version, [text_hash], lambda missing: [compute()])[0]
+
+    def get_or_compute_many(self, stage, version, text_hashes, compute_many):
+        """
+        Return the memoized results of a stage for several inputs, computing the misses in one call.
+
+        Args:
+            stage (str): Stage name, e.g. "syllabus_assessments"
+            version: The stage's extractor version
+            text_hashes (list): Hash of each input's stage inputs (see hash_inputs)
+            compute_many (callable): Given the indices of the inputs that are
+                not cached, produces their results in the same order
+
+        Returns:
+            list: The stage result of each input
+        """
+        results = [None] * len(text_hashes)
+        missing = []
+        for index, text_hash in enumerate(text_hashes):
+            found, value = self._lookup((text_hash, stage, version))
+            if found:
+                results[index] = value
+            else:
+                missing.append(index)
+
+        if missing:
+            for index, value in zip(missing, compute_many(missing)):
+                key = (text_hashes[index], stage, version)
+                self._remember(key, value)
+                if self.backend is not None:
+                    self.backend.set(key, value)
+                results[index] = copy.deepcopy(value)
+        return results
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True, copy.deepcopy(self._entries[key])
+
+        if self.backend is not None:
+            found, value = self.backend.get(key)
+            if found:
+                self._remember(key, value)
+                return True, copy.deepcopy(value)
+        return False, None
+
+    def _remember(self, key, value):
+        # Callers get copies, so the cached result cannot be mutated behind our back
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def create_stage_memo():
+    """
+    Create the application's stage memo from the environment.
+
+    EXTRACTION_CACHE_SIZE sets the LRU size; EXTRACTION_CACHE_DIR, when set,
+    enables the persistent directory backend.
+
+    Returns:
+        StageMemo: The configured memo
+    """
+    max_entries = int(os.environ.get("EXTRACTION_CACHE_SIZE", DEFAULT_MAX_ENTRIES))
+    cache_dir = os.environ.get("EXTRACTION_CACHE_DIR")
+    backend = DirectoryMemoBackend(cache_dir) if cache_dir else None
+    return StageMemo(max_entries=max_entries, backend=backend)
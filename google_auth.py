@@ -1,23 +1,31 @@
 import json
 import os
-import requests
+from urllib.parse import quote
+import http_client
 from flask import Blueprint, redirect, request, url_for, session, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from oauthlib.oauth2 import WebApplicationClient
 from datetime import datetime, timedelta
 from app import db, login_manager
-from models import User
+from models import User, save_user_token
+from calendar_generator import get_recurrence_lines
+from calendar_batch import (google_batch_send, build_change_requests, change_result, failed_change,
+                            GOOGLE_EVENTS_PATH, GOOGLE_EVENT_PATH, GOOGLE_CALENDAR_EVENTS_PATH,
+                            GOOGLE_CALENDAR_EVENT_PATH)
+from calendar_sync import pull_google_changes, SyncError, GOOGLE_CALENDAR_EVENTS_URL
+from provider_metadata import get_discovery_document, GOOGLE_DISCOVERY_URL
+from token_manager import TokenManager, TokenRefreshError
 
 # Google OAuth Configuration
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_OAUTH_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_OAUTH_CLIENT_SECRET")
-GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
-GOOGLE_CALENDAR_API_URL = "https://www.googleapis.com/calendar/v3/calendars/primary/events"
+GOOGLE_CALENDARS_API_URL = "https://www.googleapis.com/calendar/v3/calendars"
 SCOPES = [
     "openid",
     "email",
     "profile",
-    "https://www.googleapis.com/auth/calendar.events"  # For adding events to calendar
+    "https://www.googleapis.com/auth/calendar.events",  # For adding events to calendar
+    "https://www.googleapis.com/auth/calendar.app.created"  # For per-course calendars
 ]
 
 # Make sure to use this redirect URL. It has to match the one in the whitelist
@@ -33,7 +41,8 @@ print(f"""To make Google authentication work:
 3. For OAuth consent screen settings:
    - Set User Type to External
    - Add your app name, support email, and developer contact information
-   - Add the following scopes: .../auth/userinfo.email, .../auth/userinfo.profile, .../auth/calendar.events
+   - Add the following scopes: .../auth/userinfo.email, .../auth/userinfo.profile, .../auth/calendar.events,
+     .../auth/calendar.app.created
 4. Add the following Authorized redirect URI:
    {DEV_REDIRECT_URL}
 5. Make sure to enable the Google Calendar API in the API Library
@@ -56,19 +65,26 @@ def load_user(user_id):
 def login():
     """Generate Google login URL and redirect to Google's OAuth 2.0 consent screen"""
     # Find out what URL to hit for Google login
-    google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+    google_provider_cfg = get_discovery_document(GOOGLE_DISCOVERY_URL)
     authorization_endpoint = google_provider_cfg["authorization_endpoint"]
 
     # Log the redirect URI for debugging
     callback_uri = DEV_REDIRECT_URL
     print(f"Using redirect URI: {callback_uri}")
+    consent = request.args.get("consent") == "1"
 
     # Use library to construct the request for Google login
     request_uri = client.prepare_request_uri(
         authorization_endpoint,
         redirect_uri=callback_uri,
         scope=SCOPES,
+        # Ask for a refresh token so pushes keep working after the access token expires;
+        # Google only sends one with the consent screen, which the callback asks
+        # for when the user has no refresh token stored
+        access_type="offline",
+        prompt="consent" if consent else None,
     )
+    session["google_consent"] = consent
     return redirect(request_uri)
 
 @google_auth.route("/google_login/callback")
@@ -78,7 +94,7 @@ def callback():
     code = request.args.get("code")
     
     # Find out what URL to hit to get tokens
-    google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+    google_provider_cfg = get_discovery_document(GOOGLE_DISCOVERY_URL)
     token_endpoint = google_provider_cfg["token_endpoint"]
     
     # Log the details for debugging
@@ -94,7 +110,7 @@ def callback():
     )
     # Only use authentication if both client ID and secret are available
     if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
-        token_response = requests.post(
+        token_response = http_client.post(
             token_url,
             headers=headers,
             data=body,
@@ -102,7 +118,7 @@ def callback():
         )
     else:
         # Fallback without authentication - will likely fail but avoids errors
-        token_response = requests.post(
+        token_response = http_client.post(
             token_url,
             headers=headers,
             data=body,
@@ -114,7 +130,7 @@ def callback():
     # Get user info from Google
     userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
     uri, headers, body = client.add_token(userinfo_endpoint)
-    userinfo_response = requests.get(uri, headers=headers, data=body)
+    userinfo_response = http_client.get(uri, headers=headers, data=body)
     
     # Make sure email is verified with Google
     userinfo = userinfo_response.json()
@@ -134,17 +150,23 @@ def callback():
     
     # If user doesn't exist, create new user
     if not user:
-        user = User(username=users_name, email=users_email, google_token=json.dumps(token_data))
+        user = User(username=users_name, email=users_email)
         db.session.add(user)
-    else:
-        # Update token
-        user.google_token = json.dumps(token_data)
+        db.session.flush()
     
+    # Keep the token with its absolute expiry
+    google_tokens.store(user, token_data)
     db.session.commit()
     
     # Begin user session by logging the user in
     login_user(user)
     
+    # Without a refresh token pushes stop working within the hour; ask once
+    # for the consent screen, which sends one
+    asked_consent = session.pop("google_consent", False)
+    if not google_tokens.has_refresh_token(user) and not asked_consent:
+        return redirect(url_for("google_auth.login", consent="1"))
+    
     # Send user back to homepage
     return redirect(url_for("index"))
 
@@ -156,9 +178,55 @@ def logout():
     flash("Successfully logged out", "success")
     return redirect(url_for("index"))
 
-def add_event_to_google_calendar(event_data):
+def refresh_google_token(refresh_token):
+    """
+    Exchange a Google refresh token for a new access token.
+    
+    Args:
+        refresh_token (str): The refresh token
+        
+    Returns:
+        dict: The token response
+    """
+    # Find out what URL to hit for token refresh
+    google_provider_cfg = get_discovery_document(GOOGLE_DISCOVERY_URL)
+    token_endpoint = google_provider_cfg["token_endpoint"]
+    
+    response = http_client.post(token_endpoint, data={
+        'refresh_token': refresh_token,
+        'client_id': GOOGLE_CLIENT_ID,
+        'client_secret': GOOGLE_CLIENT_SECRET,
+        'grant_type': 'refresh_token'
+    })
+    if response.status_code != 200:
+        raise TokenRefreshError(f"Google token refresh failed: {response.status_code}")
+    return response.json()
+
+
+google_tokens = TokenManager("Google", "google_token", refresh_google_token, save_user_token)
+
+
+def get_google_access_token(user=None):
     """
-    Add an event to the user's Google Calendar
+    Get a user's Google access token, refreshing it if it is about to expire.
+    
+    Args:
+        user (User): The user (optional, defaults to the signed-in user)
+        
+    Returns:
+        tuple: (access_token, error) where error is None on success and a
+               message (with access_token None) otherwise
+    """
+    user = user if user is not None else current_user
+    if not user.is_authenticated or not user.google_token:
+        return None, "User not authenticated with Google"
+    
+    return google_tokens.get_access_token(user)
+
+
+def build_google_event(event_data):
+    """
+    Build the Google Calendar API event resource for an event.
     
     Args:
         event_data (dict): A dictionary containing event information:
@@ -166,91 +234,144 @@ def add_event_to_google_calendar(event_data):
             - end_time: datetime object for the event end
             - title: Event title
             - description: Event description
+            - recurrence: Recurrence rule (optional, see calendar_generator.create_ics_file)
+        
+    Returns:
+        dict: The event resource
+    """
+    event = {
+        'summary': event_data['title'],
+        'description': event_data['description'],
+        'start': {
+            'dateTime': event_data['start_time'].strftime("%Y-%m-%dT%H:%M:%S"),
+            'timeZone': 'UTC',
+        },
+        'end': {
+            'dateTime': event_data['end_time'].strftime("%Y-%m-%dT%H:%M:%S"),
+            'timeZone': 'UTC',
+        },
+    }
+    
+    # Recurring events are sent once with their RRULE/EXDATE lines
+    if event_data.get('recurrence'):
+        event['recurrence'] = get_recurrence_lines(event_data['recurrence'], event_data['start_time'])
+    
+    return event
+
+
+def sync_events_to_google_calendar(changes, user=None):
+    """
+    Apply event changes to the user's Google Calendar with batch requests.
+    
+    Changes are sent GOOGLE_BATCH_SIZE at a time through the batch endpoint,
+    so the number of round trips barely grows with the number of events.
+    
+    Args:
+        changes (list): Change dicts (see calendar_batch.build_change_requests;
+            event data as for build_google_event)
+        user (User): The user (optional, defaults to the signed-in user)
             
     Returns:
-        tuple: (success, message) where success is a boolean and message is a string
+        list: One result dict per change, in the order given (see
+              calendar_batch.change_result)
     """
-    if not current_user.is_authenticated or not current_user.google_token:
-        return False, "User not authenticated with Google"
+    if not changes:
+        return []
     
     try:
-        # Parse token from user record
-        token_data = json.loads(current_user.google_token)
+        access_token, error = get_google_access_token(user)
+        if error:
+            return [failed_change(change, error) for change in changes]
         
-        # Check if token is expired
-        if 'expires_at' in token_data and token_data['expires_at'] < datetime.now().timestamp():
-            # Token is expired, try to refresh
-            refresh_token = token_data.get('refresh_token')
-            if not refresh_token:
-                return False, "No refresh token available"
-            
-            # Refresh the token
-            try:
-                # Find out what URL to hit for token refresh
-                google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
-                token_endpoint = google_provider_cfg["token_endpoint"]
-                
-                # Prepare token refresh request
-                refresh_request = {
-                    'refresh_token': refresh_token,
-                    'client_id': GOOGLE_CLIENT_ID,
-                    'client_secret': GOOGLE_CLIENT_SECRET,
-                    'grant_type': 'refresh_token'
-                }
-                
-                # Make the request
-                try:
-                    response = requests.post(token_endpoint, data=refresh_request)
-                    if response.status_code != 200:
-                        return False, "Failed to refresh token, please log in again"
-                except Exception as conn_error:
-                    return False, f"Could not connect to Google: {str(conn_error)}"
-                
-                # Update token data
-                new_token_data = response.json()
-                # Preserve the refresh token if not returned in the response
-                if 'refresh_token' not in new_token_data and refresh_token:
-                    new_token_data['refresh_token'] = refresh_token
-                
-                # Update user's token in database
-                current_user.google_token = json.dumps(new_token_data)
-                db.session.commit()
-                
-                # Use the new token
-                token_data = new_token_data
-            except Exception as e:
-                return False, f"Error refreshing token: {str(e)}"
+        user_id = (user if user is not None else current_user).id
+        requests = build_change_requests(changes, GOOGLE_EVENTS_PATH, GOOGLE_EVENT_PATH, build_google_event,
+                                         GOOGLE_CALENDAR_EVENTS_PATH, GOOGLE_CALENDAR_EVENT_PATH)
+        responses = google_batch_send(access_token, requests, user_key=user_id)
+    except Exception as e:
+        return [failed_change(change, f"Error syncing event to Google Calendar: {str(e)}") for change in changes]
+    
+    return [change_result(change, status_code, body, "Google", "etag")
+            for change, (status_code, body) in zip(changes, responses)]
+
+
+def pull_google_calendar_changes(sync_token, user=None, calendar_id=None):
+    """
+    Pull the events changed in one of the user's Google Calendars since the last pull.
+    
+    Args:
+        sync_token (str): Cursor of the last pull (None for a full listing)
+        user (User): The user (optional, defaults to the signed-in user)
+        calendar_id (str): A secondary calendar (optional, defaults to the primary)
         
-        # Create event data for Google Calendar API
-        event = {
-            'summary': event_data['title'],
-            'description': event_data['description'],
-            'start': {
-                'dateTime': event_data['start_time'].strftime("%Y-%m-%dT%H:%M:%S"),
-                'timeZone': 'UTC',
-            },
-            'end': {
-                'dateTime': event_data['end_time'].strftime("%Y-%m-%dT%H:%M:%S"),
-                'timeZone': 'UTC',
-            },
-        }
+    Returns:
+        tuple: (changes, next_sync_token) (see calendar_sync.pull_google_changes)
         
-        # Add event to Google Calendar
-        headers = {
-            'Authorization': f"Bearer {token_data['access_token']}",
-            'Content-Type': 'application/json',
-        }
+    Raises:
+        SyncError: If the changes could not be pulled
+    """
+    access_token, error = get_google_access_token(user)
+    if error:
+        raise SyncError(error)
+    if calendar_id:
+        return pull_google_changes(access_token, sync_token,
+                                   GOOGLE_CALENDAR_EVENTS_URL.format(calendar_id=quote(calendar_id, safe='')))
+    return pull_google_changes(access_token, sync_token)
+
+
+def create_google_calendar(name, user=None):
+    """
+    Create a secondary Google Calendar, e.g. for one course's events.
+    
+    Args:
+        name (str): The calendar's name
+        user (User): The user (optional, defaults to the signed-in user)
         
-        response = requests.post(
-            GOOGLE_CALENDAR_API_URL,
-            headers=headers,
-            json=event
-        )
+    Returns:
+        tuple: (calendar_id, error) where error is None on success and a
+               message (with calendar_id None) otherwise
+    """
+    try:
+        access_token, error = get_google_access_token(user)
+        if error:
+            return None, error
         
+        response = http_client.post(
+            GOOGLE_CALENDARS_API_URL,
+            headers={'Authorization': f"Bearer {access_token}"},
+            json={'summary': name}
+        )
         if response.status_code == 200:
-            return True, "Event added to Google Calendar successfully"
-        else:
-            return False, f"Failed to add event to Google Calendar: {response.text}"
-            
+            return response.json()['id'], None
+        if response.status_code == 403:
+            return None, "Sign in with Google again to allow course calendars"
+        return None, f"Failed to create Google Calendar: {response.status_code}"
+    except Exception as e:
+        return None, f"Error creating Google Calendar: {str(e)}"
+
+
+def delete_google_calendar(calendar_id, user=None):
+    """
+    Delete a secondary Google Calendar with all its events.
+    
+    Args:
+        calendar_id (str): The calendar's id
+        user (User): The user (optional, defaults to the signed-in user)
+        
+    Returns:
+        tuple: (success, message) where success is a boolean and message is a string
+    """
+    try:
+        access_token, error = get_google_access_token(user)
+        if error:
+            return False, error
+        
+        response = http_client.delete(
+            f"{GOOGLE_CALENDARS_API_URL}/{quote(calendar_id, safe='')}",
+            headers={'Authorization': f"Bearer {access_token}"}
+        )
+        # A calendar the user already deleted is gone all the same
+        if response.status_code in (200, 204, 404, 410):
+            return True, "Calendar removed from Google Calendar"
+        return False, f"Failed to remove Google Calendar: {response.status_code}"
     except Exception as e:
-        return False, f"Error adding event to Google Calendar: {str(e)}"
\ No newline at end of file
+        return False, f"Error removing Google Calendar: {str(e)}"
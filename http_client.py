@@ -0,0 +1,134 @@
+"""
+HTTP Client Module
+
+This module is the single way the app talks to Google and Microsoft. All
+calls share one requests session whose adapters keep a pool of keep-alive
+connections per host, so repeated calls skip the TCP and TLS handshakes.
+Every call gets connect/read timeouts, and failures that are safe to repeat
+are retried a bounded number of times with jittered exponential backoff.
+Calls also go through the circuit breaker of their endpoint family, so once
+a provider is down they fail at once instead of waiting out their timeouts.
+"""
+
+import random
+import logging
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import get_breaker
+
+logger = logging.getLogger(__name__)
+
+# Connect and read timeouts, in seconds
+DEFAULT_TIMEOUT = (5, 30)
+
+# Hosts pooled at once, and connections kept per host
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 20
+
+# Retries after the first attempt, and the backoff between them in seconds
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.25
+BACKOFF_MAX = 4
+
+RETRY_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Get the shared session, creating it on first use.
+
+    Returns:
+        requests.Session: Session with pooled adapters for http and https
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                # The session serves every user, so it must never keep cookies
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                _session = session
+    return _session
+
+
+def request(method, url, retries=MAX_RETRIES, **kwargs):
+    """
+    Send a request through the shared session.
+
+    Idempotent requests are retried after connection errors, timeouts and
+    5xx responses; other requests only when the connection could not be
+    made, as the server cannot have seen them. The outcome (after retries)
+    is recorded by the endpoint family's circuit breaker; connection errors,
+    timeouts and 5xx responses count as failures.
+
+    Args:
+        method (str): HTTP method
+        url (str): URL
+        retries (int): Retries after the first attempt
+        **kwargs: Passed to requests (timeout defaults to DEFAULT_TIMEOUT)
+
+    Returns:
+        requests.Response: The last response
+
+    Raises:
+        requests.RequestException: If the last attempt failed
+        circuit_breaker.CircuitOpenError: If the endpoint family is down
+    """
+    method = method.upper()
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    idempotent = method in IDEMPOTENT_METHODS
+    breaker = get_breaker(url)
+    breaker.allow()
+
+    for attempt in range(retries + 1):
+        last_attempt = attempt == retries
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if last_attempt or not (idempotent or isinstance(e, requests.ConnectTimeout)):
+                breaker.record_failure()
+                raise
+            logger.info(f"{method} {url} failed ({e.__class__.__name__}), retrying")
+        else:
+            if last_attempt or not idempotent or response.status_code not in RETRY_STATUSES:
+                if response.status_code in RETRY_STATUSES:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                return response
+            logger.info(f"{method} {url} returned {response.status_code}, retrying")
+            response.close()
+        time.sleep(backoff_delay(attempt))
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff: a random delay up to base * 2^attempt."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def head(url, **kwargs):
+    return request('HEAD', url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
@@ -7,13 +7,20 @@ and integration with Outlook Calendar.
 
 import json
 import os
-from urllib.parse import urlencode
+from urllib.parse import urlencode, quote
 
-import requests
+import http_client
 from app import db
 from flask import Blueprint, redirect, request, url_for, current_app
 from flask_login import current_user, login_required, login_user, logout_user
-from models import User
+from models import User, save_user_token
+from calendar_batch import (graph_batch_send, build_change_requests, change_result, failed_change,
+                            GRAPH_EVENTS_PATH, GRAPH_EVENT_PATH, GRAPH_CALENDAR_EVENTS_PATH)
+from calendar_sync import pull_graph_changes, SyncError
+from token_manager import TokenManager, TokenRefreshError
+from provider_metadata import MICROSOFT_DISCOVERY_URL
+from provider_health import prober
+from oidc import verify_id_token
 from oauthlib.oauth2 import WebApplicationClient
 
 # Microsoft OAuth configuration
@@ -68,16 +75,14 @@ def login():
     current_app.logger.info(f"Microsoft login redirect URI: {redirect_uri}")
     
     try:
-        # Try to verify the Microsoft URL is accessible
-        try:
-            verify_response = requests.head(MS_AUTH_ENDPOINT, timeout=5)
-            current_app.logger.info(f"MS Auth endpoint status: {verify_response.status_code}")
-        except Exception as e:
-            current_app.logger.error(f"Cannot connect to Microsoft auth endpoint: {str(e)}")
+        # Don't send the user to Microsoft while the background prober finds it unreachable
+        ms_status = prober.status("Microsoft")
+        if ms_status["connectivity"] == "Failed":
+            current_app.logger.error(f"Microsoft auth endpoint unreachable: {ms_status['error']}")
             return f"""
             <h1>Microsoft Authentication Service Unavailable</h1>
             <p>We're unable to connect to Microsoft's authentication service at this time.</p>
-            <p>Error details: {str(e)}</p>
+            <p>Error details: {ms_status['error']}</p>
             <p><a href="{url_for('index')}">Return to the homepage</a></p>
             """, 503
             
@@ -122,7 +127,7 @@ def callback():
     )
     
     # Send the token request
-    token_response = requests.post(
+    token_response = http_client.post(
         token_url,
         headers=headers,
         data=body,
@@ -163,106 +168,39 @@ def callback():
     access_token = token_data.get("access_token")
     refresh_token = token_data.get("refresh_token")
     
-    # Get user information from Microsoft Graph API
-    # Import modules at the top level
-    import base64
-    import json
+    # Take the user's identity from the ID token, validated locally against the
+    # provider's cached signing keys; Graph is only asked when a claim is missing
+    user_info = {}
+    id_token = token_data.get("id_token")
+    if id_token:
+        try:
+            user_info = verify_id_token(id_token, MICROSOFT_DISCOVERY_URL, MS_CLIENT_ID)
+            current_app.logger.info("Validated Microsoft ID token")
+        except Exception as e:
+            current_app.logger.warning(f"Could not validate Microsoft ID token: {str(e)}")
     
-    try:
-        # First, try to decode information from the ID token instead of making an API call
-        # This often works better with personal Microsoft accounts
-        current_app.logger.info("Attempting to extract user info from ID token")
-        id_token = token_data.get("id_token")
-        
-        if id_token:
-            # The id_token is a JWT with three parts separated by dots
-            try:
-                # Split the token and get the payload part
-                token_parts = id_token.split('.')
-                if len(token_parts) >= 2:
-                    # Fix padding for base64 decode
-                    payload = token_parts[1]
-                    payload += '=' * ((4 - len(payload) % 4) % 4)
-                    
-                    # Decode the payload
-                    decoded_payload = base64.b64decode(payload)
-                    token_info = json.loads(decoded_payload.decode('utf-8'))
-                    
-                    current_app.logger.info(f"Successfully extracted user info from ID token: {json.dumps(token_info)}")
-                    
-                    # Use the token info as user info
-                    user_info = token_info
-                    user_info_response = type('obj', (object,), {'status_code': 200})  # Mock response object
-                else:
-                    current_app.logger.error("Invalid ID token format")
-                    
-                    # Fall back to API call
-                    user_info_url = f"{MS_GRAPH_API}/me"
-                    current_app.logger.info(f"Fallback: Requesting user info from {user_info_url}")
-                    
-                    user_info_response = requests.get(
-                        user_info_url, 
-                        headers={"Authorization": f"Bearer {access_token}"}
-                    )
-                    
-                    current_app.logger.info(f"User info response status: {user_info_response.status_code}")
-                    user_info = user_info_response.json()
-            except Exception as e:
-                current_app.logger.error(f"Error decoding ID token: {str(e)}")
-                
-                # Fall back to API call
-                user_info_url = f"{MS_GRAPH_API}/me"
-                current_app.logger.info(f"Fallback: Requesting user info from {user_info_url}")
-                
-                user_info_response = requests.get(
-                    user_info_url, 
-                    headers={"Authorization": f"Bearer {access_token}"}
-                )
-                
-                current_app.logger.info(f"User info response status: {user_info_response.status_code}")
-                user_info = user_info_response.json()
-        else:
-            # No ID token, so use the API call
+    if not (user_info.get("email") or user_info.get("preferred_username")):
+        try:
             user_info_url = f"{MS_GRAPH_API}/me"
             current_app.logger.info(f"Requesting user info from {user_info_url}")
             
-            user_info_response = requests.get(
+            user_info_response = http_client.get(
                 user_info_url, 
                 headers={"Authorization": f"Bearer {access_token}"}
             )
             
             current_app.logger.info(f"User info response status: {user_info_response.status_code}")
             user_info = user_info_response.json()
-        
-        # Log the user info for debugging
-        current_app.logger.info(f"Microsoft user info response: {json.dumps(user_info)}")
-        
-        # Log request details for deeper debugging
-        current_app.logger.info(f"Microsoft access token (first 20 chars): {access_token[:20]}...")
-        current_app.logger.info(f"Token data: {json.dumps({k: v for k, v in token_data.items() if k != 'access_token' and k != 'refresh_token'})}")
-        
-        # Check for error in response
-        if "error" in user_info:
-            error_code = user_info.get("error", {}).get("code", "Unknown")
-            error_message = user_info.get("error", {}).get("message", "Unknown error")
-            inner_error = user_info.get("error", {}).get("innerError", {})
-            current_app.logger.error(f"Error getting Microsoft user info: {error_code} - {error_message}")
-            current_app.logger.error(f"Inner error details: {json.dumps(inner_error)}")
-            
-            # Let's try a different MS Graph endpoint to see if it's a specific endpoint issue
-            try:
-                test_endpoint = f"{MS_GRAPH_API}/me/memberOf"
-                current_app.logger.info(f"Trying alternative endpoint: {test_endpoint}")
-                test_response = requests.get(
-                    test_endpoint,
-                    headers={"Authorization": f"Bearer {access_token}"}
-                )
-                current_app.logger.info(f"Alternative endpoint status: {test_response.status_code}")
-                current_app.logger.info(f"Alternative endpoint response: {test_response.text[:200]}...")
-            except Exception as e:
-                current_app.logger.error(f"Error testing alternative endpoint: {str(e)}")
             
-            return f"""
+            # Check for error in response
+            if "error" in user_info:
+                error_code = user_info.get("error", {}).get("code", "Unknown")
+                error_message = user_info.get("error", {}).get("message", "Unknown error")
+                inner_error = user_info.get("error", {}).get("innerError", {})
+                current_app.logger.error(f"Error getting Microsoft user info: {error_code} - {error_message}")
+                current_app.logger.error(f"Inner error details: {json.dumps(inner_error)}")
+                
+                return f"""
             <div class="container mt-5">
                 <div class="alert alert-danger">
                     <h4 class="alert-heading">Microsoft API Error</h4>
@@ -283,9 +221,9 @@ def callback():
                 </div>
             </div>
             """, 400
-    except Exception as e:
-        current_app.logger.error(f"Exception getting Microsoft user info: {str(e)}")
-        return f"An error occurred while retrieving your profile from Microsoft: {str(e)}", 500
+        except Exception as e:
+            current_app.logger.error(f"Exception getting Microsoft user info: {str(e)}")
+            return f"An error occurred while retrieving your profile from Microsoft: {str(e)}", 500
     
     # Get user email and name
     email = user_info.get("mail") or user_info.get("userPrincipalName") or user_info.get("email") or user_info.get("preferred_username")
@@ -316,7 +254,7 @@ def callback():
         return error_message, 400
     
     # Only try to split email if it exists
-    name = user_info.get("displayName")
+    name = user_info.get("displayName") or user_info.get("name")
     if not name and email:
         name = email.split("@")[0]
     elif not name:
@@ -327,13 +265,14 @@ def callback():
     if not user:
         user = User(username=name, email=email)
         db.session.add(user)
+        db.session.flush()
     
-    # Save the MS token for later use with calendar operations
-    user.microsoft_token = json.dumps({
+    # Save the MS token for later use with calendar operations, with its absolute expiry
+    microsoft_tokens.store(user, {
         "access_token": access_token,
         "refresh_token": refresh_token,
         "token_type": "Bearer",
-        "expires_at": token_data.get("expires_in"),
+        "expires_in": token_data.get("expires_in"),
     })
     
     db.session.commit()
@@ -349,44 +288,196 @@ def callback():
 def logout():
     """Logout user from Microsoft (just clears local token)"""
     if current_user.is_authenticated and current_user.microsoft_token:
-        current_user.microsoft_token = None
+        microsoft_tokens.clear(current_user)
         db.session.commit()
     
     return redirect(url_for("logout"))
 
 
-def add_event_to_outlook_calendar(event_data):
+def sync_events_to_outlook_calendar(changes, user=None):
     """
-    Add an event to the user's Outlook Calendar
+    Apply event changes to the user's Outlook Calendar with Graph $batch requests
+    
+    Changes are sent GRAPH_BATCH_SIZE at a time, so N events take about N/20
+    round trips instead of N. If the access token has expired it is refreshed
+    once and the rejected changes are sent again.
     
     Args:
-        event_data (dict): A dictionary containing event information:
-            - start_time: datetime object for the event start
-            - end_time: datetime object for the event end
-            - title: Event title
-            - description: Event description
+        changes (list): Change dicts (see calendar_batch.build_change_requests;
+            event data as for build_outlook_event)
+        user (User): The user (optional, defaults to the signed-in user)
             
     Returns:
-        tuple: (success, message) where success is a boolean and message is a string
+        list: One result dict per change, in the order given (see
+              calendar_batch.change_result)
     """
-    # Ensure json module is available
-    import json
+    if not changes:
+        return []
+    
+    access_token, error = get_microsoft_access_token(user=user)
+    if error:
+        return [failed_change(change, error) for change in changes]
+    
+    results = [None] * len(changes)
+    pending = []
+    for index, change in enumerate(changes):
+        event_data = change["event"]
+        if event_data is not None and (not event_data.get("start_time") or not event_data.get("end_time")):
+            results[index] = dict(failed_change(change, "Start time and end time are required"), retry=False)
+        else:
+            pending.append(index)
+    
+    user_id = (user if user is not None else current_user).id
+    try:
+        requests = build_change_requests([changes[index] for index in pending], GRAPH_EVENTS_PATH, GRAPH_EVENT_PATH,
+                                         build_outlook_event, GRAPH_CALENDAR_EVENTS_PATH)
+        responses = graph_batch_send(access_token, requests, user_key=user_id)
+        
+        # An expired token fails every item with 401; refresh it and retry those
+        expired = [position for position, (status_code, _) in enumerate(responses) if status_code == 401]
+        responses = dict(zip(pending, responses))
+        if expired:
+            access_token, error = get_microsoft_access_token(rejected=access_token, user=user)
+            if not error:
+                retried = graph_batch_send(access_token, [requests[position] for position in expired], user_key=user_id)
+                responses.update(zip([pending[position] for position in expired], retried))
+    except Exception as e:
+        message = f"Error syncing event to Outlook Calendar: {str(e)}"
+        return [result or failed_change(change, message) for result, change in zip(results, changes)]
+    
+    for index, (status_code, body) in responses.items():
+        change = changes[index]
+        results[index] = change_result(change, status_code, body, "Outlook", "@odata.etag")
+        event_data = change["event"]
+        if results[index]["success"] and event_data is not None and event_data.get("recurrence", {}).get("exdates"):
+            # Record the series as it is after the deletes, or the next pull takes them for the user's edit
+            etag = cancel_outlook_occurrences(access_token, results[index]["remote_id"], event_data)
+            results[index]["etag"] = etag or results[index]["etag"]
+    
+    return results
+
+
+def pull_outlook_calendar_changes(delta_link, user=None, calendar_id=None):
+    """
+    Pull the events changed in the user's Outlook Calendar since the last pull
     
-    if not current_user.is_authenticated or not current_user.microsoft_token:
-        return False, "User not authenticated with Microsoft"
+    Graph v1.0 has delta queries for the default calendar only, so nothing is
+    pulled for secondary (course) calendars; their events are still patched
+    and deleted with If-Match.
+    
+    Args:
+        delta_link (str): Cursor of the last pull (None for a full listing)
+        user (User): The user (optional, defaults to the signed-in user)
+        calendar_id (str): A secondary calendar (optional, defaults to the default)
+            
+    Returns:
+        tuple: (changes, next_delta_link) (see calendar_sync.pull_graph_changes);
+               next_delta_link is None when nothing was pulled
+        
+    Raises:
+        SyncError: If the changes could not be pulled
+    """
+    if calendar_id:
+        return [], None
+    
+    access_token, error = get_microsoft_access_token(user=user)
+    if error:
+        raise SyncError(error)
+    return pull_graph_changes(access_token, delta_link)
+
+
+def create_outlook_calendar(name, user=None):
+    """
+    Create a secondary Outlook calendar, e.g. for one course's events
+    
+    Args:
+        name (str): The calendar's name
+        user (User): The user (optional, defaults to the signed-in user)
+            
+    Returns:
+        tuple: (calendar_id, error) where error is None or a message string
+    """
+    access_token, error = get_microsoft_access_token(user=user)
+    if error:
+        return None, error
     
-    # Parse stored token
     try:
-        token_data = json.loads(current_user.microsoft_token)
-        access_token = token_data.get("access_token")
+        response = http_client.post(
+            f"{MS_GRAPH_API}/me/calendars",
+            headers={"Authorization": f"Bearer {access_token}"},
+            json={"name": name}
+        )
+        if response.status_code == 201:
+            return response.json()["id"], None
+        error_message = response.json().get("error", {}).get("message", "Unknown error")
+        return None, f"Failed to create Outlook calendar: {error_message}"
     except Exception as e:
-        return False, f"Error parsing token: {str(e)}"
+        return None, f"Error creating Outlook calendar: {str(e)}"
+
+
+def delete_outlook_calendar(calendar_id, user=None):
+    """
+    Delete a secondary Outlook calendar with all its events
     
-    # Format the event data for Microsoft Graph API
-    # ISO 8601 format with timezone info
-    if not event_data.get("start_time") or not event_data.get("end_time"):
-        return False, "Start time and end time are required"
+    Args:
+        calendar_id (str): The calendar's id
+        user (User): The user (optional, defaults to the signed-in user)
+            
+    Returns:
+        tuple: (success, message) where success is a boolean and message is a string
+    """
+    access_token, error = get_microsoft_access_token(user=user)
+    if error:
+        return False, error
     
+    try:
+        response = http_client.delete(
+            f"{MS_GRAPH_API}/me/calendars/{quote(calendar_id, safe='')}",
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        # A calendar the user already deleted is gone all the same
+        if response.status_code in (204, 404):
+            return True, "Calendar removed from Outlook"
+        return False, f"Failed to remove Outlook calendar: {response.status_code}"
+    except Exception as e:
+        return False, f"Error removing Outlook calendar: {str(e)}"
+
+
+def get_microsoft_access_token(rejected=None, user=None):
+    """
+    Get a user's Microsoft access token, refreshing it if it is about to expire
+    
+    Args:
+        rejected (str): An access token Graph has just rejected; it is
+            replaced even if it has not expired (optional)
+        user (User): The user (optional, defaults to the signed-in user)
+            
+    Returns:
+        tuple: (access_token, error) where error is None or a message string
+    """
+    user = user if user is not None else current_user
+    if not user.is_authenticated or not user.microsoft_token:
+        return None, "User not authenticated with Microsoft"
+    
+    return microsoft_tokens.get_access_token(user, rejected=rejected)
+
+
+def build_outlook_event(event_data):
+    """
+    Build a Microsoft Graph event resource from event data
+    
+    Args:
+        event_data (dict): A dictionary containing event information:
+            - start_time: datetime object for the event start
+            - end_time: datetime object for the event end
+            - title: Event title
+            - description: Event description
+            - recurrence: Recurrence rule (optional, see calendar_generator.create_ics_file)
+            
+    Returns:
+        dict: The event resource
+    """
+    # ISO 8601 format with timezone info
     start_iso = event_data["start_time"].strftime("%Y-%m-%dT%H:%M:%S")
     end_iso = event_data["end_time"].strftime("%Y-%m-%dT%H:%M:%S")
     
@@ -412,77 +503,125 @@ def add_event_to_outlook_calendar(event_data):
             "displayName": event_data["location"]
         }
     
-    # Add the event to the user's calendar
-    endpoint = f"{MS_GRAPH_API}/me/calendar/events"
+    # Recurring events are created once as a series
+    recurrence = event_data.get("recurrence")
+    if recurrence:
+        event["recurrence"] = {
+            "pattern": {
+                "type": recurrence["frequency"],
+                "interval": 1,
+                "daysOfWeek": [event_data["start_time"].strftime("%A").lower()]
+            },
+            "range": {
+                "type": "endDate",
+                "startDate": event_data["start_time"].strftime("%Y-%m-%d"),
+                "endDate": recurrence["until"]
+            }
+        }
     
+    return event
+
+
+def cancel_outlook_occurrences(access_token, series_id, event_data):
+    """
+    Delete the skipped weeks (exdates) of a recurring Outlook event.
+    
+    Microsoft Graph cannot create a series with exceptions, so the skipped
+    occurrences are removed after the series has been created. Deleting an
+    occurrence changes the series' etag, so the new one is read back.
+    
+    Args:
+        access_token (str): Microsoft Graph access token
+        series_id (str): ID of the created series master event
+        event_data (dict): The event data, including its recurrence
+            
+    Returns:
+        str: The series' etag after the deletes, or None if nothing was
+             deleted or it could not be read
+    """
+    recurrence = event_data["recurrence"]
+    exdates = set(recurrence.get("exdates", []))
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Prefer": 'outlook.timezone="UTC"'
+    }
+    
+    deleted = 0
     try:
-        response = requests.post(
-            endpoint,
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            },
-            json=event
+        response = http_client.get(
+            f"{MS_GRAPH_API}/me/events/{series_id}/instances",
+            headers=headers,
+            params={
+                "startDateTime": event_data["start_time"].strftime("%Y-%m-%dT00:00:00"),
+                "endDateTime": f"{recurrence['until']}T23:59:59",
+                "$select": "id,start"
+            }
         )
+        if response.status_code != 200:
+            current_app.logger.warning(f"Could not list Outlook occurrences: {response.status_code}")
+            return None
         
-        # Check response
-        if response.status_code == 201:
-            return True, "Event successfully added to Outlook Calendar"
-        else:
-            error_data = response.json()
-            error_message = error_data.get("error", {}).get("message", "Unknown error")
-            return False, f"Failed to add event: {error_message}"
-            
+        for instance in response.json().get("value", []):
+            if instance["start"]["dateTime"][:10] in exdates:
+                delete_response = http_client.delete(
+                    f"{MS_GRAPH_API}/me/events/{instance['id']}",
+                    headers=headers
+                )
+                if delete_response.status_code == 204:
+                    deleted += 1
+        if not deleted:
+            return None
+        
+        response = http_client.get(
+            f"{MS_GRAPH_API}/me/events/{series_id}",
+            headers=headers,
+            params={"$select": "id"}
+        )
+        if response.status_code != 200:
+            current_app.logger.warning(f"Could not read the Outlook series etag: {response.status_code}")
+            return None
+        return response.json().get("@odata.etag")
     except Exception as e:
-        return False, f"Error adding event to Outlook Calendar: {str(e)}"
+        current_app.logger.warning(f"Error removing skipped Outlook occurrences: {str(e)}")
+    
+    return None
 
 
 def refresh_microsoft_token():
     """
-    Refresh the Microsoft access token using the refresh token
+    Refresh the current user's Microsoft access token now, even if it has not expired
     
     Returns:
         bool: True if successful, False otherwise
     """
-    # Ensure json module is available
-    import json
-    
-    if not current_user.is_authenticated or not current_user.microsoft_token:
+    access_token, error = get_microsoft_access_token()
+    if error:
         return False
     
-    try:
-        token_data = json.loads(current_user.microsoft_token)
-        refresh_token = token_data.get("refresh_token")
-        
-        if not refresh_token:
-            return False
-        
-        # Prepare the refresh token request
-        refresh_url = MS_TOKEN_ENDPOINT
-        data = {
-            "client_id": MS_CLIENT_ID,
-            "client_secret": MS_CLIENT_SECRET,
-            "grant_type": "refresh_token",
-            "refresh_token": refresh_token,
-        }
-        
-        response = requests.post(refresh_url, data=data)
-        
-        if response.status_code == 200:
-            new_token_data = response.json()
-            
-            # Update stored token
-            current_user.microsoft_token = json.dumps({
-                "access_token": new_token_data.get("access_token"),
-                "refresh_token": new_token_data.get("refresh_token", refresh_token),
-                "token_type": "Bearer",
-                "expires_at": new_token_data.get("expires_in"),
-            })
-            
-            db.session.commit()
-            return True
-        else:
-            return False
+    access_token, error = get_microsoft_access_token(rejected=access_token)
+    return error is None
+
+
+def request_microsoft_token_refresh(refresh_token):
+    """
+    Exchange a Microsoft refresh token for a new access token
+    
+    Args:
+        refresh_token (str): The refresh token
             
-    except Exception:
-        return False
\ No newline at end of file
+    Returns:
+        dict: The token response
+    """
+    response = http_client.post(MS_TOKEN_ENDPOINT, data={
+        "client_id": MS_CLIENT_ID,
+        "client_secret": MS_CLIENT_SECRET,
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+        "scope": " ".join(SCOPES),
+    })
+    if response.status_code != 200:
+        raise TokenRefreshError(f"Microsoft token refresh failed: {response.status_code}")
+    return response.json()
+
+
+microsoft_tokens = TokenManager("Microsoft", "microsoft_token", request_microsoft_token_refresh, save_user_token)
@@ -1,4 +1,6 @@
+from datetime import datetime
 from flask_login import UserMixin
+from sqlalchemy.orm import Session
 from app import db
 
 class User(UserMixin, db.Model):
@@ -6,4 +8,82 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(64), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     google_token = db.Column(db.Text, nullable=True)
-    microsoft_token = db.Column(db.Text, nullable=True)
\ No newline at end of file
+    microsoft_token = db.Column(db.Text, nullable=True)
+
+class StoredCalendar(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    name = db.Column(db.String(255), nullable=False)
+    events = db.Column(db.Text, nullable=False)  # calendar_generator.dump_events JSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class CalendarFeed(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+    token = db.Column(db.String(64), unique=True, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # last change of the user's events
+
+# Index of the event UIDs already sent to each of a user's calendars, with the content last sent,
+# the event's id and etag in that calendar, and whether the user has since changed it there
+class EmittedEvent(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'calendar', 'uid'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    calendar = db.Column(db.String(16), nullable=False)  # "Google" or "Outlook"
+    uid = db.Column(db.String(255), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+    remote_id = db.Column(db.String(255), nullable=True)
+    etag = db.Column(db.String(255), nullable=True)
+    calendar_id = db.Column(db.String(255), nullable=True, index=True)  # secondary (course) calendar, None for the default
+    title = db.Column(db.String(255), nullable=True)
+    course = db.Column(db.String(64), nullable=True, index=True)  # events of a course no longer extracted are removed
+    remote_status = db.Column(db.String(16), nullable=True)  # "edited" or "deleted" in the calendar by the user
+    remote_hash = db.Column(db.String(64), nullable=True)  # content hash of the user's edited version
+    display_hash = db.Column(db.String(64), nullable=True)  # content hash as the calendar reports it (no recurrence)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Where the last pull of changes from each of a user's calendars stopped
+class SyncCursor(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'calendar', 'calendar_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    calendar = db.Column(db.String(16), nullable=False)  # "Google" or "Outlook"
+    calendar_id = db.Column(db.String(255), nullable=False, default='')  # secondary (course) calendar, '' for the default (NULLs are never unique)
+    cursor = db.Column(db.Text, nullable=False)  # Google nextSyncToken or Graph deltaLink
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Secondary calendars holding one course's events, per user and provider
+class CourseCalendar(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'calendar', 'course'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    calendar = db.Column(db.String(16), nullable=False)  # "Google" or "Outlook"
+    course = db.Column(db.String(64), nullable=False)
+    remote_id = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Calendar pushes waiting to be sent (or sent) by the background outbox worker
+class OutboxPush(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    batch = db.Column(db.String(32), nullable=False, index=True)  # the generate request the push came from
+    calendar = db.Column(db.String(16), nullable=False)  # "Google" or "Outlook"
+    action = db.Column(db.String(16), nullable=False, default='upsert')  # upsert, delete or drop_calendar
+    course_calendar = db.Column(db.Boolean, nullable=False, default=False)  # upsert into the course's own calendar
+    title = db.Column(db.String(255), nullable=False)
+    event = db.Column(db.Text, nullable=False)  # calendar_generator.dump_events JSON of one event (its uid to delete, the course to drop)
+    status = db.Column(db.String(16), nullable=False, default='pending', index=True)  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32), nullable=True, index=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+def save_user_token(user_id, attribute, token_json):
+    """Write a user's refreshed OAuth token in a session of its own, leaving the caller's transaction alone."""
+    with Session(db.engine) as token_session:
+        token_session.query(User).filter_by(id=user_id).update({attribute: token_json})
+        token_session.commit()
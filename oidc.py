@@ -0,0 +1,144 @@
+"""
+OpenID Connect Module
+
+This module validates id_tokens locally: the RS256 signature is checked
+against the provider's cached signing keys (see provider_metadata) and the
+issuer, audience and validity times against the token's claims. The check
+needs only the standard library; RSA PKCS#1 v1.5 verification is a modular
+exponentiation and a comparison.
+"""
+
+import json
+import time
+import hmac
+import base64
+import hashlib
+import logging
+
+from provider_metadata import get_discovery_document, get_jwks, get_cached_document
+
+logger = logging.getLogger(__name__)
+
+# Seconds of clock difference tolerated on exp, nbf and iat
+CLOCK_SKEW = 300
+
+# DER prefix of a SHA-256 DigestInfo (RFC 8017, section 9.2)
+SHA256_DIGEST_INFO = bytes.fromhex('3031300d060960864801650304020105000420')
+
+
+class IdTokenError(ValueError):
+    """Raised when an id_token is malformed or fails validation."""
+
+
+class UnknownKeyError(IdTokenError):
+    """Raised when no signing key matches the id_token's key id."""
+
+
+def verify_id_token(id_token, discovery_url, audience, now=None):
+    """
+    Validate an id_token against a provider's discovery document and keys.
+
+    If the token names a key that is not in the cached JWKS, the keys may
+    have been rotated; they are fetched again once.
+
+    Args:
+        id_token (str): The compact JWT
+        discovery_url (str): The provider's discovery document URL
+        audience (str): Expected audience (our client id)
+        now (float): Current Unix time (optional)
+
+    Returns:
+        dict: The token's claims
+
+    Raises:
+        IdTokenError: If the token is not valid
+    """
+    issuer = get_discovery_document(discovery_url)['issuer']
+    try:
+        return decode_id_token(id_token, get_jwks(discovery_url), audience, issuer, now)
+    except UnknownKeyError:
+        get_cached_document(get_discovery_document(discovery_url)['jwks_uri']).invalidate()
+        return decode_id_token(id_token, get_jwks(discovery_url), audience, issuer, now)
+
+
+def decode_id_token(id_token, jwks, audience, issuer, now=None, leeway=CLOCK_SKEW):
+    """
+    Validate an id_token and return its claims.
+
+    Args:
+        id_token (str): The compact JWT
+        jwks (dict): Signing keys ({"keys": [...]})
+        audience (str): Expected audience
+        issuer (str): Expected issuer; "{tenantid}" is replaced by the
+            token's tid claim, as in Microsoft's multi-tenant metadata
+        now (float): Current Unix time (optional)
+        leeway (int): Seconds of clock difference tolerated
+
+    Returns:
+        dict: The token's claims
+
+    Raises:
+        IdTokenError: If the token is not valid
+    """
+    try:
+        encoded_header, encoded_payload, encoded_signature = id_token.split('.')
+        header = json.loads(b64url_decode(encoded_header))
+        claims = json.loads(b64url_decode(encoded_payload))
+        signature = b64url_decode(encoded_signature)
+    except (AttributeError, ValueError) as e:
+        raise IdTokenError(f"Malformed id_token: {str(e)}")
+
+    if header.get('alg') != 'RS256':
+        raise IdTokenError(f"Unsupported id_token algorithm: {header.get('alg')}")
+    keys = [key for key in jwks.get('keys', []) if key.get('kid') == header.get('kid') and key.get('kty') == 'RSA']
+    if not keys:
+        raise UnknownKeyError(f"No signing key with id {header.get('kid')}")
+    signing_input = f"{encoded_header}.{encoded_payload}".encode('ascii')
+    if not any(verify_rs256(signing_input, signature, key) for key in keys):
+        raise IdTokenError("Invalid id_token signature")
+
+    expected_issuer = issuer.replace('{tenantid}', str(claims.get('tid', '')))
+    if claims.get('iss') != expected_issuer:
+        raise IdTokenError(f"Unexpected id_token issuer: {claims.get('iss')}")
+
+    token_audience = claims.get('aud')
+    if audience not in (token_audience if isinstance(token_audience, list) else [token_audience]):
+        raise IdTokenError("id_token was issued for another client")
+
+    now = time.time() if now is None else now
+    if not isinstance(claims.get('exp'), (int, float)) or claims['exp'] + leeway < now:
+        raise IdTokenError("id_token has expired")
+    for claim in ('nbf', 'iat'):
+        if isinstance(claims.get(claim), (int, float)) and claims[claim] - leeway > now:
+            raise IdTokenError(f"id_token {claim} is in the future")
+
+    return claims
+
+
+def verify_rs256(signing_input, signature, jwk):
+    """
+    Check an RSASSA-PKCS1-v1_5 SHA-256 signature.
+
+    Args:
+        signing_input (bytes): The signed bytes
+        signature (bytes): The signature
+        jwk (dict): RSA public key with base64url "n" and "e"
+
+    Returns:
+        bool: Whether the signature is valid
+    """
+    modulus = int.from_bytes(b64url_decode(jwk['n']), 'big')
+    exponent = int.from_bytes(b64url_decode(jwk['e']), 'big')
+    length = (modulus.bit_length() + 7) // 8
+    if len(signature) != length:
+        return False
+
+    encoded = pow(int.from_bytes(signature, 'big'), exponent, modulus).to_bytes(length, 'big')
+    digest_info = SHA256_DIGEST_INFO + hashlib.sha256(signing_input).digest()
+    expected = b'\x00\x01' + b'\xff' * (length - len(digest_info) - 3) + b'\x00' + digest_info
+    return hmac.compare_digest(encoded, expected)
+
+
+def b64url_decode(data):
+    """Decode unpadded base64url."""
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
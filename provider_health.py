@@ -0,0 +1,134 @@
+"""
+Provider Health Module
+
+This module keeps track of whether Google's and Microsoft's sign-in services
+can be reached. A background thread probes each provider's OpenID discovery
+document every PROBE_INTERVAL seconds and caches the outcome, so the setup
+check pages, the Microsoft login route and the readiness endpoint read a
+status instead of making a request of their own.
+
+Statuses live in process memory; each worker process runs its own prober.
+A status not refreshed for STALE_AFTER seconds is reported as unknown.
+"""
+
+import os
+import time
+import logging
+import threading
+
+import http_client
+from provider_metadata import GOOGLE_DISCOVERY_URL, MICROSOFT_DISCOVERY_URL
+
+logger = logging.getLogger(__name__)
+
+# Seconds between probes of a provider
+PROBE_INTERVAL = int(os.environ.get('HEALTH_PROBE_INTERVAL', 60))
+
+# Seconds after which a status is no longer trusted (e.g. the prober stopped)
+STALE_AFTER = 3 * PROBE_INTERVAL
+
+# Seconds a probe waits for an answer
+PROBE_TIMEOUT = 5
+
+# URL probed per provider
+PROBES = {
+    'Google': GOOGLE_DISCOVERY_URL,
+    'Microsoft': MICROSOFT_DISCOVERY_URL,
+}
+
+
+def probe(name, url):
+    """
+    Check once whether a provider answers.
+
+    Args:
+        name (str): Provider name, for messages
+        url (str): URL to request
+
+    Returns:
+        tuple: (reachable, error) where error is None when reachable
+    """
+    try:
+        response = http_client.get(url, timeout=PROBE_TIMEOUT, retries=0)
+    except Exception as e:
+        return False, str(e)
+    if response.status_code != 200:
+        return False, f"Received status code {response.status_code} from {name}"
+    return True, None
+
+
+class HealthProber:
+    """
+    Daemon thread refreshing the cached reachability of each provider.
+    """
+
+    def __init__(self, probes=None, interval=PROBE_INTERVAL, stale_after=STALE_AFTER, clock=time.monotonic):
+        self.probes = dict(PROBES if probes is None else probes)
+        self.interval = interval
+        self.stale_after = stale_after
+        self._clock = clock
+        self._statuses = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        """Start the thread, in this process, if it is not running."""
+        # Threads do not survive a fork, so a forked web worker starts its own
+        if self._pid == os.getpid() or self.interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="health-prober", daemon=True).start()
+
+    def refresh(self):
+        """Probe every provider now and cache the outcomes."""
+        for name, url in self.probes.items():
+            reachable, error = probe(name, url)
+            with self._lock:
+                previous = self._statuses.get(name)
+                self._statuses[name] = (reachable, error, self._clock())
+            if previous is None or previous[0] != reachable:
+                if reachable:
+                    logger.info(f"{name} is reachable")
+                else:
+                    logger.warning(f"{name} is unreachable: {error}")
+
+    def status(self, name):
+        """
+        Get a provider's cached status.
+
+        Args:
+            name (str): Provider name ("Google" or "Microsoft")
+
+        Returns:
+            dict: "connectivity" ("Connected", "Failed" or "Unknown" if not
+                  probed lately), "error" and "checked_ago" (seconds, or None)
+        """
+        with self._lock:
+            cached = self._statuses.get(name)
+        if cached is None:
+            return {'connectivity': 'Unknown', 'error': None, 'checked_ago': None}
+        reachable, error, checked_at = cached
+        checked_ago = self._clock() - checked_at
+        if checked_ago > self.stale_after:
+            return {'connectivity': 'Unknown', 'error': None, 'checked_ago': round(checked_ago)}
+        return {'connectivity': 'Connected' if reachable else 'Failed', 'error': error,
+                'checked_ago': round(checked_ago)}
+
+    def snapshot(self):
+        """Get the cached status of every provider, by name."""
+        return {name: self.status(name) for name in self.probes}
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Health prober error: {str(e)}")
+            time.sleep(self.interval)
+
+
+# Shared by the web routes of this process
+prober = HealthProber()
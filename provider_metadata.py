@@ -0,0 +1,162 @@
+"""
+Provider Metadata Module
+
+This module keeps the identity providers' OpenID discovery documents and
+signing keys (JWKS) in process. Each document is fetched once, kept for as
+long as its Cache-Control header allows and refreshed in the background
+shortly before it expires, so logins and token refreshes do not wait on a
+discovery round trip. A stale copy is served if a refresh fails.
+"""
+
+import re
+import time
+import logging
+import threading
+
+import http_client
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+MICROSOFT_DISCOVERY_URL = "https://login.microsoftonline.com/common/v2.0/.well-known/openid-configuration"
+
+# Lifetime when the response has no usable max-age, and the bounds of any lifetime, in seconds
+DEFAULT_TTL = 3600
+MIN_TTL = 60
+MAX_TTL = 24 * 3600
+
+# Share of the lifetime after which a background refresh starts
+REFRESH_AHEAD = 0.8
+
+MAX_AGE_PATTERN = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+
+class CachedDocument:
+    """
+    A JSON document fetched from a URL and kept until its max-age runs out.
+    """
+
+    def __init__(self, url, clock=time.monotonic):
+        self.url = url
+        self._clock = clock
+        self._value = None
+        self._fetched_at = 0
+        self._ttl = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self):
+        """
+        Get the document, fetching it if it is missing or expired.
+
+        Returns:
+            dict: The document
+
+        Raises:
+            requests.RequestException or ValueError: If there is no copy and
+                fetching fails
+        """
+        age = self._clock() - self._fetched_at
+        if self._value is not None and age < self._ttl:
+            if age >= self._ttl * REFRESH_AHEAD:
+                self._refresh_in_background()
+            return self._value
+
+        with self._lock:
+            # Another thread may have fetched it while we waited
+            if self._value is not None and self._clock() - self._fetched_at < self._ttl:
+                return self._value
+            try:
+                self._fetch()
+            except Exception as e:
+                if self._value is None:
+                    raise
+                logger.warning(f"Serving stale {self.url}: {str(e)}")
+            return self._value
+
+    def invalidate(self):
+        """Forget the document, e.g. after a key rotation."""
+        with self._lock:
+            self._value = None
+            self._ttl = 0
+
+    def _fetch(self):
+        response = http_client.get(self.url)
+        response.raise_for_status()
+        value = response.json()
+        self._value = value
+        self._ttl = parse_max_age(response.headers.get('Cache-Control'))
+        self._fetched_at = self._clock()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                self._fetch()
+        except Exception as e:
+            logger.warning(f"Background refresh of {self.url} failed: {str(e)}")
+        finally:
+            self._refreshing = False
+
+
+def parse_max_age(cache_control, default=DEFAULT_TTL):
+    """
+    Read the lifetime a Cache-Control header allows.
+
+    Args:
+        cache_control (str): Header value (optional)
+        default (int): Lifetime when the header gives none
+
+    Returns:
+        int: Lifetime in seconds, between MIN_TTL and MAX_TTL
+    """
+    if cache_control and re.search(r'\bno-(?:cache|store)\b', cache_control, re.IGNORECASE):
+        return MIN_TTL
+    match = MAX_AGE_PATTERN.search(cache_control or '')
+    ttl = int(match.group(1)) if match else default
+    return min(max(ttl, MIN_TTL), MAX_TTL)
+
+
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+def get_cached_document(url):
+    """
+    Get the shared cache entry for a URL.
+
+    Args:
+        url (str): Document URL
+
+    Returns:
+        CachedDocument: The entry, shared by all requests
+    """
+    with _documents_lock:
+        document = _documents.get(url)
+        if document is None:
+            document = _documents[url] = CachedDocument(url)
+        return document
+
+
+def get_discovery_document(discovery_url):
+    """Get a provider's OpenID discovery document."""
+    return get_cached_document(discovery_url).get()
+
+
+def get_jwks(discovery_url):
+    """
+    Get a provider's signing keys.
+
+    Args:
+        discovery_url (str): The provider's discovery document URL
+
+    Returns:
+        dict: The JWKS document ({"keys": [...]})
+    """
+    return get_cached_document(get_discovery_document(discovery_url)['jwks_uri']).get()
@@ -0,0 +1,195 @@
+"""
+Rate Limiter Module
+
+This module keeps calendar pushes within the providers' quotas. Each
+provider has a token bucket for the whole app and one per user; a request
+costs one token per event it carries and waits until both buckets can pay.
+When the provider answers 429 or 503, its Retry-After blocks that user's
+bucket. If the signal concerns the whole app rather than one user's quota,
+the provider's rate is halved too, then grows back with each success
+(additive increase, multiplicative decrease), so throughput settles just
+under the quota instead of collapsing into bulk failures.
+
+Buckets live in process memory and are shared by its threads; the
+provider-wide rate is divided by the number of web worker processes
+(WEB_CONCURRENCY) so that together they stay within the quota.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Processes sharing the provider quotas
+PROCESSES = max(int(os.environ.get('WEB_CONCURRENCY', 1)), 1)
+
+# Requests per second and burst size, for the whole app and for each user.
+# Google Calendar allows 600 requests a minute per user; Graph about 10,000
+# per 10 minutes per mailbox.
+PROVIDER_LIMITS = {
+    'Google': {'rate': 100, 'capacity': 200, 'user_rate': 10, 'user_capacity': 100},
+    'Outlook': {'rate': 100, 'capacity': 200, 'user_rate': 15, 'user_capacity': 100},
+}
+
+# Lowest share of its configured rate a throttled bucket slows down to
+MIN_RATE_FACTOR = 0.1
+
+# Share of the configured rate regained per successful request
+RECOVERY_FACTOR = 0.05
+
+# Longest wait for tokens before a request is reported as rate limited
+MAX_WAIT = 30
+
+# Per-user buckets kept (least recently used are dropped)
+MAX_USERS = 10000
+
+
+class RateLimited(Exception):
+    """Raised when a request would have to wait longer than allowed for its quota."""
+
+    def __init__(self, wait):
+        super().__init__(f"Rate limited, retry in {wait:.0f}s")
+        self.wait = wait
+
+
+class TokenBucket:
+    """
+    Token bucket with an adaptive rate and a Retry-After block.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.blocked_until = 0
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost=1):
+        """
+        Take tokens, possibly ahead of time.
+
+        Args:
+            cost (int): Tokens to take
+
+        Returns:
+            float: Seconds to wait before the request may be sent
+        """
+        with self._lock:
+            now = self._refill()
+            self.tokens -= cost
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            return max(wait, self.blocked_until - now)
+
+    def release(self, cost=1):
+        """Give back tokens of a request that was not sent."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + cost)
+
+    def throttle(self, retry_after=0):
+        """Block the bucket for retry_after seconds and halve its rate."""
+        with self._lock:
+            now = self._refill()
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            self.rate = max(self.max_rate * MIN_RATE_FACTOR, self.rate / 2)
+
+    def recover(self):
+        """Regain some of the rate lost to throttling."""
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_FACTOR)
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+
+class RateLimiter:
+    """
+    A provider-wide bucket plus one bucket per user.
+    """
+
+    def __init__(self, rate, capacity, user_rate, user_capacity, max_wait=MAX_WAIT,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.provider = TokenBucket(rate, capacity, clock)
+        self.user_rate = user_rate
+        self.user_capacity = user_capacity
+        self.max_wait = max_wait
+        self._clock = clock
+        self._sleep = sleep
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, user_key=None, cost=1):
+        """
+        Wait until a request costing `cost` may be sent.
+
+        Args:
+            user_key: Identifies the user (optional)
+            cost (int): Events carried by the request
+
+        Raises:
+            RateLimited: If the wait would exceed max_wait; nothing is taken
+        """
+        buckets = [self.provider] + ([self._user_bucket(user_key)] if user_key is not None else [])
+        wait = max(bucket.reserve(cost) for bucket in buckets)
+        if wait > self.max_wait:
+            for bucket in buckets:
+                bucket.release(cost)
+            raise RateLimited(wait)
+        if wait > 0:
+            self._sleep(wait)
+
+    def throttled(self, user_key=None, retry_after=0, provider_wide=True):
+        """
+        Record a 429/503: block the user for retry_after and, if it concerns the whole app, slow the provider down.
+
+        Without a user key the provider bucket is the only one to block.
+
+        Args:
+            user_key: Identifies the user (optional)
+            retry_after (float): The provider's Retry-After, in seconds
+            provider_wide (bool): Whether the app's quota was exceeded rather
+                than only the user's
+        """
+        logger.info(f"Provider throttled user {user_key}, backing off {retry_after}s")
+        if user_key is None:
+            self.provider.throttle(retry_after)
+            return
+        if provider_wide:
+            self.provider.throttle()
+        self._user_bucket(user_key).throttle(retry_after)
+
+    def succeeded(self, user_key=None):
+        """Record a request the provider accepted."""
+        self.provider.recover()
+        if user_key is not None:
+            self._user_bucket(user_key).recover()
+
+    def _user_bucket(self, user_key):
+        with self._lock:
+            bucket = self._users.get(user_key)
+            if bucket is None:
+                bucket = self._users[user_key] = TokenBucket(self.user_rate, self.user_capacity, self._clock)
+                if len(self._users) > MAX_USERS:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_key)
+            return bucket
+
+
+def create_limiter(provider):
+    """Create the rate limiter of a provider, with its share of the quota."""
+    limits = PROVIDER_LIMITS[provider]
+    return RateLimiter(limits['rate'] / PROCESSES, limits['capacity'], limits['user_rate'], limits['user_capacity'])
+
+
+limiters = {provider: create_limiter(provider) for provider in PROVIDER_LIMITS}
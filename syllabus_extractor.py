@@ -5,13 +5,57 @@ A specialized module for extracting assessments from course syllabi in structure
 This module specifically targets academic assessment deadlines and formats them in a consistent JSON structure.
 """
 
+import os
 import re
 import json
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
+logger = logging.getLogger(__name__)
+
+# Bump when a change alters the extracted assessments; memoized results of
+# older versions are then ignored
+EXTRACTOR_VERSION = 7
+
+# Course codes recognised in syllabi, e.g. "FNCE 674" (PDF text may read "FNCE 67 4")
+COURSE_CODE_PATTERN = re.compile(r'(ENTI|FNCE|OBHR|SGMA|MKTG|ACCT)\s*(\d\s?\d\s?\d)')
+
+# A course code must be mentioned this many times in a row (page footers,
+# headings) to open a new outline in a course pack; fewer mentions are
+# cross-references to other courses
+MIN_COURSE_MENTIONS = 3
+
+# Segments a course pack needs before they are extracted in the worker pool;
+# one or two are extracted faster here than shipped to worker processes
+MIN_POOL_SEGMENTS = 3
+
+# Worker pool shared by the requests of this process, created on first use
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def extraction_day():
+    """
+    Day that extraction results are valid for.
+
+    The extractors date ongoing items and complete years from the current
+    day, so their results are only reused on the day they were computed.
+    """
+    return datetime.now().strftime('%Y-%m-%d')
+
+
 def handle_weekly_assignments(text, events):
     """
-    Check for weekly assignments and participation and add recurring events.
+    Check for weekly assignments and participation and add a recurring event.
+    
+    The weekly work is added as ONE event with a "recurrence" entry rather than
+    one event per week:
+        {"frequency": "weekly", "until": "YYYY-MM-DD", "exdates": ["YYYY-MM-DD", ...]}
+    where exdates are the weeks that already have another event on that day;
+    the rule starts and ends on weeks that do not.
     
     Args:
         text (str): The syllabus text content
@@ -45,40 +89,41 @@ def handle_weekly_assignments(text, events):
             
             # Find the start and end dates by looking at existing events
             if events:
-                # Sort existing events by date
-                sorted_events = sorted(events, key=lambda x: x["date"])
-                
                 # Get the earliest and latest dates
-                start_date = sorted_events[0]["date"]
-                end_date = sorted_events[-1]["date"]
+                event_dates = {event["date"] for event in events}
+                start_date = min(event_dates)
+                end_date = max(event_dates)
                 
                 # Convert to datetime objects
                 start_dt = datetime.strptime(start_date, '%Y-%m-%d')
                 end_dt = datetime.strptime(end_date, '%Y-%m-%d')
                 
-                # Create weekly events (one week apart)
+                # Skip the weeks that already have an event on the same day
+                week_dates = []
                 current_dt = start_dt
                 while current_dt <= end_dt:
-                    # Only add if not already on the same day as another event
-                    current_date = current_dt.strftime('%Y-%m-%d')
-                    
-                    # Check if this day already has an event
-                    day_has_event = False
-                    for event in events:
-                        if event["date"] == current_date:
-                            day_has_event = True
-                            break
-                    
-                    # If no event on this day, add weekly assignment
-                    if not day_has_event:
-                        events.append({
-                            "title": assignment_type,
-                            "date": current_date,
-                            "time": "weekly"
-                        })
+                    week_dates.append(current_dt.strftime('%Y-%m-%d'))
                     
                     # Move to next week
                     current_dt = current_dt + timedelta(days=7)
+                kept_dates = [date for date in week_dates if date not in event_dates]
+                
+                # Represent the weekly work as a single recurring event, starting
+                # and ending on weeks it is held (skipped weeks are only ever
+                # excluded from between them)
+                if kept_dates:
+                    first_date, last_date = kept_dates[0], kept_dates[-1]
+                    events.append({
+                        "title": assignment_type,
+                        "date": first_date,
+                        "time": "weekly",
+                        "recurrence": {
+                            "frequency": "weekly",
+                            "until": last_date,
+                            "exdates": [date for date in week_dates
+                                        if date in event_dates and first_date < date < last_date]
+                        }
+                    })
             
             # No need to check other patterns if we found one
             break
@@ -137,43 +182,230 @@ def add_participation_events(text, events):
     return events
 
 
-def extract_assessments_from_syllabus(text):
+def extract_assessments_from_syllabus(text, tables=None):
     """
     Extract assessments from a syllabus and return structured data.
     
+    A combined document holding several course outlines (e.g. a term pack) is
+    split into one segment per course; the segments are extracted in parallel
+    and each resulting event is tagged with its "course" code.
+    
     Args:
         text (str): The syllabus text content
+        tables (list): Assessment tables rebuilt from the source document by
+            document_parser.extract_assessment_tables (optional)
         
     Returns:
         list: List of assessment dictionaries with title, date, and time
     """
+    segments = split_course_pack(text)
+    if len(segments) > 1:
+        return extract_course_pack_assessments(segments, tables)
+    
+    return extract_course_assessments(text, tables)
+
+
+def detect_course_code(text):
+    """
+    Find the first course code mentioned in a text.
+    
+    Args:
+        text (str): The syllabus text content
+        
+    Returns:
+        str: Normalised course code such as "FNCE 674", or None
+    """
+    match = COURSE_CODE_PATTERN.search(text)
+    if not match:
+        return None
+    return f"{match.group(1)} {match.group(2).replace(' ', '')}"
+
+
+def split_course_pack(text):
+    """
+    Split a document into one text segment per course outline.
+    
+    Course code mentions are grouped into runs; a run of at least
+    MIN_COURSE_MENTIONS mentions of a new code starts a new outline. Each
+    boundary is placed at the first blank line (page break) after the previous
+    outline's last mention, so an outline's first page stays with its course.
+    
+    Args:
+        text (str): The document text
+        
+    Returns:
+        list: (course_code, segment_text) tuples in document order; a single
+              outline yields one segment
+    """
+    runs = []
+    for match in COURSE_CODE_PATTERN.finditer(text):
+        code = f"{match.group(1)} {match.group(2).replace(' ', '')}"
+        if runs and runs[-1]["code"] == code:
+            runs[-1]["count"] += 1
+            runs[-1]["end"] = match.end()
+        else:
+            runs.append({"code": code, "start": match.start(), "end": match.end(), "count": 1})
+    
+    # Merge consecutive outline-sized runs of the same course; a short run
+    # still extends the current outline when it is of the same course (its
+    # mentions resume after a cross-reference)
+    blocks = []
+    for run in runs:
+        if run["count"] < MIN_COURSE_MENTIONS and blocks and blocks[-1]["code"] != run["code"]:
+            continue
+        if blocks and blocks[-1]["code"] == run["code"]:
+            blocks[-1]["end"] = run["end"]
+        else:
+            blocks.append(dict(run))
+    
+    if len(blocks) < 2:
+        code = blocks[0]["code"] if blocks else None
+        return [(code, text)]
+    
+    segments = []
+    segment_start = 0
+    for index, block in enumerate(blocks):
+        if index + 1 < len(blocks):
+            next_block = blocks[index + 1]
+            boundary = text.find("\n\n", block["end"], next_block["start"])
+            segment_end = boundary if boundary != -1 else next_block["start"]
+        else:
+            segment_end = len(text)
+        segments.append((block["code"], text[segment_start:segment_end]))
+        segment_start = segment_end
+    
+    return segments
+
+
+def extract_course_pack_assessments(segments, tables=None):
+    """
+    Extract the assessments of each course in a course pack (see extract_segments).
+    
+    Args:
+        segments (list): (course_code, segment_text) tuples from split_course_pack
+        tables (list): Assessment tables for the whole document (optional)
+        
+    Returns:
+        list: Assessment dictionaries from all courses, each with a "course" key,
+              sorted by date
+    """
+    segment_tables = assign_tables_to_segments(segments, tables or [])
+    jobs = [(text, segment_tables[index], code) for index, (code, text) in enumerate(segments)]
+    results = extract_segments(jobs)
+    
     events = []
-    today = datetime.now().strftime('%Y-%m-%d')
+    for (code, _), segment_events in zip(segments, results):
+        for event in segment_events:
+            event["course"] = code
+            events.append(event)
     
-    # Step 1: Look for pattern that indicates this is a course syllabus
-    course_code_match = re.search(r'(ENTI|FNCE|OBHR|SGMA|MKTG|ACCT)\s*\d{3}', text)
-    if not course_code_match:
-        # Not a course syllabus, return empty list
-        return []
-    
-    course_code = course_code_match.group(1)
-    
-    # Step 2: Handle different course syllabi formats
-    if "ENTI" in course_code:
-        # ENTI pattern: extract midterm, project, lab
-        events.extend(extract_enti_assessments(text))
-    elif "FNCE" in course_code:
-        # FNCE pattern: extract case write-ups, quizzes, in-class exercises
-        events.extend(extract_fnce_assessments(text))
-    elif "OBHR" in course_code:
-        # OBHR pattern: extract assessments from OBHR syllabi 
-        events.extend(extract_obhr_assessments(text))
-    elif "SGMA" in course_code:
-        # SGMA pattern: extract exams, papers
-        events.extend(extract_sgma_assessments(text))
-    else:
-        # General extraction for any course syllabus
-        events.extend(extract_general_course_assessments(text))
+    events.sort(key=lambda x: x["date"])
+    return events
+
+
+def assign_tables_to_segments(segments, tables):
+    """
+    Attach each rebuilt assessment table to the course segment it came from.
+    
+    A table belongs to the segment that contains most of the words of its rows.
+    
+    Args:
+        segments (list): (course_code, segment_text) tuples
+        tables (list): Assessment tables for the whole document
+        
+    Returns:
+        list: One list of tables per segment
+    """
+    segment_tables = [[] for _ in segments]
+    for table in tables:
+        words = {word for row in table["rows"] for word in re.findall(r'[A-Za-z]{4,}', row["text"])}
+        scores = [sum(1 for word in words if word in text) for _, text in segments]
+        segment_tables[scores.index(max(scores))].append(table)
+    return segment_tables
+
+
+def extract_segments(jobs):
+    """
+    Extract the assessments of course segments, in the worker pool when there are enough of them.
+    
+    Args:
+        jobs (list): (text, tables, course_code) tuples
+        
+    Returns:
+        list: One list of assessment dictionaries per job
+    """
+    if len(jobs) < MIN_POOL_SEGMENTS:
+        return [_extract_segment_assessments(job) for job in jobs]
+    
+    try:
+        return list(get_extraction_pool().map(_extract_segment_assessments, jobs))
+    except (OSError, RuntimeError) as e:
+        # Fall back to extracting in this process (e.g. where forking is
+        # unavailable, or a worker died); the pool is rebuilt on next use
+        logger.warning(f"Course pack worker pool unavailable, extracting sequentially: {e}")
+        _discard_extraction_pool()
+        return [_extract_segment_assessments(job) for job in jobs]
+
+
+def get_extraction_pool():
+    """Get this process' worker pool, creating it on first use (and again in a forked child)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _discard_extraction_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def _extract_segment_assessments(job):
+    """Worker entry point: extract the assessments of one course segment."""
+    text, tables, course_code = job
+    return extract_course_assessments(text, tables, course_code)
+
+
+def extract_course_assessments(text, tables=None, course_code=None):
+    """
+    Extract assessments from the outline of a single course.
+    
+    Args:
+        text (str): The syllabus text content
+        tables (list): Assessment tables rebuilt from the source document (optional)
+        course_code (str): Course code such as "FNCE 674" (optional, detected
+            from the text when not given)
+        
+    Returns:
+        list: List of assessment dictionaries with title, date, and time
+    """
+    events = []
+    
+    # Step 1: Read the syllabus' own assessment table (component / weight / date)
+    if tables:
+        events.extend(extract_table_assessments(tables, text))
+    
+    # Step 2: Look for pattern that indicates this is a course syllabus
+    if not course_code:
+        course_code_match = COURSE_CODE_PATTERN.search(text)
+        if not course_code_match and not events:
+            # Not a course syllabus, return empty list
+            return []
+        course_code = course_code_match.group(1) if course_code_match else ""
+    
+    # Step 3: Without a readable table, fall back to the course's hand-tuned
+    # profile or to the general patterns
+    if not events:
+        profile = next((extractor for prefix, extractor in COURSE_PROFILES if prefix in course_code), None)
+        if profile is not None:
+            events.extend(profile(text))
+        else:
+            events.extend(extract_general_course_assessments(text))
     
     # If no events found with specific extractors, try the general method
     if not events:
@@ -181,11 +413,11 @@ def extract_assessments_from_syllabus(text):
         if assessment_section:
             events.extend(extract_general_assessments(assessment_section))
     
-    # Step 3: Look for weekly assignments and participation
+    # Step 4: Look for weekly assignments and participation
     events = handle_weekly_assignments(text, events)
     events = add_participation_events(text, events)
     
-    # Step 4: Deduplicate and sort events
+    # Step 5: Deduplicate and sort events
     if events:
         # Eliminate duplicates
         unique_events = []
@@ -202,6 +434,259 @@ def extract_assessments_from_syllabus(text):
     
     return events
 
+def extract_table_assessments(tables, text):
+    """
+    Turn rebuilt assessment tables into events, one per table row.
+    
+    Each row is handled once, in order: the weight marks it as an assessment,
+    the date cell gives its date(s) and the assessment/description cells give
+    its title. A row listing several dates (e.g. "April 10 & April 14") becomes
+    one event per date.
+    
+    Args:
+        tables (list): Tables from document_parser.extract_assessment_tables
+        text (str): The full syllabus text, used to infer the year
+        
+    Returns:
+        list: List of assessment dictionaries, or an empty list if the tables
+              could not be read reliably
+    """
+    events = []
+    today = datetime.now().strftime('%Y-%m-%d')
+    default_year = infer_syllabus_year(text)
+    text_dates = find_text_dates(text)
+    compact_text = compact(text)
+    
+    for table in tables:
+        title_columns = [index for index, header in enumerate(table['header'])
+                         if TITLE_HEADER_PATTERN.search(header)]
+        if not title_columns:
+            continue
+        
+        table_events = []
+        unresolved_rows = 0
+        mismatched_rows = 0
+        for row in table['rows']:
+            row_text = row['text']
+            
+            # Collect the title pieces of each title column, dropping dates and numbers
+            title_cells = []
+            for index in title_columns:
+                pieces = [clean_table_title(piece) for piece in row['cells'][index]]
+                pieces = [piece for piece in pieces if piece]
+                if pieces:
+                    title_cells.append(pieces)
+            if not title_cells:
+                unresolved_rows += 1
+                continue
+            
+            time = extract_table_time(row_text)
+            
+            # Dates in the row; a year in the row overrides the inferred one
+            year_match = re.search(r'\b(20\d{2})\b', row_text)
+            year = year_match.group(1) if year_match else default_year
+            dates = []
+            for month, day in TABLE_DATE_PATTERN.findall(row_text):
+                date = extract_date_from_match(f"{month} {day.replace(' ', '')}, {year}")
+                if date and date not in dates:
+                    dates.append(date)
+            
+            if not dates:
+                # Markers wrap inside their cell ("See course" / "schedule")
+                cells_text = ' '.join(' '.join(cell) for cell in row['cells'])
+                schedule_match = SCHEDULE_MARKER_PATTERN.search(cells_text)
+                if not schedule_match:
+                    unresolved_rows += 1
+                    continue
+                # Ongoing items use today's date, like the other extractors
+                marker = schedule_match.group(0).lower()
+                time = "see course schedule" if "schedule" in marker or marker in ("tba", "tbd") \
+                    else "throughout the course"
+                dates = [today]
+            elif SCHEDULE_MARKER_PATTERN.search(row_text) and "throughout" in row_text.lower():
+                time = "throughout the course"
+            
+            if not row_matches_text(title_cells, dates if time not in UNDATED_TIMES else [], compact_text,
+                                    text_dates):
+                mismatched_rows += 1
+            
+            for position, date in enumerate(dates):
+                if len(dates) > 1 and any(len(pieces) == len(dates) for pieces in title_cells):
+                    # One title piece per date, e.g. "Quiz #2 | Quiz #3"
+                    parts = [pieces[position] if len(pieces) == len(dates) else ' '.join(pieces)
+                             for pieces in title_cells]
+                    title = ': '.join(parts)
+                else:
+                    title = ': '.join(' '.join(pieces) for pieces in title_cells)
+                    if len(dates) > 1:
+                        title = f"{title} (Part {position + 1})"
+                
+                table_events.append({
+                    "title": title,
+                    "date": date,
+                    "time": time
+                })
+        
+        # A table where most rows could not be read, or whose rows do not say
+        # what the text layer says, was probably mis-rebuilt
+        if mismatched_rows:
+            logger.info(f"Assessment table rejected: {mismatched_rows} rows do not match the text")
+        elif table_events and unresolved_rows <= len(table['rows']) // 2:
+            events.extend(table_events)
+    
+    return events
+
+
+def compact(text):
+    """Lower-case a text and drop its whitespace, which PDF text layers scatter inside words and numbers."""
+    return re.sub(r'\s+', '', text).lower()
+
+
+def find_text_dates(text):
+    """
+    Find the month-day dates written in a syllabus' text layer.
+    
+    Args:
+        text (str): The syllabus text content
+        
+    Returns:
+        list: (position in the compacted text, "MM-DD") tuples
+    """
+    dates = []
+    for match in COMPACT_DATE_PATTERN.finditer(compact(text)):
+        month = MONTH_NUMBERS[match.group(1)[:3]]
+        dates.append((match.start(), f"{month}-{match.group(2).zfill(2)}"))
+    return dates
+
+
+def row_matches_text(title_cells, dates, compact_text, text_dates):
+    """
+    Check a rebuilt table row against the syllabus' text layer.
+    
+    Every title cell must be written in the text, and each of the row's dates
+    must be written within TEXT_MATCH_WINDOW characters of one of them. Rows
+    built from pieces of neighbouring rows fail one or the other.
+    
+    Args:
+        title_cells (list): The row's title pieces, per title column
+        dates (list): The row's dates ("YYYY-MM-DD"), empty for ongoing work
+        compact_text (str): The text layer, compacted
+        text_dates (list): Dates of the text layer from find_text_dates
+        
+    Returns:
+        bool: True if the text layer backs the row
+    """
+    positions = []
+    for pieces in title_cells:
+        title = compact(' '.join(pieces))
+        found = [match.start() for match in re.finditer(re.escape(title), compact_text)]
+        if not found:
+            return False
+        positions.extend(found)
+    
+    for date in dates:
+        if not any(text_date == date[5:] and abs(text_position - position) <= TEXT_MATCH_WINDOW
+                   for text_position, text_date in text_dates for position in positions):
+            return False
+    return True
+
+
+# Table header cells that hold the assessment name
+TITLE_HEADER_PATTERN = re.compile(
+    r'assessment|component|deliverable|description|item|task|activit', re.IGNORECASE)
+
+# Month and day as written in assessment tables ("March 04", "Apr. 9"; PDF
+# text may split the day, "March 1 7")
+TABLE_DATE_PATTERN = re.compile(
+    r'\b(Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June?|July?|Aug(?:ust)?|'
+    r'Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)\.?\s+(\d(?: ?\d)?)(?:st|nd|rd|th)?\b',
+    re.IGNORECASE)
+
+# Month and day in compacted text (see compact)
+COMPACT_DATE_PATTERN = re.compile(
+    r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?(\d{1,2})(?!\d)')
+
+MONTH_NUMBERS = {month: f"{index:02d}" for index, month in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), start=1)}
+
+# Characters of compacted text around a table row's title within which its date must be written
+TEXT_MATCH_WINDOW = 300
+
+# Times given to ongoing items, which carry no date of their own
+UNDATED_TIMES = ("see course schedule", "throughout the course")
+
+# Date cells for ongoing work without a fixed due date
+SCHEDULE_MARKER_PATTERN = re.compile(
+    r'throughout|see course schedule|ongoing|on-going|weekly|each day|\btba\b|\btbd\b',
+    re.IGNORECASE)
+
+
+def clean_table_title(piece):
+    """
+    Remove dates, weights and stray numbers from a table cell piece.
+    
+    Args:
+        piece (str): Text from an assessment or description cell
+        
+    Returns:
+        str: Cleaned title text (empty if nothing meaningful is left)
+    """
+    title = TABLE_DATE_PATTERN.sub('', piece)
+    title = re.sub(r'\b20\d{2}\b|\d{1,3}(?:\.\d+)?\s*%', '', title)
+    title = re.sub(r'\((?:in|during|before)\s+class\)', '', title, flags=re.IGNORECASE)
+    title = re.sub(r'#\s+(\d)', r'#\1', title)
+    title = re.sub(r'\s+', ' ', title).strip(' ,&:;-')
+    
+    # Skip fragments that are only numbers or punctuation (e.g. outcome lists)
+    if re.fullmatch(r'[\d\s,.;&()-]*', title):
+        return ""
+    
+    return title
+
+
+def extract_table_time(row_text):
+    """
+    Find the due time of an assessment table row.
+    
+    Args:
+        row_text (str): The row text in reading order
+        
+    Returns:
+        str: Time description, "during class" by default
+    """
+    time_match = re.search(r'\b(\d{1,2}:\d{2})\s*(am|pm)?', row_text, re.IGNORECASE)
+    if time_match:
+        return time_match.group(1) + (time_match.group(2) or '').lower()
+    
+    row_lower = row_text.lower()
+    if 'before class' in row_lower:
+        return 'before class'
+    
+    return 'during class'
+
+
+def infer_syllabus_year(text):
+    """
+    Infer the year of a syllabus' term for dates written without a year.
+    
+    Args:
+        text (str): The syllabus text content
+        
+    Returns:
+        str: Four-digit year
+    """
+    # PDF text sometimes splits the year ("Fall 202 4")
+    term_match = re.search(r'\b(?:Winter|Spring|Summer|Fall)\s+(2\s?0\s?\d\s?\d)\b', text, re.IGNORECASE)
+    if term_match:
+        return term_match.group(1).replace(' ', '')
+    
+    year_match = re.search(r'\b(20\d{2})\b', text)
+    if year_match:
+        return year_match.group(1)
+    
+    return str(datetime.now().year)
+
+
 def extract_enti_assessments(text):
     """Extract assessments from ENTI syllabi"""
     events = []
@@ -423,6 +908,15 @@ def extract_sgma_assessments(text):
     
     return events
 
+# Hand-tuned extractors for known courses, by course code prefix
+COURSE_PROFILES = (
+    ("ENTI", extract_enti_assessments),
+    ("FNCE", extract_fnce_assessments),
+    ("OBHR", extract_obhr_assessments),
+    ("SGMA", extract_sgma_assessments),
+)
+
+
 def extract_general_course_assessments(text):
     """Extract assessments from any course syllabus using general patterns"""
     events = []
@@ -0,0 +1,414 @@
+"""
+Syllabus Revisions Module
+
+This module handles revised versions of a course outline. The new text is
+compared with the previous version of the same course at paragraph level
+(pages are separated by blank lines too); extraction re-runs only on the
+changed paragraphs and the events of unchanged paragraphs are reused.
+
+The result also lists which events were added, changed or removed compared
+with the previous version, which the upload reports to the user. Calendar
+pushes work out their own changes against the events already emitted (see
+calendar_outbox.diff_events).
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+from difflib import SequenceMatcher
+
+from syllabus_extractor import (split_course_pack, assign_tables_to_segments, extract_segments,
+                                extract_assessments_from_syllabus, extraction_day, EXTRACTOR_VERSION)
+
+logger = logging.getLogger(__name__)
+
+# Paragraphs are separated by blank (or whitespace-only) lines
+PARAGRAPH_BREAK_PATTERN = re.compile(r'\n\s*\n')
+
+# Share of an event title's words a paragraph must mention to be its source
+MIN_TITLE_COVERAGE = 0.6
+
+# Leading text (course code, term) re-extracted along with the changed paragraphs
+REGION_CONTEXT_CHARS = 1000
+
+
+class RevisionStore:
+    """
+    Directory store keeping the last processed version of each owner's courses.
+
+    The owner is the user (or anonymous browser) who uploaded the outline, so
+    each of them is compared with their own previous upload of a course. Each
+    course is one JSON file, <root>/<owner>/<course>.json, holding the
+    paragraph hashes of its text and its events, each with the index of the
+    paragraph it was found in, stamped with the extractor version and day
+    that found them.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, owner, course_code):
+        directory = re.sub(r'[^A-Za-z0-9]+', '_', owner).strip('_')
+        name = re.sub(r'[^A-Za-z0-9]+', '_', course_code).strip('_')
+        return os.path.join(self.root, directory, f"{name}.json")
+
+    def load(self, owner, course_code):
+        try:
+            with open(self._path(owner, course_code), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable revision of {course_code} for {owner}: {e}")
+            return None
+
+    def save(self, owner, course_code, record):
+        path = self._path(owner, course_code)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A unique temporary file in the target directory, so concurrent saves never share one
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def split_paragraphs(text):
+    """
+    Split text into paragraphs.
+
+    Args:
+        text (str): Document or course segment text
+
+    Returns:
+        list: Non-empty paragraph strings in document order
+    """
+    return [paragraph for paragraph in PARAGRAPH_BREAK_PATTERN.split(text) if paragraph.strip()]
+
+
+def compact(text):
+    """Lowercase text without whitespace; PDF text often splits words ("Mar ch 1 1")."""
+    return re.sub(r'\s+', '', text).lower()
+
+
+def paragraph_hash(paragraph):
+    return hashlib.sha256(compact(paragraph).encode('utf-8')).hexdigest()
+
+
+def locate_event_source(event, compact_paragraphs):
+    """
+    Find the paragraph an event was extracted from.
+
+    The paragraph mentioning most of the title's words wins; ties go to the
+    paragraph that also mentions the event's date, then to the earliest one.
+
+    Args:
+        event (dict): Event with title and date (YYYY-MM-DD)
+        compact_paragraphs (list): Paragraphs passed through compact()
+
+    Returns:
+        int: Paragraph index, or None when the event cannot be pinned to one
+             paragraph (e.g. recurring work derived from the whole outline)
+    """
+    if event.get('recurrence'):
+        return None
+
+    title = re.sub(r'\s*\(Part \d+\)$', '', event.get('title', ''))
+    words = [compact(word) for word in re.findall(r'[A-Za-z0-9#]{3,}', title)]
+    if not words:
+        return None
+
+    date_mentions = []
+    try:
+        date_obj = datetime.strptime(event['date'], '%Y-%m-%d')
+        date_mentions = [re.compile(re.escape(compact(f"{name} {date_obj.day}")) + r'(?!\d)')
+                         for name in (date_obj.strftime('%B'), date_obj.strftime('%b'))]
+    except (KeyError, ValueError):
+        pass
+
+    best_index, best_score = None, None
+    for index, paragraph in enumerate(compact_paragraphs):
+        coverage = sum(1 for word in words if word in paragraph) / len(words)
+        if coverage < MIN_TITLE_COVERAGE:
+            continue
+        score = (coverage, any(pattern.search(paragraph) for pattern in date_mentions))
+        if best_score is None or score > best_score:
+            best_index, best_score = index, score
+    return best_index
+
+
+def diff_events(old_events, new_events):
+    """
+    Compare two event lists by title.
+
+    Args:
+        old_events (list): Events of the previous version
+        new_events (list): Events of the new version
+
+    Returns:
+        dict: {"added": [...], "changed": [...], "removed": [...]}; changed
+              events are the new versions
+    """
+    def keyed(events):
+        keys = {}
+        for event in events:
+            key = (event.get('course'), event['title'])
+            keys.setdefault(key, []).append(event)
+        return keys
+
+    old_keyed = keyed(old_events)
+    new_keyed = keyed(new_events)
+    delta = {'added': [], 'changed': [], 'removed': []}
+
+    for key, events in new_keyed.items():
+        previous = old_keyed.get(key, [])
+        for index, event in enumerate(events):
+            if index >= len(previous):
+                delta['added'].append(event)
+            elif any(event.get(field) != previous[index].get(field) for field in ('date', 'time', 'recurrence')):
+                delta['changed'].append(event)
+
+    for key, events in old_keyed.items():
+        delta['removed'].extend(events[len(new_keyed.get(key, [])):])
+
+    return delta
+
+
+def extract_course_revision(course_code, text, tables, store, owner, extract=extract_segments):
+    """
+    Extract the events of one course, reusing its previous version where unchanged.
+
+    Args:
+        course_code (str): Course code such as "FNCE 674"
+        text (str): The course's outline text
+        tables (list): Assessment tables rebuilt for this course
+        store (RevisionStore): Previous versions of each course
+        owner (str): Whose previous version to compare with
+        extract (callable): extract(jobs) -> one event list per
+            (text, tables, course_code) job
+
+    Returns:
+        tuple: (events, delta) where delta is the diff_events() result
+    """
+    revision = plan_course_revision(course_code, text, tables, store.load(owner, course_code))
+    extract_revisions([revision], extract)
+    return finish_course_revision(revision, store, owner)
+
+
+def is_current(record):
+    """Check whether a stored version was extracted by this extractor version today."""
+    return (record.get('extractor_version') == EXTRACTOR_VERSION and
+            record.get('extraction_day') == extraction_day())
+
+
+def plan_course_revision(course_code, text, tables, previous):
+    """
+    Work out what a course's new version needs extracted.
+
+    Args:
+        course_code (str): Course code such as "FNCE 674"
+        text (str): The course's outline text
+        tables (list): Assessment tables rebuilt for this course
+        previous (dict): The stored previous version, or None; its events
+            are only reused when is_current(previous)
+
+    Returns:
+        dict: The revision; its "entries" are set when nothing needs
+              extracting, otherwise its "job" is the (text, tables,
+              course_code) extraction to run, over the whole outline or only
+              the changed paragraphs
+    """
+    paragraphs = split_paragraphs(text)
+    # Events found by another extractor version or on another day are compared
+    # with, but never reused
+    reusable = previous if previous and is_current(previous) else None
+    revision = {
+        'course_code': course_code,
+        'text': text,
+        'tables': tables,
+        'paragraphs': paragraphs,
+        'compact_paragraphs': [compact(paragraph) for paragraph in paragraphs],
+        'hashes': [paragraph_hash(paragraph) for paragraph in paragraphs],
+        'previous': reusable,
+        'old_events': [entry['event'] for entry in previous['events']] if previous else [],
+        'entries': None,
+        'region': None,
+    }
+
+    if reusable and reusable['paragraph_hashes'] == revision['hashes']:
+        revision['entries'] = reusable['events']
+    elif reusable and all(entry['source'] is not None for entry in reusable['events']):
+        _plan_changed_paragraphs(revision)
+    else:
+        # First version, or events that depend on the whole outline: extract everything
+        revision['job'] = (text, tables, course_code)
+    return revision
+
+
+def extract_revisions(revisions, extract):
+    """
+    Run the extractions the revisions need, all in one call to extract.
+
+    A course pack's changed courses are thus extracted together (through the
+    worker pool with the default extract). A partial extraction whose events
+    cannot be pinned to a paragraph is redone over the whole outline.
+
+    Args:
+        revisions (list): Revisions from plan_course_revision
+        extract (callable): extract(jobs) -> one event list per job
+    """
+    for _ in range(2):
+        pending = [revision for revision in revisions if revision['entries'] is None]
+        if not pending:
+            return
+        for revision, events in zip(pending, extract([revision['job'] for revision in pending])):
+            if revision['region'] is None:
+                revision['entries'] = [{'event': event, 'source': locate_event_source(
+                    event, revision['compact_paragraphs'])} for event in events]
+                continue
+            revision['entries'] = _place_region_events(revision, events)
+            if revision['entries'] is None:
+                revision['region'] = None
+                revision['job'] = (revision['text'], revision['tables'], revision['course_code'])
+
+
+def finish_course_revision(revision, store, owner):
+    """
+    Store an extracted revision as the course's latest version.
+
+    Returns:
+        tuple: (events, delta) where delta is the diff_events() result
+    """
+    previous = revision['previous']
+    events = [entry['event'] for entry in revision['entries']]
+    if previous and previous['paragraph_hashes'] == revision['hashes']:
+        return events, diff_events(events, events)
+
+    store.save(owner, revision['course_code'], {'paragraph_hashes': revision['hashes'],
+                                                'events': revision['entries'],
+                                                'extractor_version': EXTRACTOR_VERSION,
+                                                'extraction_day': extraction_day()})
+    return events, diff_events(revision['old_events'], events)
+
+
+def _plan_changed_paragraphs(revision):
+    """Plan the re-extraction of only the changed paragraphs of a revised outline."""
+    previous, paragraphs = revision['previous'], revision['paragraphs']
+    matcher = SequenceMatcher(None, previous['paragraph_hashes'], revision['hashes'], autojunk=False)
+    unchanged = {}
+    changed = set()
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == 'equal':
+            for offset in range(old_end - old_start):
+                unchanged[old_start + offset] = new_start + offset
+        else:
+            changed.update(range(new_start, new_end))
+
+    reused = [{'event': entry['event'], 'source': unchanged[entry['source']]}
+              for entry in previous['events'] if entry['source'] in unchanged]
+
+    # The opening paragraphs name the course and term, which date parsing relies on
+    region = []
+    context_length = 0
+    for index, paragraph in enumerate(paragraphs):
+        if context_length >= REGION_CONTEXT_CHARS:
+            break
+        region.append(index)
+        context_length += len(paragraph)
+    region += [index for index in sorted(changed) if index not in region]
+
+    if not changed:
+        revision['entries'] = sorted(reused, key=lambda entry: entry['event']['date'])
+        return
+    revision.update(reused=reused, changed=changed, region=region,
+                    job=("\n\n".join(paragraphs[index] for index in region), revision['tables'],
+                         revision['course_code']))
+
+
+def _place_region_events(revision, region_events):
+    """
+    Merge the events re-extracted from the changed paragraphs with the reused ones.
+
+    Returns:
+        list: {"event", "source"} entries, reused plus re-extracted, or None
+              when a new event cannot be pinned to a paragraph and a full
+              extraction is needed
+    """
+    region, changed = revision['region'], revision['changed']
+    compact_paragraphs = revision['compact_paragraphs']
+    entries = list(revision['reused'])
+
+    reused_titles = {entry['event']['title'] for entry in entries}
+    seen = {(entry['event']['title'], entry['event']['date']) for entry in entries}
+    for event in region_events:
+        # Only look in the region: the event came from it, and a date that
+        # moved away may still be mentioned in an unchanged paragraph
+        position = locate_event_source(event, [compact_paragraphs[index] for index in region])
+        if position is None:
+            return None
+        source = region[position]
+        # Events found in the context paragraphs were reused unless their
+        # source paragraph changed
+        if source not in changed and event['title'] in reused_titles:
+            continue
+        if (event['title'], event['date']) not in seen:
+            entries.append({'event': event, 'source': source})
+            seen.add((event['title'], event['date']))
+
+    logger.info(f"{revision['course_code']}: re-extracted {len(changed)} of {len(revision['paragraphs'])} "
+                f"paragraphs, reused {len(revision['reused'])} events")
+    entries.sort(key=lambda entry: entry['event']['date'])
+    return entries
+
+
+def extract_syllabus_revision(text, tables, store, owner, extract=extract_segments):
+    """
+    Extract a syllabus or course pack incrementally against stored previous versions.
+
+    Only the courses of a pack that changed are extracted, all in one call to
+    extract, so they share the course pack worker pool.
+
+    Args:
+        text (str): The document text
+        tables (list): Assessment tables rebuilt from the document
+        store (RevisionStore): Previous versions of each course
+        owner (str): Whose previous versions to compare with
+        extract (callable): extract(jobs) -> one event list per
+            (text, tables, course_code) job
+
+    Returns:
+        tuple: (events, delta); documents without a course code are extracted
+               in full and all their events reported as added
+    """
+    segments = split_course_pack(text)
+    if segments[0][0] is None:
+        events = extract_assessments_from_syllabus(text, tables)
+        return events, diff_events([], events)
+
+    segment_tables = assign_tables_to_segments(segments, tables or [])
+    revisions = [plan_course_revision(course_code, segment_text, segment_tables[index],
+                                      store.load(owner, course_code))
+                 for index, (course_code, segment_text) in enumerate(segments)]
+    extract_revisions(revisions, extract)
+
+    events = []
+    delta = {'added': [], 'changed': [], 'removed': []}
+    for revision in revisions:
+        course_events, course_delta = finish_course_revision(revision, store, owner)
+        if len(segments) > 1:
+            for event in course_events + [e for changes in course_delta.values() for e in changes]:
+                event['course'] = revision['course_code']
+        events.extend(course_events)
+        for kind, changes in course_delta.items():
+            delta[kind].extend(changes)
+
+    events.sort(key=lambda x: x['date'])
+    return events, delta
@@ -0,0 +1,105 @@
+"""
+Tests for assessment extraction from the course outlines in attached_assets.
+
+Each outline is run through the same path as an upload (text layer plus
+rebuilt assessment table) and must give the events pinned below. Ongoing
+items ("throughout the course", "see course schedule") have no date of
+their own, so only their title and time are pinned.
+"""
+
+import glob
+
+from document_parser import extract_text_from_file, extract_assessment_tables
+from syllabus_extractor import (extract_assessments_from_syllabus, extract_table_assessments, row_matches_text,
+                                compact, find_text_dates, UNDATED_TIMES)
+
+EXPECTED = {
+    'ENTI 674': [
+        ('Midterm Quiz', '2025-03-27', 'during class'),
+        ('Group Project (Part 1)', '2025-04-10', 'during class'),
+        ('Group Project (Part 2)', '2025-04-14', 'during class'),
+        ('Class Participation', None, 'throughout the course'),
+        ('Lab', None, 'see course schedule'),
+    ],
+    'FNCE 674': [
+        ('Nike CoC Case Write-up', '2025-03-01', 'before class'),
+        ('Risk Portfolio Simulation', '2025-03-04', 'during class'),
+        ('Nike CoC Exercise', '2025-03-04', 'during class'),
+        ('Winfield Exercise', '2025-03-11', 'during class'),
+        ('Quiz #1', '2025-03-11', 'during class'),
+        ('Cap Str/Derivatives Exercise', '2025-03-18', 'during class'),
+        ('Quiz #2', '2025-03-18', 'during class'),
+        ('Resource Allocation Exercise', '2025-03-25', 'during class'),
+        ('Quiz #3', '2025-03-25', 'during class'),
+        ('Invest or Take Case Write-up', '2025-04-01', 'before class'),
+        ('Compensation Exercise', '2025-04-01', 'during class'),
+        ('Ethics Exercise', '2025-04-08', 'during class'),
+        ('Final Quiz', '2025-04-08', 'during class'),
+    ],
+    'OBHR 674': [
+        ('Class Participation', None, 'throughout the course'),
+        ('Assignment #1', '2025-03-25', 'during class'),
+        ('Assignment #2', '2025-04-08', 'during class'),
+        ('Group Exercise #1', '2025-04-10', 'during class'),
+        ('Group Project #2', '2025-04-11', 'during class'),
+    ],
+    'SGMA 672': [
+        ('Class Presentation', None, 'throughout the course'),
+        ('Exam #1', '2025-03-19', 'during class'),
+        ('Exam #2', '2025-04-02', 'during class'),
+        ('Exam #3', '2025-04-09', 'during class'),
+        ('Personal Strategy Paper', '2025-04-09', 'during class'),
+        ('Participation and Contribution', None, 'throughout the course'),
+    ],
+}
+
+
+def outline_path(course):
+    return glob.glob(f"attached_assets/W25 {course} *.pdf")[0]
+
+
+def extract(course):
+    path = outline_path(course)
+    return extract_assessments_from_syllabus(extract_text_from_file(path), extract_assessment_tables(path))
+
+
+def pinned(events):
+    return sorted((event['title'], None if event['time'] in UNDATED_TIMES else event['date'], event['time'])
+                  for event in events)
+
+
+def test_enti_outline():
+    assert pinned(extract('ENTI 674')) == sorted(EXPECTED['ENTI 674'])
+
+
+def test_fnce_outline():
+    assert pinned(extract('FNCE 674')) == sorted(EXPECTED['FNCE 674'])
+
+
+def test_obhr_outline():
+    assert pinned(extract('OBHR 674')) == sorted(EXPECTED['OBHR 674'])
+
+
+def test_sgma_outline():
+    assert pinned(extract('SGMA 672')) == sorted(EXPECTED['SGMA 672'])
+
+
+def test_misbuilt_tables_fall_back_to_the_course_profile():
+    # The OBHR table is rebuilt with rows shifted into their neighbours
+    # ("Individual Assignment #2 Group Exercises #1"), which the text layer does not say
+    for course in ('FNCE 674', 'OBHR 674'):
+        path = outline_path(course)
+        text = extract_text_from_file(path)
+        assert extract_table_assessments(extract_assessment_tables(path), text) == []
+        assert pinned(extract_assessments_from_syllabus(text)) == sorted(EXPECTED[course])
+
+
+def test_rows_must_match_the_text_layer():
+    text = "Individual Assignment #1 Culture of Diversity Due: Marc h 1 7, 2025\n" + "x" * 400 + "\nApril 10"
+    compact_text, text_dates = compact(text), find_text_dates(text)
+    title = [['Individual Assignment #1', 'Culture of Diversity']]
+
+    assert row_matches_text(title, ['2025-03-17'], compact_text, text_dates)
+    assert not row_matches_text(title, ['2025-03-01'], compact_text, text_dates)
+    assert not row_matches_text(title, ['2025-04-10'], compact_text, text_dates)
+    assert not row_matches_text([['Individual Assignment #2']], [], compact_text, text_dates)
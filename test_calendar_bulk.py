@@ -0,0 +1,155 @@
+"""
+Conformance tests for the bulk calendar serializer.
+
+Calendars written by calendar_generator.serialize_calendar are parsed back
+with icalendar and compared with the event data and with the output of the
+icalendar object model (create_ics_file).
+"""
+
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from dateutil import tz
+from icalendar import Calendar
+
+from calendar_generator import (serialize_calendar, create_ics_file, create_calendar_file,
+                                write_calendar_file, make_event_uid, MAX_LINE_OCTETS)
+
+
+def sample_events():
+    return [
+        {
+            'title': 'FNCE 674: Quiz #1, Project valuation; part A\\B',
+            'start_time': datetime(2025, 3, 11, 9, 0),
+            'end_time': datetime(2025, 3, 11, 11, 50),
+            'description': 'Course: FNCE 674\nAssessment: Quiz #1\r\nTime: during class',
+            'location': 'MTH 445, Room 2',
+        },
+        {
+            'title': 'Weekly Assignment',
+            'start_time': datetime(2025, 3, 4, 9, 0),
+            'recurrence': {'frequency': 'weekly', 'until': '2025-04-08', 'exdates': ['2025-03-11', '2025-03-25']},
+        },
+        {
+            'title': 'Réflexion écrite – ' + 'é' * 60,
+            'start_time': datetime(2025, 4, 1, 13, 0, tzinfo=timezone.utc),
+            'end_time': datetime(2025, 4, 1, 14, 0, tzinfo=timezone.utc),
+            'description': 'Ünïcödé ' * 30,
+        },
+    ]
+
+
+def parse_events(data):
+    return Calendar.from_ical(data).walk('VEVENT')
+
+
+def test_round_trip_fields():
+    events = sample_events()
+    parsed = parse_events(serialize_calendar(events))
+
+    assert len(parsed) == len(events)
+    for event_data, vevent in zip(events, parsed):
+        assert str(vevent.get('summary')) == event_data['title']
+        assert str(vevent.get('description')) == event_data.get('description', '').replace('\r', '')
+        if event_data.get('location'):
+            assert str(vevent.get('location')) == event_data['location']
+        assert vevent.decoded('dtstart') == event_data['start_time']
+        expected_end = event_data.get('end_time') or event_data['start_time'] + timedelta(hours=1)
+        assert vevent.decoded('dtend') == expected_end
+        assert vevent.get('uid')
+        assert vevent.get('dtstamp')
+
+
+def test_recurrence_round_trip():
+    vevent = parse_events(serialize_calendar(sample_events()))[1]
+
+    rrule = vevent.get('rrule')
+    assert rrule['FREQ'] == ['WEEKLY']
+    assert rrule['UNTIL'] == [datetime(2025, 4, 8, 23, 59, 59)]
+    exdates = [exdate.dt for exdate in vevent.get('exdate').dts]
+    assert exdates == [datetime(2025, 3, 11, 9, 0), datetime(2025, 3, 25, 9, 0)]
+
+
+def test_lines_are_folded_and_crlf_terminated():
+    data = serialize_calendar(sample_events())
+
+    assert data.endswith(b'\r\n')
+    for line in data.split(b'\r\n'):
+        assert len(line) <= MAX_LINE_OCTETS
+        # Folding never splits a UTF-8 sequence
+        line.decode('utf-8')
+    assert b'\n' not in data.replace(b'\r\n', b'')
+
+
+def test_uids_are_unique():
+    parsed = parse_events(serialize_calendar(sample_events() * 3))
+    uids = [str(vevent.get('uid')) for vevent in parsed]
+    assert len(set(uids)) == len(uids)
+
+
+def test_time_zone_fallback():
+    calgary = tz.gettz('America/Edmonton')
+    event = {'title': 'Exam #1', 'start_time': datetime(2025, 3, 19, 9, 0, tzinfo=calgary)}
+    vevent = parse_events(serialize_calendar([event]))[0]
+
+    assert vevent.decoded('dtstart') == event['start_time']
+    assert vevent.decoded('dtend') == event['start_time'] + timedelta(hours=1)
+
+
+def test_matches_object_model_output():
+    with tempfile.TemporaryDirectory() as output_dir:
+        for event_data in sample_events():
+            with open(create_ics_file(event_data, output_dir), 'rb') as f:
+                expected = parse_events(f.read())[0]
+            actual = parse_events(serialize_calendar([event_data]))[0]
+
+            for field in ('summary', 'description', 'location'):
+                assert str(actual.get(field, '')) == str(expected.get(field, ''))
+            for field in ('dtstart', 'dtend'):
+                assert actual.decoded(field) == expected.decoded(field)
+            assert actual.get('rrule') == expected.get('rrule')
+
+
+def test_create_calendar_file():
+    with tempfile.TemporaryDirectory() as output_dir:
+        first = create_calendar_file(sample_events(), output_dir, name='FNCE 674', shard='user_1')
+        second = create_calendar_file(sample_events(), output_dir, name='FNCE 674', shard='user_1')
+
+        assert first != second
+        assert os.path.dirname(first) == os.path.join(output_dir, 'user_1')
+        assert sorted(os.listdir(os.path.dirname(first))) == sorted([os.path.basename(first), os.path.basename(second)])
+        with open(first, 'rb') as f:
+            assert len(parse_events(f.read())) == len(sample_events())
+        assert create_calendar_file([], output_dir) is None
+
+
+def test_write_calendar_file_is_content_addressed():
+    with tempfile.TemporaryDirectory() as output_dir:
+        data = serialize_calendar(sample_events())
+        first = write_calendar_file(output_dir, 'FNCE_674', data)
+        second = write_calendar_file(output_dir, 'FNCE_674', data)
+        other = write_calendar_file(output_dir, 'FNCE_674', data + b' ')
+
+        assert first == second != other
+        # No temporary files are left behind
+        assert sorted(os.listdir(output_dir)) == sorted([os.path.basename(first), os.path.basename(other)])
+        with open(first, 'rb') as f:
+            assert f.read() == data
+
+
+def test_event_uids_are_stable():
+    uid = make_event_uid('FNCE 674', 'Quiz #1: Project valuation', '2025-03-11')
+
+    assert uid == make_event_uid('FNCE 674', 'FNCE 674: quiz #1 -  Project Valuation', datetime(2025, 3, 11, 9, 0))
+    assert uid != make_event_uid('FNCE 674', 'Quiz #2: Project valuation', '2025-03-11')
+    assert uid != make_event_uid('FNCE 674', 'Quiz #1: Project valuation', '2025-03-18')
+    assert uid != make_event_uid('ENTI 674', 'Quiz #1: Project valuation', '2025-03-11')
+
+    # Ongoing items are dated the day they are extracted, so their date is left out
+    ongoing = make_event_uid('FNCE 674', 'Class Participation', None)
+    assert ongoing == make_event_uid('FNCE 674', 'FNCE 674: Class participation', None)
+    assert ongoing != make_event_uid('FNCE 674', 'Class Participation', '2025-03-11')
+
+    event = dict(sample_events()[0], uid=uid)
+    assert str(parse_events(serialize_calendar([event]))[0].get('uid')) == uid
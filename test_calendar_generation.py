@@ -12,7 +12,7 @@ This script:
 import json
 import os
 from datetime import datetime
-from document_parser import parse_document
+from document_parser import parse_document, extract_assessment_tables
 from syllabus_extractor import extract_assessments_from_syllabus
 from calendar_generator import create_multiple_ics_files
 
@@ -49,8 +49,9 @@ def main():
         text = parse_document(syllabus_path)
         print(f"  - Extracted {len(text)} characters")
         
-        # Extract assessments
-        assessments = extract_assessments_from_syllabus(text)
+        # Extract assessments, using the rebuilt assessment table when available
+        tables = extract_assessment_tables(syllabus_path)
+        assessments = extract_assessments_from_syllabus(text, tables)
         print(f"  - Found {len(assessments)} assessments")
         
         for assessment in assessments:
@@ -90,6 +91,8 @@ def main():
                 "end_time": end_time,
                 "description": f"Course: {course_name}\nAssessment: {assessment['title']}\nTime: {assessment['time']}"
             }
+            if assessment.get("recurrence"):
+                event["recurrence"] = assessment["recurrence"]
             
             all_events.append(event)
             print(f"    - Added: {title} on {assessment['date']}")
@@ -0,0 +1,274 @@
+"""
+Tests for the calendar outbox against a throwaway SQLite database.
+
+The providers are replaced by a stand-in calendar that records the changes
+sent to it and answers pulls with the changes queued on it.
+"""
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+# The app reads its configuration on import
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'outbox.db')}"
+os.environ['OUTBOX_WORKERS'] = '0'
+os.environ['HEALTH_PROBE_INTERVAL'] = '0'
+
+from app import app, db
+import calendar_outbox
+from models import User, OutboxPush, EmittedEvent, SyncCursor, save_user_token
+from calendar_outbox import (enqueue_pushes, diff_events, drain_outbox, claim_pushes, send_pushes, MAX_ATTEMPTS,
+                             LEASE_SECONDS, RETRY_DELAY)
+from calendar_sync import graph_change
+
+QUIZZES = {
+    'uid': 'quizzes@date-extractor',
+    'course': 'FNCE101',
+    'title': 'FNCE101: Weekly quiz',
+    'description': 'Chapters of the week',
+    'location': None,
+    'start_time': datetime(2025, 3, 11, 9),
+    'end_time': datetime(2025, 3, 11, 10),
+    'recurrence': {'frequency': 'weekly', 'until': '2025-04-29', 'exdates': ['2025-03-18']},
+}
+
+
+class StandInCalendar:
+    """Records the changes pushed to it and answers pulls with queued changes."""
+
+    def __init__(self):
+        self.sent = []
+        self.pending_changes = []
+
+    def push(self, changes, user=None):
+        self.sent.extend(changes)
+        # Etag of the series after its skipped weeks were deleted
+        return [{'success': True, 'message': "Event added to Outlook Calendar",
+                 'remote_id': change['remote_id'] or 'o1', 'etag': 'W/"2"', 'retry': False}
+                for change in changes]
+
+    def pull(self, cursor, user=None, calendar_id=None):
+        changes, self.pending_changes = self.pending_changes, []
+        return changes, 'delta-1'
+
+
+    def fail(self, changes, user=None):
+        self.sent.extend(changes)
+        return [{'success': False, 'message': "Outlook is busy", 'retry': True} for change in changes]
+
+
+def with_outbox(test):
+    stand_in = StandInCalendar()
+    saved = [dict(registry) for registry in (calendar_outbox.PUSHERS, calendar_outbox.PULLERS,
+                                             calendar_outbox.CALENDAR_CREATORS)]
+    calendar_outbox.PUSHERS['Outlook'] = stand_in.push
+    calendar_outbox.PULLERS['Outlook'] = stand_in.pull
+    try:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            user = User(username='student', email='student@example.com')
+            db.session.add(user)
+            db.session.commit()
+            test(user, stand_in)
+            db.session.remove()
+    finally:
+        for registry, entries in zip((calendar_outbox.PUSHERS, calendar_outbox.PULLERS,
+                                      calendar_outbox.CALENDAR_CREATORS), saved):
+            registry.update(entries)
+
+
+def push(user, events_data, removed=()):
+    enqueue_pushes(user, 'batch-1', 'Outlook', events_data, removed)
+    db.session.commit()
+    return drain_outbox()
+
+
+def test_recurring_event_round_trip():
+    def test(user, stand_in):
+        assert push(user, [QUIZZES]) == 1
+        assert len(stand_in.sent) == 1
+
+        # Graph reports the series back with its pattern, without the skipped weeks
+        stand_in.pending_changes = [graph_change({
+            'id': 'o1', '@odata.etag': 'W/"3"', 'type': 'seriesMaster',
+            'subject': 'FNCE101: Weekly quiz', 'body': {'content': 'Chapters of the week'},
+            'start': {'dateTime': '2025-03-11T09:00:00.0000000', 'timeZone': 'UTC'},
+            'end': {'dateTime': '2025-03-11T10:00:00.0000000', 'timeZone': 'UTC'},
+            'recurrence': {'pattern': {'type': 'weekly', 'interval': 1, 'daysOfWeek': ['tuesday']},
+                           'range': {'type': 'endDate', 'startDate': '2025-03-11', 'endDate': '2025-04-29'}},
+        })]
+        changed, skipped, removed = diff_events(user, 'Outlook', [QUIZZES])
+        assert (changed, removed) == ([], [])
+        assert push(user, [QUIZZES]) == 1
+
+        row = EmittedEvent.query.filter_by(uid=QUIZZES['uid']).one()
+        assert row.remote_status is None
+        assert row.etag == 'W/"3"'
+        assert len(stand_in.sent) == 1
+        assert OutboxPush.query.filter_by(status='sent').count() == 2
+
+    with_outbox(test)
+
+
+def test_recurring_event_edited_in_calendar_is_left_alone():
+    def test(user, stand_in):
+        push(user, [QUIZZES])
+
+        stand_in.pending_changes = [graph_change({
+            'id': 'o1', '@odata.etag': 'W/"3"', 'subject': 'Weekly quiz (room 2)',
+            'body': {'content': 'Chapters of the week'},
+            'start': {'dateTime': '2025-03-11T09:00:00.0000000', 'timeZone': 'UTC'},
+            'end': {'dateTime': '2025-03-11T10:00:00.0000000', 'timeZone': 'UTC'},
+        })]
+        push(user, [dict(QUIZZES, description='Chapters of the week and the last')])
+
+        row = EmittedEvent.query.filter_by(uid=QUIZZES['uid']).one()
+        assert row.remote_status == 'edited'
+        assert len(stand_in.sent) == 1
+
+    with_outbox(test)
+
+
+def test_one_cursor_per_calendar():
+    def test(user, stand_in):
+        push(user, [QUIZZES])
+        push(user, [dict(QUIZZES, description='Chapters of the week and the last')])
+        push(user, [QUIZZES])
+
+        cursors = SyncCursor.query.filter_by(user_id=user.id, calendar='Outlook').all()
+        assert [cursor.calendar_id for cursor in cursors] == ['']
+
+    with_outbox(test)
+
+
+def test_deselected_events_are_not_removed():
+    def test(user, stand_in):
+        events_data = [dict(QUIZZES, uid=f"{title}@date-extractor", title=title, recurrence=None)
+                       for title in ('Quiz 1', 'Quiz 2', 'Quiz 3')]
+        push(user, events_data)
+
+        # Quiz 2 is still extracted but left out of the calendar; Quiz 3 is gone
+        extracted = [{'uid': event_data['uid'], 'course': 'FNCE101'} for event_data in events_data[:2]]
+        changed, skipped, removed = diff_events(user, 'Outlook', events_data[:1], extracted)
+        assert changed == []
+        assert [row.title for row in removed] == ['Quiz 3']
+
+    with_outbox(test)
+
+
+def test_refreshed_tokens_are_saved_apart_from_the_send():
+    def test(user, stand_in):
+        # A token refreshed mid-send neither commits nor is lost with the send's transaction
+        enqueue_pushes(user, 'batch-1', 'Outlook', [QUIZZES])
+        save_user_token(user.id, 'microsoft_token', '{"access_token": "access-1"}')
+        db.session.rollback()
+
+        assert OutboxPush.query.count() == 0
+        assert db.session.get(User, user.id).microsoft_token == '{"access_token": "access-1"}'
+
+    with_outbox(test)
+
+
+def enqueue(user, titles, calendar='Outlook', course_calendars=False):
+    events_data = [dict(QUIZZES, uid=f"{title}@date-extractor", title=title, recurrence=None) for title in titles]
+    enqueue_pushes(user, 'batch-1', calendar, events_data, course_calendars=course_calendars)
+    db.session.commit()
+
+
+def test_claims_all_pushes_of_a_calendar_together():
+    def test(user, stand_in):
+        other = User(username='other', email='other@example.com')
+        db.session.add(other)
+        db.session.commit()
+        enqueue(user, ['Quiz 1'])
+        enqueue(other, ['Quiz 1'])
+        enqueue(user, ['Quiz 2'], calendar='Google')
+        enqueue(user, ['Quiz 3'])
+        now = datetime.utcnow()
+
+        pushes = claim_pushes(now)
+        assert [(push.user_id, push.title) for push in pushes] == [(user.id, 'Quiz 1'), (user.id, 'Quiz 3')]
+        assert all(push.status == 'sending' and push.attempts == 1 for push in pushes)
+
+        # A push enqueued meanwhile waits for the live claim on its calendar
+        enqueue(user, ['Quiz 4'])
+        now = datetime.utcnow()
+        assert [(push.user_id, push.calendar) for push in claim_pushes(now)] == [(other.id, 'Outlook')]
+        assert [push.calendar for push in claim_pushes(now)] == ['Google']
+        assert claim_pushes(now) == []
+
+        send_pushes(pushes, now)
+        assert [push.title for push in claim_pushes(now)] == ['Quiz 4']
+
+    with_outbox(test)
+
+
+def test_expired_lease_is_claimed_again():
+    def test(user, stand_in):
+        enqueue(user, ['Quiz 1'])
+        now = datetime.utcnow()
+        assert len(claim_pushes(now)) == 1
+
+        assert claim_pushes(now + timedelta(seconds=LEASE_SECONDS - 1)) == []
+        pushes = claim_pushes(now + timedelta(seconds=LEASE_SECONDS + 1))
+        assert [push.attempts for push in pushes] == [2]
+
+    with_outbox(test)
+
+
+def test_lease_expired_too_often_fails():
+    def test(user, stand_in):
+        enqueue(user, ['Quiz 1'])
+        now = datetime.utcnow()
+        for attempt in range(MAX_ATTEMPTS):
+            now += timedelta(seconds=LEASE_SECONDS + 1)
+            assert len(claim_pushes(now)) == 1
+
+        assert claim_pushes(now + timedelta(seconds=LEASE_SECONDS + 1)) == []
+        push = OutboxPush.query.one()
+        assert (push.status, push.attempts) == ('failed', MAX_ATTEMPTS)
+
+    with_outbox(test)
+
+
+def test_failed_push_backs_off_then_fails():
+    def test(user, stand_in):
+        calendar_outbox.PUSHERS['Outlook'] = stand_in.fail
+        enqueue(user, ['Quiz 1'])
+        now = datetime.utcnow()
+
+        delays = []
+        for attempt in range(MAX_ATTEMPTS):
+            assert drain_outbox(now) == 1
+            push = OutboxPush.query.one()
+            if push.status == 'failed':
+                break
+            assert push.status == 'pending'
+            delays.append((push.next_attempt_at - now).total_seconds())
+            assert drain_outbox(now) == 0
+            now = push.next_attempt_at
+
+        assert delays == [RETRY_DELAY * 2 ** attempt for attempt in range(MAX_ATTEMPTS - 1)]
+        assert (push.status, push.attempts, push.message) == ('failed', MAX_ATTEMPTS, "Outlook is busy")
+        assert len(stand_in.sent) == MAX_ATTEMPTS
+
+    with_outbox(test)
+
+
+def test_error_while_sending_reschedules_the_pushes():
+    def test(user, stand_in):
+        def create_calendar(name, user=None):
+            raise ConnectionError("Outlook went away")
+
+        calendar_outbox.CALENDAR_CREATORS['Outlook'] = create_calendar
+        enqueue(user, ['Quiz 1', 'Quiz 2'], course_calendars=True)
+        now = datetime.utcnow()
+
+        assert drain_outbox(now) == 2
+        pushes = OutboxPush.query.order_by(OutboxPush.id).all()
+        assert [(push.status, push.attempts, push.claimed_by) for push in pushes] == [('pending', 1, None)] * 2
+        assert all(push.next_attempt_at == now + timedelta(seconds=RETRY_DELAY) for push in pushes)
+        assert "Outlook went away" in pushes[0].message
+
+    with_outbox(test)
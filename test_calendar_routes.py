@@ -0,0 +1,174 @@
+"""
+Tests for the calendar download and feed routes through Flask's test client,
+against a throwaway SQLite database: ETag revalidation, gzip negotiation,
+the feed's If-Modified-Since, the streamed ZIP and stored calendar expiry.
+"""
+
+import io
+import os
+import gzip
+import zipfile
+import tempfile
+from datetime import datetime, timedelta
+
+# The app reads its configuration on import
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'routes.db')}"
+os.environ['OUTBOX_WORKERS'] = '0'
+os.environ['HEALTH_PROBE_INTERVAL'] = '0'
+
+from app import app, db, prune_stored_calendars
+from models import User, StoredCalendar, CalendarFeed
+from calendar_generator import dump_events
+
+
+def make_events(count, prefix='Quiz'):
+    return [{
+        'uid': f"{prefix.lower()}-{index}@date-extractor",
+        'title': f"{prefix} {index}",
+        'description': f"Chapters {index} and {index + 1}",
+        'start_time': datetime(2025, 3, 11, 9) + timedelta(days=7 * index),
+        'end_time': datetime(2025, 3, 11, 10) + timedelta(days=7 * index),
+    } for index in range(count)]
+
+
+def with_app(test):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        try:
+            test(app.test_client())
+        finally:
+            db.session.remove()
+
+
+def store(events_data, user=None, key='calendar-key', created_at=None):
+    stored = StoredCalendar(key=key, user_id=user.id if user else None, name='FNCE101',
+                            events=dump_events(events_data), created_at=created_at or datetime.utcnow())
+    db.session.add(stored)
+    db.session.commit()
+    return stored
+
+
+def make_user():
+    user = User(username='student', email='student@example.com')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_calendar_is_revalidated_with_its_etag():
+    def test(client):
+        store(make_events(2))
+
+        response = client.get('/calendars/calendar-key.ics')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/calendar'
+        assert b'SUMMARY:Quiz 1' in response.data
+        etag = response.headers['ETag']
+
+        response = client.get('/calendars/calendar-key.ics', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+
+        response = client.get('/calendars/calendar-key.ics', headers={'If-None-Match': '"something-else"'})
+        assert response.status_code == 200
+
+    with_app(test)
+
+
+def test_large_calendars_are_gzipped_for_clients_that_accept_it():
+    def test(client):
+        store(make_events(40))
+
+        plain = client.get('/calendars/calendar-key.ics')
+        assert 'Content-Encoding' not in plain.headers
+        assert 'Accept-Encoding' in plain.headers['Vary']
+
+        compressed = client.get('/calendars/calendar-key.ics', headers={'Accept-Encoding': 'gzip'})
+        assert compressed.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(compressed.data) == plain.data
+        # Each encoding has its own ETag
+        assert compressed.headers['ETag'] != plain.headers['ETag']
+
+        response = client.get('/calendars/calendar-key.ics',
+                              headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['ETag']})
+        assert response.status_code == 200
+
+    with_app(test)
+
+
+def test_feed_answers_if_modified_since():
+    def test(client):
+        user = make_user()
+        feed = CalendarFeed(user_id=user.id, token='feed-token', updated_at=datetime(2025, 3, 1, 12, 0, 0, 500))
+        db.session.add(feed)
+        store(make_events(2), user=user)
+
+        response = client.get('/calendar/feed-token.ics')
+        assert response.status_code == 200
+        last_modified = response.headers['Last-Modified']
+        assert last_modified == 'Sat, 01 Mar 2025 12:00:00 GMT'
+
+        response = client.get('/calendar/feed-token.ics', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+
+        feed.updated_at = datetime(2025, 3, 2, 8, 0)
+        db.session.commit()
+        response = client.get('/calendar/feed-token.ics', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 200
+        assert response.headers['Last-Modified'] == 'Sun, 02 Mar 2025 08:00:00 GMT'
+
+    with_app(test)
+
+
+def test_bundle_is_streamed_as_a_zip():
+    def test(client):
+        events_data = make_events(3)
+        store(events_data)
+
+        response = client.get('/calendars/calendar-key.zip')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/zip'
+        assert response.is_streamed
+        assert response.headers['Content-Disposition'] == 'attachment; filename="FNCE101.zip"'
+
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            names = archive.namelist()
+            assert names[0] == 'FNCE101.ics'
+            assert len(names) == 1 + len(events_data)
+            assert archive.read('FNCE101.ics') == client.get('/calendars/calendar-key.ics').data
+
+    with_app(test)
+
+
+def test_anonymous_calendars_expire():
+    def test(client):
+        days = app.config['STORED_CALENDAR_DAYS']
+        store(make_events(1), key='old', created_at=datetime.utcnow() - timedelta(days=days + 1))
+        store(make_events(1), key='recent', created_at=datetime.utcnow() - timedelta(days=days - 1))
+
+        assert client.get('/calendars/old.ics').status_code == 404
+        assert client.get('/calendars/old.zip').status_code == 404
+        assert client.get('/calendars/recent.ics').status_code == 200
+
+        prune_stored_calendars()
+        db.session.commit()
+        assert [stored.key for stored in StoredCalendar.query] == ['recent']
+
+    with_app(test)
+
+
+def test_superseded_calendars_of_a_user_are_pruned():
+    def test(client):
+        user = make_user()
+        store(make_events(2), user=user, key='first')
+        store(make_events(2, prefix='Lab'), user=user, key='labs')
+        store(make_events(3), user=user, key='re-upload')
+
+        prune_stored_calendars(user)
+        db.session.commit()
+        # The re-upload holds every event of the first upload; the labs are still needed
+        assert sorted(stored.key for stored in StoredCalendar.query) == ['labs', 're-upload']
+
+    with_app(test)
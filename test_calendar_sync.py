@@ -0,0 +1,138 @@
+"""
+Tests for pulling calendar changes against a local stand-in server.
+
+The stand-in serves a Google events listing in pages of two, ending with a
+nextSyncToken (and answers an expired token with 410), and a Graph calendar
+view delta in pages linked by @odata.nextLink, ending with a deltaLink.
+"""
+
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from calendar_generator import event_content_hash
+from calendar_sync import (pull_google_changes, pull_graph_changes, parse_remote_time, SyncCursorExpired)
+
+GOOGLE_EVENTS = [
+    {'id': 'g1', 'etag': '"1"', 'status': 'confirmed', 'summary': 'Quiz 1', 'description': 'Chapters 1-3',
+     'start': {'dateTime': '2025-03-11T05:00:00-04:00'}, 'end': {'dateTime': '2025-03-11T06:00:00-04:00'}},
+    {'id': 'g2', 'etag': '"2"', 'status': 'confirmed', 'summary': 'Midterm',
+     'start': {'dateTime': '2025-04-01T13:00:00Z'}, 'end': {'dateTime': '2025-04-01T15:00:00Z'}},
+    {'id': 'g3', 'etag': '"3"', 'status': 'confirmed', 'summary': 'Holiday',
+     'start': {'date': '2025-04-18'}, 'end': {'date': '2025-04-19'}},
+]
+
+
+class StandInProvider(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        StandInProvider.requests_seen.append((url.path, query))
+        assert self.headers['Authorization'] == 'Bearer test-token'
+
+        if url.path == '/calendar/v3/calendars/primary/events':
+            if query.get('syncToken') == 'expired':
+                return self.reply(410, {'error': {'code': 410, 'message': 'Sync token is no longer valid'}})
+            if query.get('syncToken') == 'token-1':
+                return self.reply(200, {'items': [{'id': 'g2', 'etag': '"4"', 'status': 'cancelled'}],
+                                        'nextSyncToken': 'token-2'})
+            start = int(query.get('pageToken', 0))
+            page = {'items': GOOGLE_EVENTS[start:start + 2]}
+            if start + 2 < len(GOOGLE_EVENTS):
+                page['nextPageToken'] = str(start + 2)
+            else:
+                page['nextSyncToken'] = 'token-1'
+            return self.reply(200, page)
+
+        assert 'outlook.timezone="UTC"' in self.headers['Prefer']
+        base = f"http://{self.headers['Host']}/v1.0/me/calendarView/delta"
+        if 'skiptoken' in query:
+            return self.reply(200, {'value': [{'id': 'o2', '@removed': {'reason': 'deleted'}}],
+                                    '@odata.deltaLink': f"{base}?deltatoken=delta-1"})
+        assert 'startDateTime' in query and 'endDateTime' in query
+        return self.reply(200, {'value': [{
+            'id': 'o1', '@odata.etag': 'W/"1"', 'subject': 'Quiz 1', 'body': {'content': 'Chapters 1-3'},
+            'start': {'dateTime': '2025-03-11T09:00:00.0000000', 'timeZone': 'UTC'},
+            'end': {'dateTime': '2025-03-11T10:00:00.0000000', 'timeZone': 'UTC'},
+        }], '@odata.nextLink': f"{base}?skiptoken=page-2"})
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_with_stand_in(test):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInProvider)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StandInProvider.requests_seen = []
+    try:
+        test(f"http://127.0.0.1:{server.server_address[1]}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def sent_event(title, description, start, end):
+    # Event data as generate sends it
+    return {'title': title, 'description': description, 'start_time': start, 'end_time': end}
+
+
+def test_google_full_listing_then_changes():
+    def test(base_url):
+        events_url = f"{base_url}/calendar/v3/calendars/primary/events"
+        changes, sync_token = pull_google_changes('test-token', events_url=events_url)
+
+        assert sync_token == 'token-1'
+        assert [change['remote_id'] for change in changes] == ['g1', 'g2', 'g3']
+        assert changes[0]['content_hash'] == event_content_hash(sent_event(
+            'Quiz 1', 'Chapters 1-3', datetime(2025, 3, 11, 9), datetime(2025, 3, 11, 10)))
+
+        changes, sync_token = pull_google_changes('test-token', sync_token, events_url=events_url)
+        assert sync_token == 'token-2'
+        assert changes == [{'remote_id': 'g2', 'etag': '"4"', 'removed': True, 'content_hash': None}]
+
+    run_with_stand_in(test)
+
+
+def test_google_expired_token():
+    def test(base_url):
+        try:
+            pull_google_changes('test-token', 'expired', events_url=f"{base_url}/calendar/v3/calendars/primary/events")
+        except SyncCursorExpired:
+            return
+        assert False, "expected the sync token to be rejected"
+
+    run_with_stand_in(test)
+
+
+def test_graph_delta_follows_pages():
+    def test(base_url):
+        changes, delta_link = pull_graph_changes('test-token', delta_url=f"{base_url}/v1.0/me/calendarView/delta",
+                                                 now=datetime(2025, 1, 15))
+
+        assert delta_link.endswith('?deltatoken=delta-1')
+        assert StandInProvider.requests_seen[0][1]['startDateTime'] == '2024-01-16T00:00:00Z'
+        assert [(change['remote_id'], change['removed']) for change in changes] == [('o1', False), ('o2', True)]
+        assert changes[0]['content_hash'] == event_content_hash(sent_event(
+            'Quiz 1', 'Chapters 1-3', datetime(2025, 3, 11, 9), datetime(2025, 3, 11, 10)))
+
+    run_with_stand_in(test)
+
+
+def test_remote_times_are_naive_utc():
+    assert parse_remote_time({'dateTime': '2025-03-11T05:00:00-04:00'}) == datetime(2025, 3, 11, 9)
+    assert parse_remote_time({'dateTime': '2025-03-11T09:00:00.0000000', 'timeZone': 'UTC'}) == datetime(2025, 3, 11, 9)
+    assert parse_remote_time({'dateTime': '2025-03-11T09:00:00.123Z'}) == datetime(2025, 3, 11, 9)
+    assert parse_remote_time({'date': '2025-04-18'}) is None
@@ -0,0 +1,78 @@
+"""
+Tests for the provider circuit breakers.
+
+Time is a fake clock, so the breakers can be walked through closed, open and
+half-open without waiting.
+"""
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, get_breaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def assert_open(breaker):
+    try:
+        breaker.allow()
+    except CircuitOpenError as e:
+        assert breaker.name in str(e)
+        return
+    assert False, "expected the breaker to be open"
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker('Google Calendar', failure_threshold=3, reset_timeout=30, clock=FakeClock())
+
+    for _ in range(2):
+        breaker.allow()
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == 'closed'
+
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert_open(breaker)
+
+
+def test_half_open_probe_closes_on_success():
+    clock = FakeClock()
+    breaker = CircuitBreaker('Microsoft Graph', failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+
+    clock.now = 30
+    assert breaker.state == 'half-open'
+    breaker.allow()
+    # Only the probe goes through while it is in flight
+    assert_open(breaker)
+
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    breaker.allow()
+
+
+def test_half_open_probe_reopens_on_failure():
+    clock = FakeClock()
+    breaker = CircuitBreaker('Microsoft sign-in', failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+
+    clock.now = 30
+    breaker.allow()
+    breaker.record_failure()
+
+    clock.now = 59
+    assert_open(breaker)
+    clock.now = 60
+    breaker.allow()
+
+
+def test_breakers_are_shared_per_endpoint_family():
+    assert get_breaker('https://oauth2.googleapis.com/token') is get_breaker('https://accounts.google.com/o/oauth2/v2/auth')
+    assert get_breaker('https://graph.microsoft.com/v1.0/$batch').name == 'Microsoft Graph'
+    assert get_breaker('https://www.googleapis.com/calendar/v3/calendars/primary/events').name == 'Google Calendar'
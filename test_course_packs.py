@@ -0,0 +1,61 @@
+"""
+Tests for splitting course packs into per-course outlines.
+
+Packs are built from short stand-in outlines whose course code repeats in
+page footers, as in the real outlines; a single mention of another course is
+a cross-reference and must not open a new outline.
+"""
+
+from syllabus_extractor import (split_course_pack, assign_tables_to_segments, extract_course_pack_assessments,
+                                extract_segments, MIN_POOL_SEGMENTS)
+
+
+def outline(code, body):
+    footer = f"\n{code} Course Outline Winter 2025\n"
+    return f"{code} Course Outline{footer}{body}{footer}{footer}\n\n"
+
+
+PACK = (outline("FNCE 674", "Case write-ups and quizzes. See also OBHR 674 for the group project.") +
+        outline("OBHR 674", "Individual assignments and group exercises.") +
+        outline("SGMA 672", "Three exams and a personal strategy paper."))
+
+
+def test_pack_splits_per_course():
+    segments = split_course_pack(PACK)
+
+    assert [code for code, _ in segments] == ["FNCE 674", "OBHR 674", "SGMA 672"]
+    assert "".join(text for _, text in segments) == PACK
+    assert "See also OBHR 674" in segments[0][1]
+    assert segments[1][1].lstrip().startswith("OBHR 674 Course Outline")
+
+
+def test_single_outline_is_one_segment():
+    text = outline("FNCE 674", "Quizzes.")
+    assert split_course_pack(text) == [("FNCE 674", text)]
+    assert split_course_pack("No course here") == [(None, "No course here")]
+
+
+def test_pdf_split_course_codes():
+    text = PACK.replace("OBHR 674", "OBHR 67 4")
+    assert [code for code, _ in split_course_pack(text)] == ["FNCE 674", "OBHR 674", "SGMA 672"]
+
+
+def test_tables_go_to_the_segment_with_their_words():
+    segments = split_course_pack(PACK)
+    exams = {'rows': [{'text': "Three exams, strategy paper"}]}
+    assignments = {'rows': [{'text': "Individual assignments, group exercises"}]}
+
+    assert assign_tables_to_segments(segments, [exams, assignments]) == [[], [assignments], [exams]]
+
+
+def test_pack_events_are_tagged_with_their_course():
+    events = extract_course_pack_assessments(split_course_pack(PACK))
+
+    assert {event["course"] for event in events} == {"FNCE 674", "OBHR 674", "SGMA 672"}
+    assert [event["date"] for event in events] == sorted(event["date"] for event in events)
+
+
+def test_pool_and_inline_extraction_agree():
+    jobs = [(outline(code, "Exams."), [], code) for code in ("FNCE 674", "OBHR 674", "SGMA 672")]
+    assert len(jobs) >= MIN_POOL_SEGMENTS
+    assert extract_segments(jobs) == [extract_segments([job])[0] for job in jobs]
@@ -0,0 +1,82 @@
+"""
+Tests for the extraction stage memo: LRU eviction, stage versions and the
+directory backend.
+"""
+
+import tempfile
+
+from extraction_cache import StageMemo, DirectoryMemoBackend, hash_inputs
+from syllabus_extractor import EXTRACTOR_VERSION
+
+
+class CountingStage:
+    """Stage that records the inputs it was asked to compute."""
+
+    def __init__(self):
+        self.computed = []
+
+    def compute(self, text):
+        def run():
+            self.computed.append(text)
+            return [{'title': f"Quiz on {text}"}]
+        return run
+
+
+def test_least_recently_used_entry_is_evicted():
+    memo, stage = StageMemo(max_entries=2), CountingStage()
+
+    def lookup(text):
+        return memo.get_or_compute('syllabus_assessments', EXTRACTOR_VERSION, hash_inputs(text), stage.compute(text))
+
+    lookup('a')
+    lookup('b')
+    lookup('a')  # b is now the least recently used
+    lookup('c')
+    assert stage.computed == ['a', 'b', 'c']
+
+    lookup('a')
+    lookup('c')
+    assert stage.computed == ['a', 'b', 'c']
+    lookup('b')
+    assert stage.computed == ['a', 'b', 'c', 'b']
+
+
+def test_version_bump_invalidates_only_its_stage():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        memo, stage = StageMemo(backend=DirectoryMemoBackend(cache_dir)), CountingStage()
+        text_hash = hash_inputs('outline')
+
+        memo.get_or_compute('syllabus_assessments', EXTRACTOR_VERSION, text_hash, stage.compute('assessments'))
+        memo.get_or_compute('structured_events', 1, text_hash, stage.compute('events'))
+        memo.get_or_compute('syllabus_assessments', EXTRACTOR_VERSION + 1, text_hash, stage.compute('assessments'))
+        assert stage.computed == ['assessments', 'events', 'assessments']
+
+        # A fresh process finds both versions on disk
+        memo = StageMemo(backend=DirectoryMemoBackend(cache_dir))
+        memo.get_or_compute('syllabus_assessments', EXTRACTOR_VERSION, text_hash, stage.compute('assessments'))
+        memo.get_or_compute('structured_events', 1, text_hash, stage.compute('events'))
+        assert len(stage.computed) == 3
+
+
+def test_results_are_copies():
+    memo, stage = StageMemo(), CountingStage()
+    result = memo.get_or_compute('syllabus_assessments', EXTRACTOR_VERSION, hash_inputs('a'), stage.compute('a'))
+    result[0]['title'] = 'changed'
+
+    again = memo.get_or_compute('syllabus_assessments', EXTRACTOR_VERSION, hash_inputs('a'), stage.compute('a'))
+    assert again == [{'title': 'Quiz on a'}]
+
+
+def test_misses_are_computed_together():
+    memo, calls = StageMemo(), []
+
+    def compute_many(missing):
+        calls.append(missing)
+        return [f"result {index}" for index in missing]
+
+    hashes = [hash_inputs(text) for text in ('a', 'b', 'c')]
+    memo.get_or_compute_many('syllabus_assessments', EXTRACTOR_VERSION, hashes[1:2], compute_many)
+    results = memo.get_or_compute_many('syllabus_assessments', EXTRACTOR_VERSION, hashes, compute_many)
+
+    assert calls == [[0], [0, 2]]
+    assert results == ['result 0', 'result 0', 'result 2']
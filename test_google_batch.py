@@ -0,0 +1,231 @@
+"""
+Tests for Google Calendar batch inserts against a local stand-in server.
+
+The stand-in parses each multipart batch request with the standard library's
+MIME parser, answers every part (in reverse order, as Google does not
+guarantee order), fails the parts whose summary contains "FAIL" and answers
+the parts whose summary contains "SLOW" with a rate-limit 403 (with a
+Retry-After of 3 seconds) the first time.
+Patches with a stale If-Match fail with 412 and deletes of unknown events
+with 404.
+It can hold each response for a while, to show how many batches are in flight.
+"""
+
+import json
+import threading
+import time
+from email import message_from_bytes
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from calendar_batch import (google_batch_send, build_change_requests, change_result,
+                            GOOGLE_EVENTS_PATH, GOOGLE_EVENT_PATH)
+from rate_limiter import RateLimiter
+
+
+class StandInGoogle(BaseHTTPRequestHandler):
+    batches = []
+    throttled = set()
+    delay = 0
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        with StandInGoogle.lock:
+            StandInGoogle.in_flight += 1
+            StandInGoogle.max_in_flight = max(StandInGoogle.max_in_flight, StandInGoogle.in_flight)
+        time.sleep(StandInGoogle.delay)
+        with StandInGoogle.lock:
+            StandInGoogle.in_flight -= 1
+
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        message = message_from_bytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        assert self.headers['Authorization'] == 'Bearer test-token'
+        assert message.is_multipart()
+
+        parts = []
+        for part in message.get_payload():
+            assert part.get_content_type() == 'application/http'
+            head, _, payload = part.get_payload().partition('\r\n\r\n')
+            request_line, *header_lines = head.split('\r\n')
+            method, path = request_line.split(' ')
+            headers = dict(line.split(': ', 1) for line in header_lines)
+            event = json.loads(payload) if payload.strip() else None
+            parts.append((part['Content-ID'].strip('<>'), method, path, headers, event))
+        StandInGoogle.batches.append(len(parts))
+
+        boundary = 'batch_response_boundary'
+        response = []
+        for content_id, method, path, headers, event in reversed(parts):
+            part_headers = ''
+            event_id = path.rpartition('/')[2]
+            if method == 'DELETE':
+                status, payload = ('204 No Content', None) if event_id.startswith('event-') else \
+                    ('404 Not Found', {'error': {'code': 404, 'message': 'Not Found'}})
+            elif method == 'PATCH':
+                assert path == GOOGLE_EVENT_PATH.format(event_id=event_id)
+                if headers.get('If-Match') != '"etag-1"':
+                    status, payload = '412 Precondition Failed', {'error': {'code': 412, 'message': 'Precondition Failed'}}
+                else:
+                    status, payload = '200 OK', dict(event, id=event_id, etag='"etag-2"')
+            elif 'FAIL' in event['summary']:
+                status, payload = '400 Bad Request', {'error': {'code': 400, 'message': 'Invalid summary'}}
+            elif 'SLOW' in event['summary'] and event['summary'] not in StandInGoogle.throttled:
+                StandInGoogle.throttled.add(event['summary'])
+                part_headers = 'Retry-After: 3\r\n'
+                status, payload = '403 Forbidden', {'error': {'code': 403, 'message': 'Rate Limit Exceeded',
+                                                              'errors': [{'reason': 'userRateLimitExceeded'}]}}
+            else:
+                assert method == 'POST' and path == GOOGLE_EVENTS_PATH
+                status, payload = '200 OK', dict(event, id=f"event-{content_id}", etag='"etag-1"')
+            response.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n"
+                f"\r\n"
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n"
+                f"{part_headers}"
+                f"\r\n"
+                f"{json.dumps(payload) if payload is not None else ''}\r\n"
+            )
+        response.append(f"--{boundary}--\r\n")
+        data = ''.join(response).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', f"multipart/mixed; boundary={boundary}")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_with_stand_in(test):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInGoogle)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StandInGoogle.batches = []
+    StandInGoogle.throttled = set()
+    StandInGoogle.delay = 0
+    StandInGoogle.max_in_flight = 0
+    try:
+        test(f"http://127.0.0.1:{server.server_address[1]}/batch/calendar/v3")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def unlimited(waits=None):
+    # Waits are recorded instead of slept, on a frozen clock
+    return RateLimiter(10 ** 6, 10 ** 6, 10 ** 6, 10 ** 6, clock=lambda: 0.0,
+                       sleep=waits.append if waits is not None else lambda seconds: None)
+
+
+def make_events(count, failing=(), slow=()):
+    return [{
+        'summary': f"Event {index}" + (' FAIL' if index in failing else '') + (' SLOW' if index in slow else ''),
+        'start': {'dateTime': '2025-03-11T09:00:00', 'timeZone': 'UTC'},
+        'end': {'dateTime': '2025-03-11T10:00:00', 'timeZone': 'UTC'},
+    } for index in range(count)]
+
+
+def inserts(event_bodies):
+    return [{'method': 'POST', 'path': GOOGLE_EVENTS_PATH, 'body': event_body} for event_body in event_bodies]
+
+
+def test_batches_of_fifty():
+    def test(batch_url):
+        results = google_batch_send('test-token', inserts(make_events(120)), batch_url=batch_url, limiter=unlimited())
+
+        assert sorted(StandInGoogle.batches) == [20, 50, 50]
+        assert len(results) == 120
+        for index, (status_code, body) in enumerate(results):
+            assert status_code == 200
+            assert body['summary'] == f"Event {index}"
+            assert body['id'] == f"event-item-{index}"
+
+    run_with_stand_in(test)
+
+
+def test_part_failures_map_to_their_events():
+    def test(batch_url):
+        results = google_batch_send('test-token', inserts(make_events(60, failing={3, 55})), batch_url=batch_url,
+                                    limiter=unlimited())
+
+        failed = [index for index, (status_code, _) in enumerate(results) if status_code != 200]
+        assert failed == [3, 55]
+        assert results[3][1]['error']['message'] == 'Invalid summary'
+
+    run_with_stand_in(test)
+
+
+def test_rate_limited_parts_are_retried():
+    def test(batch_url):
+        waits = []
+        limiter = unlimited(waits)
+        results = google_batch_send('test-token', inserts(make_events(60, slow={10})), batch_url=batch_url,
+                                    user_key=1, limiter=limiter)
+
+        assert sorted(StandInGoogle.batches) == [1, 10, 50]
+        # The part's own Retry-After
+        assert waits == [3]
+        # userRateLimitExceeded holds back that user alone
+        assert limiter.provider.rate == 10 ** 6
+        assert all(status_code == 200 for status_code, _ in results)
+        assert results[10][1]['id'] == 'event-item-10'
+
+    run_with_stand_in(test)
+
+
+def test_batches_are_sent_concurrently():
+    def test(batch_url):
+        StandInGoogle.delay = 0.3
+        started = time.monotonic()
+        results = google_batch_send('test-token', inserts(make_events(300)), batch_url=batch_url, concurrency=3,
+                                    limiter=unlimited())
+        elapsed = time.monotonic() - started
+
+        assert len(StandInGoogle.batches) == 6
+        assert StandInGoogle.max_in_flight == 3
+        # Six batches three at a time take two round trips, not six
+        assert elapsed < 1.5
+        assert [body['id'] for _, body in results] == [f"event-item-{index}" for index in range(300)]
+
+    run_with_stand_in(test)
+
+
+def test_no_events():
+    def test(batch_url):
+        assert google_batch_send('test-token', [], batch_url=batch_url, limiter=unlimited()) == []
+        assert StandInGoogle.batches == []
+
+    run_with_stand_in(test)
+
+
+def test_changes_insert_patch_and_delete():
+    def test(batch_url):
+        event = {'title': 'Quiz 1'}
+        changes = [
+            {'event': event, 'remote_id': None, 'etag': None},
+            {'event': event, 'remote_id': 'event-7', 'etag': '"etag-1"'},
+            {'event': event, 'remote_id': 'event-8', 'etag': '"edited"'},
+            {'event': None, 'remote_id': 'event-9', 'etag': '"etag-1"'},
+            {'event': None, 'remote_id': 'deleted-by-user', 'etag': '"etag-1"'},
+        ]
+        requests = build_change_requests(changes, GOOGLE_EVENTS_PATH, GOOGLE_EVENT_PATH,
+                                         lambda event_data: {'summary': event_data['title']})
+        responses = google_batch_send('test-token', requests, batch_url=batch_url, limiter=unlimited())
+        results = [change_result(change, status_code, body, 'Google', 'etag')
+                   for change, (status_code, body) in zip(changes, responses)]
+
+        assert [result['success'] for result in results] == [True, True, False, True, True]
+        assert (results[0]['remote_id'], results[0]['etag']) == ('event-item-0', '"etag-1"')
+        assert (results[1]['remote_id'], results[1]['etag']) == ('event-7', '"etag-2"')
+        # An event edited in the calendar is not overwritten, nor retried
+        assert not results[2]['retry'] and results[2]['etag'] == '"edited"'
+        assert results[4]['remote_id'] is None
+
+    run_with_stand_in(test)
@@ -0,0 +1,171 @@
+"""
+Tests for Microsoft Graph $batch inserts against a local stand-in server.
+
+The stand-in answers every request of a JSON $batch (in reverse order), fails
+the events whose subject contains "FAIL" and throttles the events whose
+subject contains "SLOW" on their first attempt. Patches with a stale If-Match
+fail with 412. Retry-After waits go through
+a rate limiter on a frozen clock, so they are recorded rather than slept.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from calendar_batch import (graph_batch_send, build_change_requests, change_result,
+                            GRAPH_EVENTS_PATH, GRAPH_EVENT_PATH, GRAPH_CALENDAR_EVENTS_PATH)
+from rate_limiter import RateLimiter
+
+
+class StandInGraph(BaseHTTPRequestHandler):
+    batches = []
+    throttled = set()
+
+    def do_POST(self):
+        assert self.headers['Authorization'] == 'Bearer test-token'
+        batch = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        StandInGraph.batches.append(len(batch['requests']))
+
+        responses = []
+        for item in reversed(batch['requests']):
+            if item['method'] == 'DELETE':
+                assert 'body' not in item
+                responses.append({'id': item['id'], 'status': 204})
+                continue
+            if item['method'] == 'PATCH':
+                assert item['url'] == GRAPH_EVENT_PATH.format(event_id='AAMk-7')
+                stale = item['headers'].get('If-Match') != 'W/"etag-1"'
+                responses.append({'id': item['id'], 'status': 412} if stale else
+                                 {'id': item['id'], 'status': 200,
+                                  'body': dict(item['body'], id='AAMk-7', **{'@odata.etag': 'W/"etag-2"'})})
+                continue
+            assert item['method'] == 'POST' and item['url'] == GRAPH_EVENTS_PATH
+            subject = item['body']['subject']
+            if 'FAIL' in subject:
+                responses.append({'id': item['id'], 'status': 400,
+                                  'body': {'error': {'code': 'ErrorInvalidRequest', 'message': 'Invalid subject'}}})
+            elif 'SLOW' in subject and subject not in StandInGraph.throttled:
+                StandInGraph.throttled.add(subject)
+                responses.append({'id': item['id'], 'status': 429, 'headers': {'Retry-After': '2'},
+                                  'body': {'error': {'code': 'TooManyRequests'}}})
+            else:
+                responses.append({'id': item['id'], 'status': 201,
+                                  'body': dict(item['body'], id=f"event-{item['id']}")})
+        data = json.dumps({'responses': responses}).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_with_stand_in(test):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInGraph)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StandInGraph.batches = []
+    StandInGraph.throttled = set()
+    try:
+        test(f"http://127.0.0.1:{server.server_address[1]}/v1.0/$batch")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def make_events(count, failing=(), slow=()):
+    return [{
+        'subject': f"Event {index}" + (' FAIL' if index in failing else '') + (' SLOW' if index in slow else ''),
+        'start': {'dateTime': '2025-03-11T09:00:00', 'timeZone': 'UTC'},
+        'end': {'dateTime': '2025-03-11T10:00:00', 'timeZone': 'UTC'},
+    } for index in range(count)]
+
+
+def inserts(event_bodies):
+    return [{'method': 'POST', 'path': GRAPH_EVENTS_PATH, 'body': event_body} for event_body in event_bodies]
+
+
+def make_limiter(waits=None):
+    # Generous quota on a frozen clock; waits are recorded instead of slept
+    return RateLimiter(1000, 1000, 1000, 1000, clock=lambda: 0.0,
+                       sleep=waits.append if waits is not None else lambda seconds: None)
+
+
+def test_batches_of_twenty():
+    def test(batch_url):
+        results = graph_batch_send('test-token', inserts(make_events(45, failing={7})), batch_url=batch_url,
+                                   limiter=make_limiter())
+
+        assert sorted(StandInGraph.batches) == [5, 20, 20]
+        assert [index for index, (status_code, _) in enumerate(results) if status_code != 201] == [7]
+        assert results[7][1]['error']['message'] == 'Invalid subject'
+        assert results[44][1]['id'] == 'event-44'
+
+    run_with_stand_in(test)
+
+
+def test_throttled_events_are_retried_after_retry_after():
+    def test(batch_url):
+        waits = []
+        results = graph_batch_send('test-token', inserts(make_events(25, slow={3, 21})), batch_url=batch_url,
+                                   limiter=make_limiter(waits))
+
+        assert sorted(StandInGraph.batches[:2]) == [5, 20]
+        assert StandInGraph.batches[2:] == [2]
+        assert waits == [2]
+        assert all(status_code == 201 for status_code, _ in results)
+        assert results[21][1]['id'] == 'event-21'
+
+    run_with_stand_in(test)
+
+
+def test_throttling_gives_up_after_max_attempts():
+    def test(batch_url):
+        results = graph_batch_send('test-token', inserts(make_events(3, slow={1})), batch_url=batch_url,
+                                   max_attempts=1, limiter=make_limiter())
+
+        assert [status_code for status_code, _ in results] == [201, 429, 201]
+
+    run_with_stand_in(test)
+
+
+def test_changes_insert_patch_and_delete():
+    def test(batch_url):
+        event = {'title': 'Quiz 1'}
+        changes = [
+            {'event': event, 'remote_id': None, 'etag': None},
+            {'event': event, 'remote_id': 'AAMk-7', 'etag': 'W/"etag-1"'},
+            {'event': event, 'remote_id': 'AAMk-7', 'etag': 'W/"edited"'},
+            {'event': None, 'remote_id': 'AAMk-9', 'etag': 'W/"etag-1"'},
+        ]
+        requests = build_change_requests(changes, GRAPH_EVENTS_PATH, GRAPH_EVENT_PATH,
+                                         lambda event_data: {'subject': event_data['title']})
+        responses = graph_batch_send('test-token', requests, batch_url=batch_url, limiter=make_limiter())
+        results = [change_result(change, status_code, body, 'Outlook', '@odata.etag')
+                   for change, (status_code, body) in zip(changes, responses)]
+
+        assert [result['success'] for result in results] == [True, True, False, True]
+        assert results[0]['remote_id'] == 'event-0'
+        assert (results[1]['remote_id'], results[1]['etag']) == ('AAMk-7', 'W/"etag-2"')
+        assert results[2]['message'] == "Event was changed in your Outlook Calendar, not overwritten"
+        assert results[3]['remote_id'] is None
+
+    run_with_stand_in(test)
+
+
+def test_changes_in_a_course_calendar():
+    event = {'title': 'Quiz 1'}
+    changes = [
+        {'event': event, 'remote_id': None, 'etag': None, 'calendar_id': 'AAMk/cal='},
+        {'event': None, 'remote_id': 'AAMk-9', 'etag': None, 'calendar_id': 'AAMk/cal='},
+    ]
+    requests = build_change_requests(changes, GRAPH_EVENTS_PATH, GRAPH_EVENT_PATH,
+                                     lambda event_data: {'subject': event_data['title']},
+                                     calendar_events_path=GRAPH_CALENDAR_EVENTS_PATH)
+
+    assert requests[0]['path'] == '/me/calendars/AAMk%2Fcal%3D/events'
+    # Graph addresses an event by its id alone, whichever calendar holds it
+    assert requests[1]['path'] == GRAPH_EVENT_PATH.format(event_id='AAMk-9')
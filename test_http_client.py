@@ -0,0 +1,115 @@
+"""
+Tests for the shared HTTP client against a local stand-in server.
+
+The stand-in answers 503 to the first request of every path ending in
+"/flaky" and records the client port of each request, which shows whether
+a keep-alive connection was reused.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import http_client
+from circuit_breaker import CircuitOpenError, FAILURE_THRESHOLD
+
+
+class StandInProvider(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests_seen = []
+
+    def handle_request(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        StandInProvider.requests_seen.append((self.command, self.path, self.client_address[1]))
+
+        first = sum(1 for _, path, _ in StandInProvider.requests_seen if path == self.path) == 1
+        status = 503 if self.path.endswith('/flaky') and first else 200
+        data = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = handle_request
+    do_POST = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_with_stand_in(test):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInProvider)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StandInProvider.requests_seen = []
+    try:
+        test(f"http://127.0.0.1:{server.server_address[1]}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_connections_are_reused():
+    def test(base_url):
+        for _ in range(3):
+            assert http_client.get(f"{base_url}/discovery").status_code == 200
+
+        ports = {port for _, _, port in StandInProvider.requests_seen}
+        assert len(ports) == 1
+
+    run_with_stand_in(test)
+
+
+def test_idempotent_requests_are_retried():
+    def test(base_url):
+        response = http_client.get(f"{base_url}/get/flaky")
+
+        assert response.status_code == 200
+        assert [path for _, path, _ in StandInProvider.requests_seen] == ['/get/flaky', '/get/flaky']
+
+    run_with_stand_in(test)
+
+
+def test_posts_are_not_retried_after_a_response():
+    def test(base_url):
+        response = http_client.post(f"{base_url}/post/flaky", data={'code': 'abc'})
+
+        assert response.status_code == 503
+        assert len(StandInProvider.requests_seen) == 1
+
+    run_with_stand_in(test)
+
+
+def test_connection_errors_are_raised_after_retries():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInProvider)
+    port = server.server_address[1]
+    server.server_close()
+
+    try:
+        http_client.get(f"http://127.0.0.1:{port}/closed", retries=1)
+    except http_client.requests.ConnectionError:
+        pass
+    else:
+        assert False, "expected a connection error"
+
+
+def test_failing_endpoints_fail_fast():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInProvider)
+    port = server.server_address[1]
+    server.server_close()
+
+    errors = []
+    for _ in range(FAILURE_THRESHOLD + 2):
+        try:
+            http_client.head(f"http://127.0.0.1:{port}/probe", retries=0)
+        except Exception as e:
+            errors.append(e.__class__)
+
+    assert errors[:FAILURE_THRESHOLD] == [http_client.requests.ConnectionError] * FAILURE_THRESHOLD
+    assert errors[FAILURE_THRESHOLD:] == [CircuitOpenError] * 2
+
+
+def test_backoff_is_bounded():
+    for attempt in range(10):
+        assert 0 <= http_client.backoff_delay(attempt) <= http_client.BACKOFF_MAX
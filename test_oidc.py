@@ -0,0 +1,133 @@
+"""
+Tests for local id_token validation.
+
+Tokens are signed with an RSA key generated for the test run (in pure
+Python, like the verifier), so signature, issuer, audience and expiry
+checks can be exercised without a provider.
+"""
+
+import json
+import base64
+import hashlib
+import random
+import time
+
+from oidc import decode_id_token, IdTokenError, UnknownKeyError, SHA256_DIGEST_INFO
+
+ISSUER = "https://login.microsoftonline.com/{tenantid}/v2.0"
+TENANT = "9188040d-6c67-4c5b-b112-36a304b66dad"
+CLIENT_ID = "client-123"
+
+
+def is_probable_prime(n, rounds=20):
+    if n < 2:
+        return False
+    for p in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29):
+        if n % p == 0:
+            return n == p
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+    for _ in range(rounds):
+        x = pow(random.randrange(2, n - 1), d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def generate_prime(bits):
+    while True:
+        candidate = random.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if is_probable_prime(candidate):
+            return candidate
+
+
+def generate_key(bits=1024, exponent=65537):
+    while True:
+        p, q = generate_prime(bits // 2), generate_prime(bits // 2)
+        phi = (p - 1) * (q - 1)
+        if p != q and phi % exponent:
+            return p * q, exponent, pow(exponent, -1, phi)
+
+
+KEY = generate_key()
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def int_b64url(value):
+    return b64url(value.to_bytes((value.bit_length() + 7) // 8, 'big'))
+
+
+def jwks(kid='key-1'):
+    modulus, exponent, _ = KEY
+    return {'keys': [{'kty': 'RSA', 'kid': kid, 'n': int_b64url(modulus), 'e': int_b64url(exponent)}]}
+
+
+def sign(claims, kid='key-1', alg='RS256'):
+    modulus, _, private_exponent = KEY
+    length = (modulus.bit_length() + 7) // 8
+    signing_input = f"{b64url(json.dumps({'alg': alg, 'kid': kid}).encode())}.{b64url(json.dumps(claims).encode())}"
+    digest_info = SHA256_DIGEST_INFO + hashlib.sha256(signing_input.encode()).digest()
+    encoded = b'\x00\x01' + b'\xff' * (length - len(digest_info) - 3) + b'\x00' + digest_info
+    signature = pow(int.from_bytes(encoded, 'big'), private_exponent, modulus).to_bytes(length, 'big')
+    return f"{signing_input}.{b64url(signature)}"
+
+
+def make_claims(**overrides):
+    now = time.time()
+    claims = {
+        'iss': ISSUER.replace('{tenantid}', TENANT),
+        'tid': TENANT,
+        'aud': CLIENT_ID,
+        'iat': int(now),
+        'nbf': int(now),
+        'exp': int(now) + 3600,
+        'email': 'student@example.com',
+        'name': 'A Student',
+    }
+    claims.update(overrides)
+    return claims
+
+
+def assert_rejected(id_token, error=IdTokenError, keys=None):
+    try:
+        decode_id_token(id_token, keys or jwks(), CLIENT_ID, ISSUER)
+    except error:
+        return
+    assert False, "expected the id_token to be rejected"
+
+
+def test_valid_token():
+    claims = decode_id_token(sign(make_claims()), jwks(), CLIENT_ID, ISSUER)
+
+    assert claims['email'] == 'student@example.com'
+    assert claims['name'] == 'A Student'
+
+
+def test_tampered_token():
+    header, payload, signature = sign(make_claims()).split('.')
+    forged = b64url(json.dumps(make_claims(email='someone@example.com')).encode())
+
+    assert_rejected(f"{header}.{forged}.{signature}")
+    assert_rejected(f"{header}.{payload}")
+    assert_rejected(sign(make_claims(), alg='HS256'))
+
+
+def test_claims_are_checked():
+    assert_rejected(sign(make_claims(aud='another-client')))
+    assert_rejected(sign(make_claims(iss='https://login.example.com/v2.0')))
+    assert_rejected(sign(make_claims(exp=int(time.time()) - 3600)))
+    assert_rejected(sign(make_claims(nbf=int(time.time()) + 3600)))
+
+
+def test_unknown_key():
+    assert_rejected(sign(make_claims(), kid='rotated-key'), error=UnknownKeyError)
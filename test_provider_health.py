@@ -0,0 +1,89 @@
+"""
+Tests for the cached provider health probes against a local stand-in server.
+
+The stand-in answers /up with 200 and /down with 503; a closed port stands
+in for a provider that cannot be reached at all. Time is a fake clock, so
+statuses can be aged past STALE_AFTER without waiting.
+"""
+
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from provider_health import HealthProber
+
+
+class StandInProvider(BaseHTTPRequestHandler):
+    probes = 0
+
+    def do_GET(self):
+        StandInProvider.probes += 1
+        self.send_response(200 if self.path == '/up' else 503)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_with_stand_in(test):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInProvider)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StandInProvider.probes = 0
+    try:
+        test(f"http://127.0.0.1:{server.server_address[1]}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}/"
+
+
+def test_statuses_are_cached_until_refreshed():
+    def test(base_url):
+        clock = FakeClock()
+        prober = HealthProber({'Up': f"{base_url}/up", 'Down': f"{base_url}/down"}, interval=60, stale_after=180,
+                              clock=clock)
+        assert prober.status('Up') == {'connectivity': 'Unknown', 'error': None, 'checked_ago': None}
+
+        prober.refresh()
+        clock.now = 30
+        for _ in range(10):
+            assert prober.status('Up') == {'connectivity': 'Connected', 'error': None, 'checked_ago': 30}
+            assert prober.status('Down')['connectivity'] == 'Failed'
+        assert prober.status('Down')['error'] == "Received status code 503 from Down"
+        assert StandInProvider.probes == 2
+
+    run_with_stand_in(test)
+
+
+def test_unreachable_provider_fails():
+    prober = HealthProber({'Gone': closed_port_url()}, clock=FakeClock())
+    prober.refresh()
+    status = prober.status('Gone')
+    assert status['connectivity'] == 'Failed' and status['error']
+
+
+def test_stale_statuses_are_unknown():
+    def test(base_url):
+        clock = FakeClock()
+        prober = HealthProber({'Up': f"{base_url}/up"}, interval=60, stale_after=180, clock=clock)
+        prober.refresh()
+        clock.now = 181
+        assert prober.snapshot() == {'Up': {'connectivity': 'Unknown', 'error': None, 'checked_ago': 181}}
+
+    run_with_stand_in(test)
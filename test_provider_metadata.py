@@ -0,0 +1,133 @@
+"""
+Tests for the discovery document and JWKS cache against a local stand-in.
+
+The stand-in serves a discovery document pointing at its own JWKS, counts
+the requests per path and can be told to fail. Time is driven by a fake
+clock so expiry and refresh-ahead are deterministic.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from provider_metadata import CachedDocument, get_jwks, parse_max_age, MIN_TTL, DEFAULT_TTL
+
+
+class StandInProvider(BaseHTTPRequestHandler):
+    hits = {}
+    failing = False
+    version = 1
+
+    def do_GET(self):
+        StandInProvider.hits[self.path] = StandInProvider.hits.get(self.path, 0) + 1
+        if StandInProvider.failing:
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        if self.path == '/.well-known/openid-configuration':
+            document = {'issuer': base_url, 'jwks_uri': f"{base_url}/keys", 'version': StandInProvider.version}
+        else:
+            document = {'keys': [{'kid': f"key-{StandInProvider.version}"}]}
+        data = json.dumps(document).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'public, max-age=600')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_with_stand_in(test):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInProvider)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StandInProvider.hits = {}
+    StandInProvider.failing = False
+    StandInProvider.version = 1
+    try:
+        test(f"http://127.0.0.1:{server.server_address[1]}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_documents_are_cached_for_their_max_age():
+    def test(base_url):
+        clock = FakeClock()
+        document = CachedDocument(f"{base_url}/.well-known/openid-configuration", clock=clock)
+
+        assert document.get()['version'] == 1
+        clock.now += 300
+        StandInProvider.version = 2
+        assert document.get()['version'] == 1
+        assert StandInProvider.hits == {'/.well-known/openid-configuration': 1}
+
+        clock.now += 301
+        assert document.get()['version'] == 2
+
+    run_with_stand_in(test)
+
+
+def test_refresh_ahead_runs_in_background():
+    def test(base_url):
+        clock = FakeClock()
+        document = CachedDocument(f"{base_url}/.well-known/openid-configuration", clock=clock)
+        document.get()
+
+        clock.now += 500
+        StandInProvider.version = 2
+        # The cached copy is served while the refresh runs
+        assert document.get()['version'] == 1
+        for _ in range(100):
+            if document.get()['version'] == 2:
+                break
+            time.sleep(0.01)
+        assert document.get()['version'] == 2
+
+    run_with_stand_in(test)
+
+
+def test_stale_copy_is_served_when_refresh_fails():
+    def test(base_url):
+        clock = FakeClock()
+        document = CachedDocument(f"{base_url}/.well-known/openid-configuration", clock=clock)
+        document.get()
+
+        clock.now += 700
+        StandInProvider.failing = True
+        assert document.get()['version'] == 1
+
+    run_with_stand_in(test)
+
+
+def test_jwks_follows_discovery():
+    def test(base_url):
+        discovery_url = f"{base_url}/.well-known/openid-configuration"
+
+        assert get_jwks(discovery_url) == {'keys': [{'kid': 'key-1'}]}
+        assert get_jwks(discovery_url) == {'keys': [{'kid': 'key-1'}]}
+        assert StandInProvider.hits == {'/.well-known/openid-configuration': 1, '/keys': 1}
+
+    run_with_stand_in(test)
+
+
+def test_parse_max_age():
+    assert parse_max_age('public, max-age=3600, must-revalidate') == 3600
+    assert parse_max_age('private, max-age=0') == MIN_TTL
+    assert parse_max_age('no-cache') == MIN_TTL
+    assert parse_max_age(None) == DEFAULT_TTL
@@ -0,0 +1,109 @@
+"""
+Tests for the provider rate limiter.
+
+Time is a fake clock and waits are recorded instead of slept, so the token
+buckets' arithmetic can be checked exactly.
+"""
+
+from rate_limiter import RateLimiter, RateLimited, TokenBucket, MIN_RATE_FACTOR
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def make_limiter(clock, waits, rate=10, capacity=20, user_rate=5, user_capacity=10, max_wait=30):
+    def sleep(seconds):
+        waits.append(round(seconds, 6))
+        clock.sleep(seconds)
+    return RateLimiter(rate, capacity, user_rate, user_capacity, max_wait=max_wait, clock=clock, sleep=sleep)
+
+
+def test_bursts_up_to_capacity_then_waits():
+    clock, waits = FakeClock(), []
+    limiter = make_limiter(clock, waits)
+
+    limiter.acquire(cost=20)
+    assert waits == []
+    limiter.acquire(cost=5)
+    assert waits == [0.5]
+
+
+def test_user_buckets_are_separate():
+    clock, waits = FakeClock(), []
+    limiter = make_limiter(clock, waits)
+
+    limiter.acquire('alice', cost=10)
+    limiter.acquire('bob', cost=10)
+    assert waits == []
+    # Alice has used her burst; she waits for her own rate (5/s)
+    limiter.acquire('alice', cost=5)
+    assert waits == [1.0]
+
+
+def test_retry_after_blocks_the_user_and_slows_the_provider():
+    clock, waits = FakeClock(), []
+    limiter = make_limiter(clock, waits)
+
+    limiter.throttled('alice', retry_after=3)
+    limiter.acquire('bob')
+    assert waits == []
+    limiter.acquire('alice')
+    assert waits == [3.0]
+    assert limiter.provider.rate == 5
+
+    for _ in range(100):
+        limiter.succeeded('alice')
+    assert limiter.provider.rate == 10
+
+
+def test_user_quota_signals_leave_the_provider_alone():
+    clock, waits = FakeClock(), []
+    limiter = make_limiter(clock, waits)
+
+    limiter.throttled('alice', retry_after=3, provider_wide=False)
+    assert limiter.provider.rate == 10
+    limiter.acquire('bob')
+    limiter.acquire('alice')
+    assert waits == [3.0]
+
+
+def test_without_a_user_the_provider_is_throttled_once():
+    clock, waits = FakeClock(), []
+    limiter = make_limiter(clock, waits)
+
+    limiter.throttled(retry_after=2)
+    assert limiter.provider.rate == 5
+    limiter.acquire()
+    assert waits == [2.0]
+
+
+def test_rate_never_drops_below_its_floor():
+    bucket = TokenBucket(10, 10, clock=FakeClock())
+    for _ in range(20):
+        bucket.throttle()
+    assert bucket.rate == 10 * MIN_RATE_FACTOR
+
+
+def test_long_waits_raise_without_taking_tokens():
+    clock, waits = FakeClock(), []
+    limiter = make_limiter(clock, waits, max_wait=1)
+    limiter.throttled('alice', retry_after=10)
+
+    try:
+        limiter.acquire('alice', cost=5)
+    except RateLimited as e:
+        assert e.wait == 10
+    else:
+        assert False, "expected RateLimited"
+
+    assert waits == []
+    limiter.acquire('bob', cost=10)
+    assert waits == []
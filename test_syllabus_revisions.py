@@ -0,0 +1,143 @@
+"""
+Tests for the revision store and incremental re-extraction of revised outlines.
+
+Extraction is a stand-in that reports one event per "Quiz on <Month> <day>"
+line and records the text it was given, so the tests can check what was
+re-extracted.
+"""
+
+import os
+import re
+import tempfile
+import threading
+
+import syllabus_revisions
+from syllabus_revisions import RevisionStore, diff_events, extract_course_revision, extract_syllabus_revision
+
+# The opening paragraphs (course, term) are re-extracted with every change, so
+# the first one is long enough to be the only context
+OUTLINE = ("FNCE 674 Winter 2025 " + "Course description. " * 60 +
+           "\n\nQuiz 1 on March 11\n\nQuiz 2 on March 18\n\nReadings are posted weekly")
+
+
+def fake_extract(calls):
+    def extract(jobs):
+        calls.append([text for text, _, _ in jobs])
+        months = {'March': '03', 'April': '04'}
+        return [[{'title': f"Quiz {number}", 'date': f"2025-{months[month]}-{int(day):02d}", 'time': 'during class'}
+                 for number, month, day in re.findall(r'Quiz (\d) on (March|April) (\d+)', text)]
+                for text, _, _ in jobs]
+    return extract
+
+
+def test_store_is_keyed_by_owner_and_course():
+    with tempfile.TemporaryDirectory() as root:
+        store = RevisionStore(root)
+        store.save('user_1', 'FNCE 674', {'paragraph_hashes': ['a'], 'events': []})
+        store.save('user_2', 'FNCE 674', {'paragraph_hashes': ['b'], 'events': []})
+
+        assert store.load('user_1', 'FNCE 674')['paragraph_hashes'] == ['a']
+        assert store.load('user_2', 'FNCE 674')['paragraph_hashes'] == ['b']
+        assert store.load('user_1', 'OBHR 674') is None
+
+
+def test_concurrent_saves_leave_one_whole_file():
+    with tempfile.TemporaryDirectory() as root:
+        store = RevisionStore(root)
+        errors = []
+
+        def save(index):
+            try:
+                store.save('user_1', 'FNCE 674', {'paragraph_hashes': [str(index)] * 500, 'events': []})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=save, args=(index,)) for index in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert len(set(store.load('user_1', 'FNCE 674')['paragraph_hashes'])) == 1
+        assert os.listdir(os.path.join(root, 'user_1')) == ['FNCE_674.json']
+
+
+def test_diff_by_course_and_title():
+    old = [{'title': 'Quiz 1', 'date': '2025-03-11'}, {'title': 'Quiz 2', 'date': '2025-03-18'},
+           {'title': 'Final', 'date': '2025-04-08'}]
+    new = [{'title': 'Quiz 1', 'date': '2025-03-11'}, {'title': 'Quiz 2', 'date': '2025-03-20'},
+           {'title': 'Quiz 3', 'date': '2025-03-25'}]
+
+    delta = diff_events(old, new)
+    assert [event['title'] for event in delta['added']] == ['Quiz 3']
+    assert [(event['title'], event['date']) for event in delta['changed']] == [('Quiz 2', '2025-03-20')]
+    assert [event['title'] for event in delta['removed']] == ['Final']
+
+
+def test_only_changed_paragraphs_are_re_extracted():
+    with tempfile.TemporaryDirectory() as root:
+        store = RevisionStore(root)
+        calls = []
+        events, delta = extract_course_revision('FNCE 674', OUTLINE, [], store, 'user_1', fake_extract(calls))
+        assert len(delta['added']) == 2 and len(calls) == 1
+
+        revised = OUTLINE.replace('March 18', 'March 20')
+        events, delta = extract_course_revision('FNCE 674', revised, [], store, 'user_1', fake_extract(calls))
+        assert 'Quiz 1 on March 11' not in calls[-1][0] and 'Quiz 2 on March 20' in calls[-1][0]
+        assert [(event['title'], event['date']) for event in events] == [('Quiz 1', '2025-03-11'),
+                                                                        ('Quiz 2', '2025-03-20')]
+        assert [event['title'] for event in delta['changed']] == ['Quiz 2']
+
+        # Another owner's first upload is compared with nothing
+        events, delta = extract_course_revision('FNCE 674', revised, [], store, 'user_2', fake_extract(calls))
+        assert len(delta['added']) == 2 and calls[-1] == [revised]
+
+
+def test_unchanged_outline_is_not_extracted():
+    with tempfile.TemporaryDirectory() as root:
+        store = RevisionStore(root)
+        calls = []
+        extract_course_revision('FNCE 674', OUTLINE, [], store, 'user_1', fake_extract(calls))
+        events, delta = extract_course_revision('FNCE 674', OUTLINE, [], store, 'user_1', fake_extract(calls))
+
+        assert len(calls) == 1 and len(events) == 2
+        assert delta == {'added': [], 'changed': [], 'removed': []}
+
+
+def test_new_extractor_version_or_day_re_extracts_everything():
+    version, day = syllabus_revisions.EXTRACTOR_VERSION, syllabus_revisions.extraction_day
+    with tempfile.TemporaryDirectory() as root:
+        store = RevisionStore(root)
+        calls = []
+        try:
+            extract_course_revision('FNCE 674', OUTLINE, [], store, 'user_1', fake_extract(calls))
+
+            syllabus_revisions.EXTRACTOR_VERSION = version + 1
+            events, delta = extract_course_revision('FNCE 674', OUTLINE, [], store, 'user_1', fake_extract(calls))
+            assert calls[-1] == [OUTLINE] and len(calls) == 2
+            assert delta == {'added': [], 'changed': [], 'removed': []}
+
+            revised = OUTLINE.replace('March 18', 'March 20')
+            syllabus_revisions.extraction_day = lambda: '2099-01-01'
+            events, delta = extract_course_revision('FNCE 674', revised, [], store, 'user_1', fake_extract(calls))
+            assert calls[-1] == [revised]
+            assert [event['title'] for event in delta['changed']] == ['Quiz 2']
+        finally:
+            syllabus_revisions.EXTRACTOR_VERSION, syllabus_revisions.extraction_day = version, day
+
+
+def test_changed_courses_of_a_pack_are_extracted_together():
+    pack = "\n\n".join(OUTLINE.replace("FNCE 674", code) + f"\n\n{code} footer\n\n{code} footer"
+                       for code in ("FNCE 674", "OBHR 674", "SGMA 672"))
+    with tempfile.TemporaryDirectory() as root:
+        store = RevisionStore(root)
+        calls = []
+        events, delta = extract_syllabus_revision(pack, [], store, 'user_1', fake_extract(calls))
+        assert [len(texts) for texts in calls] == [3]
+        assert {event['course'] for event in events} == {"FNCE 674", "OBHR 674", "SGMA 672"}
+
+        revised = pack.replace("Quiz 2 on March 18", "Quiz 2 on March 20", 1)
+        events, delta = extract_syllabus_revision(revised, [], store, 'user_1', fake_extract(calls))
+        assert [len(texts) for texts in calls] == [3, 1]
+        assert [(event['course'], event['date']) for event in delta['changed']] == [("FNCE 674", '2025-03-20')]
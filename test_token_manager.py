@@ -0,0 +1,157 @@
+"""
+Tests for the OAuth token manager.
+
+Users are plain objects and the provider is a refresh function that counts
+its calls, so expiry, single-flight refresh and write-back can be checked
+without a database or network.
+"""
+
+import json
+import threading
+import time
+
+from token_manager import TokenManager, TokenRefreshError, with_expiry, REFRESH_MARGIN
+
+
+class FakeUser:
+    def __init__(self, user_id, token_data=None):
+        self.id = user_id
+        self.google_token = json.dumps(token_data) if token_data else None
+
+
+class FakeProvider:
+    def __init__(self, delay=0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.saved = []
+
+    def refresh(self, refresh_token):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise TokenRefreshError("invalid_grant")
+        return {'access_token': f"access-{self.calls}", 'expires_in': 3599}
+
+    def save(self, user_id, attribute, token_json):
+        self.saved.append((user_id, attribute, json.loads(token_json)))
+
+
+def make_manager(provider):
+    return TokenManager('Google', 'google_token', provider.refresh, provider.save)
+
+
+def test_fresh_tokens_are_not_refreshed():
+    provider = FakeProvider()
+    user = FakeUser(1, with_expiry({'access_token': 'access-0', 'refresh_token': 'r', 'expires_in': 3599}))
+
+    assert make_manager(provider).get_access_token(user) == ('access-0', None)
+    assert provider.calls == 0
+
+
+def test_tokens_near_expiry_are_refreshed_and_stored():
+    provider = FakeProvider()
+    manager = make_manager(provider)
+    user = FakeUser(1, {'access_token': 'access-0', 'refresh_token': 'r',
+                        'expires_at': time.time() + REFRESH_MARGIN - 10})
+
+    assert manager.get_access_token(user) == ('access-1', None)
+    stored = json.loads(user.google_token)
+    assert stored['refresh_token'] == 'r'
+    assert stored['expires_at'] > time.time() + 3000
+    assert provider.saved == [(1, 'google_token', stored)]
+
+
+def test_tokens_that_cannot_be_saved_are_still_used():
+    provider = FakeProvider()
+
+    def save(user_id, attribute, token_json):
+        raise ConnectionError("database is locked")
+
+    manager = TokenManager('Google', 'google_token', provider.refresh, save)
+    user = FakeUser(1, {'access_token': 'access-0', 'refresh_token': 'r', 'expires_at': time.time() - 1})
+
+    assert manager.get_access_token(user) == ('access-1', None)
+    assert manager.get_access_token(FakeUser(1, json.loads(user.google_token))) == ('access-1', None)
+    assert provider.calls == 1
+
+
+def test_relative_expiry_is_treated_as_expired():
+    # Tokens once stored expires_in (e.g. 3599) as expires_at
+    provider = FakeProvider()
+    user = FakeUser(1, {'access_token': 'access-0', 'refresh_token': 'r', 'expires_at': 3599})
+
+    assert make_manager(provider).get_access_token(user) == ('access-1', None)
+
+
+def test_concurrent_requests_share_one_refresh():
+    provider = FakeProvider(delay=0.2)
+    manager = make_manager(provider)
+    expired = {'access_token': 'access-0', 'refresh_token': 'r', 'expires_at': time.time() - 1}
+    # Each request has its own copy of the user, as with separate sessions
+    users = [FakeUser(1, expired) for _ in range(8)]
+    results = []
+
+    threads = [threading.Thread(target=lambda user=user: results.append(manager.get_access_token(user)))
+               for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert provider.calls == 1
+    assert len(provider.saved) == 1
+    assert results == [('access-1', None)] * 8
+
+
+def test_rejected_tokens_are_replaced_once():
+    provider = FakeProvider()
+    manager = make_manager(provider)
+    user = FakeUser(1, with_expiry({'access_token': 'access-0', 'refresh_token': 'r', 'expires_in': 3599}))
+
+    assert manager.get_access_token(user, rejected='access-0') == ('access-1', None)
+    # A second request that saw the same rejection gets the new token
+    assert manager.get_access_token(user, rejected='access-0') == ('access-1', None)
+    assert provider.calls == 1
+
+
+def test_sign_in_without_a_refresh_token_keeps_the_stored_one():
+    manager = make_manager(FakeProvider())
+    user = FakeUser(1, with_expiry({'access_token': 'access-0', 'refresh_token': 'r', 'expires_in': 3599}))
+
+    manager.store(user, {'access_token': 'access-1', 'expires_in': 3599})
+    assert json.loads(user.google_token)['refresh_token'] == 'r'
+    assert manager.has_refresh_token(user)
+
+    assert not manager.has_refresh_token(FakeUser(2))
+    new_user = FakeUser(3)
+    manager.store(new_user, {'access_token': 'access-1', 'expires_in': 3599})
+    assert not manager.has_refresh_token(new_user)
+
+
+def test_cleared_tokens_are_not_handed_out():
+    provider = FakeProvider()
+    manager = make_manager(provider)
+    user = FakeUser(1, {'access_token': 'access-0', 'refresh_token': 'r', 'expires_at': time.time() - 1})
+    assert manager.get_access_token(user) == ('access-1', None)
+
+    # Signed out in this process, or in another one whose change this user object has loaded
+    manager.clear(user)
+    assert user.google_token is None
+    assert manager.get_access_token(user) == (None, "User not authenticated with Google")
+
+    manager.get_access_token(FakeUser(2, {'access_token': 'access-0', 'refresh_token': 'r', 'expires_at': 0}))
+    assert manager.get_access_token(FakeUser(2)) == (None, "User not authenticated with Google")
+    assert provider.calls == 2
+
+
+def test_refresh_failures():
+    user = FakeUser(1, {'access_token': 'access-0', 'refresh_token': 'r', 'expires_at': 0})
+    assert make_manager(FakeProvider(fail=True)).get_access_token(user) == \
+        (None, "Failed to refresh token, please log in again")
+
+    user = FakeUser(2, {'access_token': 'access-0', 'expires_at': 0})
+    assert make_manager(FakeProvider()).get_access_token(user) == (None, "No refresh token available")
+
+    assert make_manager(FakeProvider()).get_access_token(FakeUser(3)) == \
+        (None, "User not authenticated with Google")
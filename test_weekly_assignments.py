@@ -0,0 +1,25 @@
+"""
+Tests for the recurring event added for weekly work.
+"""
+
+from syllabus_extractor import handle_weekly_assignments
+
+TEXT = "Weekly assignments are due following each class."
+
+
+def weekly_event(events):
+    return [event for event in handle_weekly_assignments(TEXT, events) if event.get('recurrence')][0]
+
+
+def test_rule_starts_and_ends_on_held_weeks():
+    events = [{'title': 'Quiz 1', 'date': '2025-03-04'}, {'title': 'Midterm', 'date': '2025-03-18'},
+              {'title': 'Final', 'date': '2025-04-08'}]
+
+    event = weekly_event(events)
+    assert event['date'] == '2025-03-11'
+    assert event['recurrence'] == {'frequency': 'weekly', 'until': '2025-04-01', 'exdates': ['2025-03-18']}
+
+
+def test_no_rule_when_every_week_is_taken():
+    events = [{'title': 'Quiz 1', 'date': '2025-03-04'}, {'title': 'Quiz 2', 'date': '2025-03-11'}]
+    assert not any(event.get('recurrence') for event in handle_weekly_assignments(TEXT, events))
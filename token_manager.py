@@ -0,0 +1,190 @@
+"""
+Token Manager Module
+
+This module keeps users' OAuth tokens for a provider. Tokens are stored with
+an absolute expiry ("expires_at", a Unix timestamp) and refreshed shortly
+before they expire, so calendar pushes never start with a dead token.
+Requests that need the same user's token while it is being refreshed wait
+for that one refresh instead of starting their own, and the new token is
+written back to the user once, outside the caller's transaction.
+"""
+
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Tokens expiring within this many seconds are refreshed before use
+REFRESH_MARGIN = 300
+
+# Lifetime assumed when a token response has no expires_in
+DEFAULT_EXPIRES_IN = 3600
+
+# Refresh locks shared out among users; users whose ids share a lock only
+# wait for each other's refreshes
+REFRESH_LOCKS = 64
+
+
+class TokenRefreshError(Exception):
+    """Raised by a refresh function when the provider rejects a refresh."""
+
+
+def with_expiry(token_data, now=None):
+    """
+    Give a token response an absolute expiry.
+
+    Args:
+        token_data (dict): Token response from the provider
+        now (float): Current Unix time (optional)
+
+    Returns:
+        dict: The token with "expires_at" set from "expires_in"
+    """
+    token_data = dict(token_data)
+    now = time.time() if now is None else now
+    token_data['expires_at'] = now + int(token_data.get('expires_in') or DEFAULT_EXPIRES_IN)
+    return token_data
+
+
+class TokenManager:
+    """
+    Access tokens of one provider, refreshed proactively and single-flight.
+    """
+
+    def __init__(self, provider, attribute, refresh, save, margin=REFRESH_MARGIN, clock=time.time):
+        """
+        Args:
+            provider (str): Provider name used in messages ("Google", "Microsoft")
+            attribute (str): User attribute holding the token JSON
+            refresh (callable): Takes a refresh token and returns the new token
+                response; raises TokenRefreshError if the provider refuses
+            save (callable): Writes a refreshed token given the user id, the
+                attribute and the token JSON, without committing the
+                caller's transaction (a refresh can happen mid-push)
+            margin (int): Seconds before expiry at which tokens are refreshed
+            clock (callable): Returns the current Unix time
+        """
+        self.provider = provider
+        self.attribute = attribute
+        self._refresh = refresh
+        self._save = save
+        self.margin = margin
+        self._clock = clock
+        # Latest token per user id, shared by the threads of this process
+        self._tokens = {}
+        self._locks = [threading.Lock() for _ in range(REFRESH_LOCKS)]
+        self._guard = threading.Lock()
+
+    def store(self, user, token_data):
+        """
+        Store a new token response for a user (the caller commits).
+
+        Providers only send a refresh token with some responses (Google with
+        the consent screen), so a response without one keeps the user's
+        stored refresh token.
+
+        Args:
+            user: The user
+            token_data (dict): Token response from the provider
+        """
+        token_data = with_expiry(token_data, self._clock())
+        if not token_data.get('refresh_token'):
+            current = self._current_token(user)
+            if current and current.get('refresh_token'):
+                token_data['refresh_token'] = current['refresh_token']
+        setattr(user, self.attribute, json.dumps(token_data))
+        if user.id is not None:
+            with self._guard:
+                self._tokens[user.id] = token_data
+
+    def clear(self, user):
+        """
+        Forget a user's token, e.g. when they sign out (the caller commits).
+
+        Args:
+            user: The user
+        """
+        setattr(user, self.attribute, None)
+        self._forget(user.id)
+
+    def has_refresh_token(self, user):
+        """Check whether a user's stored token can be refreshed."""
+        token_data = self._current_token(user)
+        return bool(token_data and token_data.get('refresh_token'))
+
+    def get_access_token(self, user, rejected=None):
+        """
+        Get a user's access token, refreshing it if it is about to expire.
+
+        Args:
+            user: The user
+            rejected (str): An access token the provider has just rejected;
+                it is refreshed even if it has not expired (optional)
+
+        Returns:
+            tuple: (access_token, error) where error is None on success and a
+                   message (with access_token None) otherwise
+        """
+        token_data = self._current_token(user)
+        if token_data is None:
+            return None, f"User not authenticated with {self.provider}"
+        if self._is_usable(token_data, rejected):
+            return token_data.get('access_token'), None
+
+        with self._lock_for(user.id):
+            # Another request may have refreshed or cleared it while we waited
+            token_data = self._current_token(user)
+            if token_data is None:
+                return None, f"User not authenticated with {self.provider}"
+            if self._is_usable(token_data, rejected):
+                return token_data.get('access_token'), None
+
+            refresh_token = token_data.get('refresh_token')
+            if not refresh_token:
+                return None, "No refresh token available"
+            try:
+                new_token_data = self._refresh(refresh_token)
+            except TokenRefreshError:
+                return None, "Failed to refresh token, please log in again"
+            except Exception as e:
+                return None, f"Could not connect to {self.provider}: {str(e)}"
+
+            self.store(user, new_token_data)
+            try:
+                self._save(user.id, self.attribute, getattr(user, self.attribute))
+            except Exception as e:
+                # The token is still cached for this process
+                logger.warning(f"Could not save refreshed {self.provider} token of user {user.id}: {str(e)}")
+            logger.info(f"Refreshed {self.provider} token of user {user.id}")
+            return new_token_data.get('access_token'), None
+
+    def _current_token(self, user):
+        try:
+            stored = json.loads(getattr(user, self.attribute) or 'null')
+        except ValueError:
+            stored = None
+        if stored is None:
+            # Signed out or disconnected, perhaps in another process
+            self._forget(user.id)
+            return None
+        with self._guard:
+            cached = self._tokens.get(user.id)
+        # The user object may have been loaded before another request's refresh
+        if cached is not None and cached.get('expires_at', 0) > (stored.get('expires_at') or 0):
+            return cached
+        return stored
+
+    def _is_usable(self, token_data, rejected):
+        if rejected is not None and token_data.get('access_token') == rejected:
+            return False
+        expires_at = token_data.get('expires_at')
+        return expires_at is None or expires_at - self.margin > self._clock()
+
+    def _forget(self, user_id):
+        with self._guard:
+            self._tokens.pop(user_id, None)
+
+    def _lock_for(self, user_id):
+        return self._locks[hash(user_id) % len(self._locks)]